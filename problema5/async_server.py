@@ -0,0 +1,377 @@
+import asyncio
+import contextlib
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from protocol import FileTransferProtocol, SegmentWriter
+from file_handler import FileHandler
+import commands
+
+class AsyncFileServer:
+    """Servidor del mismo protocolo sobre asyncio: una corrutina por conexión y
+    un pool acotado de hilos para el disco, en lugar de un hilo por cliente"""
+    
+    # Comandos que transfieren datos y ocupan un cupo de transferencia
+    TRANSFER_COMMANDS = (
+        FileTransferProtocol.CMD_UPLOAD, FileTransferProtocol.CMD_DOWNLOAD,
+        FileTransferProtocol.CMD_RESUME, FileTransferProtocol.CMD_RANGE,
+        FileTransferProtocol.CMD_SIGNATURES, FileTransferProtocol.CMD_DELTA
+    )
+    
+    def __init__(self, host='localhost', port=9000, base_directory='shared_files',
+                 backlog=1024, max_transfers=64, max_transfers_per_client=4, io_workers=16):
+        self.host = host
+        self.port = port
+        self.file_handler = FileHandler(base_directory)
+        self.backlog = backlog                                    # Conexiones pendientes de accept
+        self.max_transfers = max_transfers                        # Transferencias simultáneas en total
+        self.max_transfers_per_client = max_transfers_per_client  # Transferencias simultáneas por IP
+        self.io_workers = io_workers                              # Hilos para lectura/escritura en disco
+        self.client_slots = {}  # IP -> [semáforo, conexiones abiertas]
+        self.running = False
+    
+    def start(self):
+        """Inicia el servidor"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\nDeteniendo servidor...")
+        self.running = False
+    
+    async def serve(self):
+        """Acepta conexiones hasta que se detenga el loop"""
+        self.loop = asyncio.get_running_loop()
+        self.transfer_slots = asyncio.Semaphore(self.max_transfers)
+        with ThreadPoolExecutor(self.io_workers) as self.executor:
+            server = await asyncio.start_server(
+                self.handle_client, self.host, self.port, backlog=self.backlog
+            )
+            self.port = server.sockets[0].getsockname()[1]  # Puerto real si se pidió el 0
+            
+            print(f"Servidor asíncrono escuchando en {self.host}:{self.port}")
+            self.running = True
+            
+            async with server:
+                await server.serve_forever()
+    
+    def run_io(self, function, *args):
+        """Ejecuta una operación de disco en el pool de hilos"""
+        return self.loop.run_in_executor(self.executor, function, *args)
+    
+    @contextlib.asynccontextmanager
+    async def transfer_slot(self, client_ip):
+        """Espera un cupo del cliente y luego uno global antes de transferir"""
+        async with self.client_slots[client_ip][0]:
+            async with self.transfer_slots:
+                yield
+    
+    async def handle_client(self, reader, writer):
+        """Maneja la comunicación con un cliente"""
+        address = writer.get_extra_info('peername')
+        client_ip = address[0]
+        slots = self.client_slots.setdefault(
+            client_ip, [asyncio.Semaphore(self.max_transfers_per_client), 0]
+        )
+        slots[1] += 1
+        # Capacidades negociadas con HELO para esta conexión
+        session = commands.new_session()
+        try:
+            while True:
+                # Recibir header (EOF limpio entre comandos = el cliente se fue)
+                try:
+                    header = await reader.readexactly(FileTransferProtocol.HEADER_SIZE)
+                except asyncio.IncompleteReadError:
+                    break
+                
+                command, data_size, checksum = FileTransferProtocol.parse_header(header)
+                if command == FileTransferProtocol.CMD_END:
+                    break
+                
+                if command in self.TRANSFER_COMMANDS:
+                    async with self.transfer_slot(client_ip):
+                        await self.handle_command(reader, writer, header, session)
+                else:
+                    await self.handle_command(reader, writer, header, session)
+        
+        except Exception as e:
+            print(f"Error con cliente {address}: {e}")
+        finally:
+            slots[1] -= 1
+            if slots[1] == 0:
+                del self.client_slots[client_ip]
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+    
+    async def handle_command(self, reader, writer, header, session):
+        """Despacha un comando versión 1 o completa el header y despacha uno versión 2"""
+        command, data_size, checksum = FileTransferProtocol.parse_header(header)
+        
+        if command in FileTransferProtocol.V2_COMMANDS:
+            # Completar el header versión 2
+            header += await reader.readexactly(
+                FileTransferProtocol.HEADER_V2_SIZE - FileTransferProtocol.HEADER_SIZE
+            )
+            await self.handle_v2_command(reader, writer, header, session)
+        elif command == FileTransferProtocol.CMD_UPLOAD:
+            await self.handle_upload(reader, writer, data_size, checksum)
+        elif command == FileTransferProtocol.CMD_DOWNLOAD:
+            await self.handle_download(reader, writer)
+        elif command == FileTransferProtocol.CMD_LIST:
+            await self.handle_list(writer)
+    
+    async def handle_v2_command(self, reader, writer, header, session):
+        """Despacha los comandos que usan el header versión 2"""
+        command, flags, data_size, offset, checksum, algorithm = FileTransferProtocol.parse_header_v2(header)
+        
+        if command == FileTransferProtocol.CMD_HELLO:
+            await self.handle_hello(reader, writer, data_size, session)
+        elif command == FileTransferProtocol.CMD_RESUME:
+            await self.handle_resume(reader, writer, flags, data_size, offset, checksum, algorithm)
+        elif command == FileTransferProtocol.CMD_RANGE:
+            await self.handle_range(reader, writer, flags, data_size, offset, session)
+        elif command == FileTransferProtocol.CMD_SIGNATURES:
+            await self.handle_signatures(reader, writer)
+        elif command == FileTransferProtocol.CMD_DELTA:
+            await self.handle_delta(reader, writer, data_size, checksum, algorithm)
+        elif command == FileTransferProtocol.CMD_LIST_PAGE:
+            await self.handle_list_page(reader, writer, data_size)
+        else:
+            raise ValueError("Versión de protocolo no soportada")
+    
+    async def send(self, writer, data):
+        """Envía datos respetando el control de flujo del transporte"""
+        writer.write(data)
+        await writer.drain()
+    
+    async def send_error(self, writer, error):
+        """Envía un error con header versión 1"""
+        await self.send(writer, commands.error_reply(error))
+    
+    async def send_error_v2(self, writer, error):
+        """Envía un error con header versión 2"""
+        await self.send(writer, commands.error_reply_v2(error))
+    
+    async def receive_filename(self, reader):
+        """Recibe el nombre de archivo precedido por su longitud"""
+        filename_size = struct.unpack('!I', await reader.readexactly(4))[0]
+        return (await reader.readexactly(filename_size)).decode()
+    
+    async def recv_segment(self, reader, segment_writer, size):
+        """Recibe size bytes en bloques y los escribe (y hashea) en el pool de hilos"""
+        remaining = size
+        while remaining > 0:
+            chunk = await reader.readexactly(min(FileTransferProtocol.STREAM_BUFFER_SIZE, remaining))
+            await self.run_io(segment_writer.write, chunk)
+            remaining -= len(chunk)
+    
+    async def recv_compressed_segment(self, reader, segment_writer):
+        """Recibe frames comprimidos y los descomprime y escribe en el pool de hilos"""
+        while True:
+            length = struct.unpack('!I', await reader.readexactly(4))[0]
+            if length == 0:
+                break
+            await self.run_io(segment_writer.write_compressed, await reader.readexactly(length))
+        segment_writer.finish()
+    
+    async def send_file_range(self, writer, f, size, offset):
+        """Envía un rango del archivo con sendfile del loop (sin pasar por Python); un archivo
+        del block store se envía bloque por bloque"""
+        if not size:
+            return
+        ranges = getattr(f, 'ranges', None)
+        if ranges is None:
+            await self.loop.sendfile(writer.transport, f, offset, size)
+            return
+        for path, block_offset, length in ranges(offset, size):
+            with open(path, 'rb') as block:
+                await self.loop.sendfile(writer.transport, block, block_offset, length)
+    
+    @staticmethod
+    def read_compressed(compressor, f, size, offset):
+        """Lee y comprime un bloque del archivo; con size 0 vacía el compresor"""
+        if size == 0:
+            return compressor.flush()
+        data = FileTransferProtocol.pread(f, size, offset)
+        if len(data) != size:
+            raise IOError("El archivo es más corto de lo esperado")
+        return compressor.compress(data)
+    
+    async def send_compressed_range(self, writer, f, size, offset, codec, level):
+        """Envía un rango comprimido como frames [4 bytes largo + datos], terminando en 0"""
+        compressor = FileTransferProtocol.new_compressor(codec, level)
+        end_offset = offset + size
+        while True:
+            length = min(FileTransferProtocol.STREAM_BUFFER_SIZE, end_offset - offset)
+            compressed = await self.run_io(self.read_compressed, compressor, f, length, offset)
+            if compressed:
+                await self.send(writer, struct.pack('!I', len(compressed)) + compressed)
+            if length == 0:
+                break
+            offset += length
+        await self.send(writer, struct.pack('!I', 0))
+    
+    async def handle_hello(self, reader, writer, data_size, session):
+        """Negocia las capacidades de la conexión (compresión y nivel)"""
+        try:
+            payload = await reader.readexactly(data_size)
+            await self.send(writer, commands.hello(payload, session))
+        
+        except Exception as e:
+            await self.send_error_v2(writer, e)
+    
+    async def handle_upload(self, reader, writer, data_size, expected_checksum):
+        """Maneja subida de archivos"""
+        temp_path = None
+        try:
+            filename = await self.receive_filename(reader)
+            
+            # Recibir datos directo a un temporal, calculando el checksum
+            hasher = FileTransferProtocol.new_checksum()
+            temp_file, temp_path = await self.run_io(self.file_handler.open_temp_file, filename)
+            with temp_file:
+                await self.recv_segment(
+                    reader, SegmentWriter(temp_file.fileno(), data_size, 0, hasher=hasher), data_size
+                )
+            
+            # Verificar checksum
+            if FileTransferProtocol.finish_checksum(hasher) != expected_checksum:
+                raise ValueError("Checksum no coincide")
+            
+            # Publicar el archivo de forma atómica (el índice guarda el MD5 ya calculado)
+            await self.run_io(self.file_handler.commit_temp_file, temp_path, filename, hasher.md5_hexdigest())
+            temp_path = None
+            
+            await self.send(writer, FileTransferProtocol.create_header(FileTransferProtocol.CMD_ACK))
+            print(f"Archivo {filename} recibido exitosamente")
+        
+        except Exception as e:
+            await self.send_error(writer, e)
+        finally:
+            if temp_path:
+                await self.run_io(self.file_handler.discard_temp_file, temp_path)
+    
+    async def handle_download(self, reader, writer):
+        """Maneja descarga de archivos"""
+        try:
+            filename = await self.receive_filename(reader)
+            
+            with await self.run_io(commands.open_shared_file, self.file_handler, filename) as f:
+                # Checksum desde el índice; solo se relee el archivo si cambió
+                file_size = FileTransferProtocol.file_stat(f).st_size
+                checksum = await self.run_io(self.file_handler.get_file_checksum, filename, f)
+                
+                await self.send(writer, FileTransferProtocol.create_header(
+                    FileTransferProtocol.CMD_DATA, file_size, checksum
+                ))
+                await self.send_file_range(writer, f, file_size, 0)
+            
+            print(f"Archivo {filename} enviado exitosamente")
+        
+        except Exception as e:
+            await self.send_error(writer, e)
+    
+    async def handle_resume(self, reader, writer, flags, data_size, offset, expected_checksum, algorithm):
+        """Maneja un segmento de una subida reanudable"""
+        try:
+            filename = await self.receive_filename(reader)
+            
+            # Consulta: retorna cuánto tiene ya el archivo parcial
+            if flags & FileTransferProtocol.FLAG_QUERY:
+                await self.send(writer, await self.run_io(commands.resume_query, self.file_handler, filename))
+                return
+            
+            fd = await self.run_io(commands.open_resume_segment, self.file_handler, filename)
+            try:
+                hasher = FileTransferProtocol.new_checksum(algorithm)
+                codec = FileTransferProtocol.codec_from_flags(flags)
+                segment_writer = SegmentWriter(fd, data_size, offset, codec, hasher)
+                if codec:
+                    await self.recv_compressed_segment(reader, segment_writer)
+                else:
+                    await self.recv_segment(reader, segment_writer, data_size)
+                ack = await self.run_io(
+                    commands.finish_resume_segment,
+                    self.file_handler, fd, filename, flags, offset, data_size, hasher, expected_checksum
+                )
+            finally:
+                os.close(fd)
+            await self.send(writer, ack)
+        
+        except Exception as e:
+            await self.send_error_v2(writer, e)
+    
+    async def handle_range(self, reader, writer, flags, data_size, offset, session):
+        """Maneja la descarga de un rango del archivo"""
+        try:
+            filename = await self.receive_filename(reader)
+            with await self.run_io(commands.open_shared_file, self.file_handler, filename) as f:
+                header, length, codec = await self.run_io(
+                    commands.plan_range, self.file_handler, f, filename, flags, data_size, offset, session
+                )
+                await self.send(writer, header)
+                if codec:
+                    await self.send_compressed_range(writer, f, length, offset, codec, session['level'])
+                else:
+                    await self.send_file_range(writer, f, length, offset)
+        
+        except Exception as e:
+            await self.send_error_v2(writer, e)
+    
+    async def handle_signatures(self, reader, writer):
+        """Envía las firmas de bloques del archivo actual para una sincronización delta"""
+        try:
+            filename = await self.receive_filename(reader)
+            await self.send(writer, await self.run_io(commands.signatures, self.file_handler, filename))
+        
+        except Exception as e:
+            await self.send_error_v2(writer, e)
+    
+    async def handle_delta(self, reader, writer, data_size, expected_checksum, algorithm):
+        """Reconstruye un archivo a partir de bloques existentes y datos nuevos"""
+        stream = None
+        try:
+            filename = await self.receive_filename(reader)
+            stream = await self.run_io(commands.start_delta, self.file_handler, filename, algorithm)
+            while stream.needed:
+                data = await reader.readexactly(stream.needed)
+                # Solo COPY y LITERAL tocan el disco; el resto se interpreta en el loop
+                if stream.writes:
+                    await self.run_io(stream.feed, data)
+                else:
+                    stream.feed(data)
+            
+            ack = await self.run_io(stream.finish, filename, data_size, expected_checksum)
+            stream = None
+            await self.send(writer, ack)
+        
+        except Exception as e:
+            await self.send_error_v2(writer, e)
+        finally:
+            if stream:
+                await self.run_io(stream.abort)
+    
+    async def handle_list(self, writer):
+        """Maneja listado de archivos"""
+        try:
+            files = await self.run_io(self.file_handler.list_files)
+            file_list = "\n".join(files).encode()
+            
+            header = FileTransferProtocol.create_header(FileTransferProtocol.CMD_DATA, len(file_list))
+            await self.send(writer, header + file_list)
+        
+        except Exception as e:
+            await self.send_error(writer, e)
+    
+    async def handle_list_page(self, reader, writer, data_size):
+        """Maneja una página del listado paginado"""
+        try:
+            payload = await reader.readexactly(data_size)
+            await self.send(writer, await self.run_io(commands.list_page, self.file_handler, payload))
+        
+        except Exception as e:
+            await self.send_error_v2(writer, e)
+
+if __name__ == "__main__":
+    server = AsyncFileServer()
+    server.start()
@@ -0,0 +1,331 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from server import FileServer
+from async_server import AsyncFileServer
+from client import FileClient
+
+SERVER_CLASSES = {'threads': FileServer, 'asyncio': AsyncFileServer}
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def start_server(base_directory, server_class=FileServer):
+    """Inicia un servidor en loopback (puerto libre) en un hilo aparte"""
+    server = server_class('127.0.0.1', 0, base_directory)
+    server_thread = threading.Thread(target=server.start)
+    server_thread.daemon = True
+    server_thread.start()
+    while not server.running:
+        time.sleep(0.01)
+    return server
+
+def usage_report(who):
+    """CPU y pico de memoria residente del proceso who (RUSAGE_SELF o RUSAGE_CHILDREN)"""
+    usage = resource.getrusage(who)
+    return {'cpu_user_s': usage.ru_utime, 'cpu_system_s': usage.ru_stime, 'peak_rss_mb': usage.ru_maxrss / 1024}
+
+def serve(base_directory, server_name):
+    """Modo --serve: corre el servidor en este proceso y atiende comandos de control por stdin
+    ('refresh' o 'usage'); cada respuesta es una línea JSON en stdout. Termina con EOF"""
+    control = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # La salida del servidor no debe mezclarse con el control
+    server = start_server(base_directory, SERVER_CLASSES[server_name])
+    control.write(f"{server.port}\n")
+    control.flush()
+    for line in sys.stdin:
+        if line.strip() == 'refresh':
+            server.file_handler.index.refresh()
+            reply = {}
+        else:
+            reply = usage_report(resource.RUSAGE_SELF)
+        control.write(json.dumps(reply) + "\n")
+        control.flush()
+
+class ServerProcess:
+    """Servidor en un proceso aparte: su CPU y su memoria se miden sin las de los clientes"""
+    
+    def __init__(self, base_directory, server_name='threads'):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', base_directory, '--server', server_name],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        self.port = int(self.process.stdout.readline())
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.process.stdin.close()
+        self.process.wait()
+    
+    def command(self, name):
+        """Envía un comando de control y retorna la respuesta"""
+        self.process.stdin.write(name + "\n")
+        self.process.stdin.flush()
+        return json.loads(self.process.stdout.readline())
+    
+    def refresh(self):
+        """Reindexa el directorio compartido (tras crear archivos por fuera del servidor)"""
+        self.command('refresh')
+    
+    def usage(self):
+        """CPU acumulada y pico de memoria del proceso servidor"""
+        return self.command('usage')
+
+def create_test_file(path, size_mb):
+    """Crea un archivo de prueba con datos aleatorios"""
+    create_sized_file(path, size_mb * 1024 * 1024)
+
+def create_sized_file(path, size):
+    """Crea un archivo de size bytes con datos aleatorios"""
+    block = os.urandom(min(size, 1024 * 1024))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+def parse_size(text):
+    """Convierte '1K', '64M' o '1G' a bytes"""
+    text = text.strip().upper()
+    if text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(size):
+    """Tamaño legible con la unidad más grande que lo divide"""
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+def percentile(sorted_values, fraction):
+    """Percentil por rango más cercano de una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def link_or_copy(source, destination):
+    """Enlaza destination a source sin copiar datos; copia si el sistema no admite hard links"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def timed(operation):
+    """Ejecuta una operación silenciando su salida y retorna los segundos que tardó"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = operation()
+    elapsed = time.perf_counter() - start
+    if not ok:
+        raise RuntimeError("La transferencia falló")
+    return elapsed
+
+def benchmark_streams(size_mb, stream_counts):
+    """Compara subida y descarga con distinta cantidad de streams en loopback"""
+    with tempfile.TemporaryDirectory() as workdir, ServerProcess(os.path.join(workdir, 'shared')) as server:
+        source = os.path.join(workdir, 'origen.bin')
+        create_test_file(source, size_mb)
+        
+        client = FileClient('127.0.0.1', server.port)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.connect()
+        
+        print(f"Archivo de {size_mb} MB, bloques de 4 MB")
+        print(f"{'streams':>8} {'subida MB/s':>12} {'descarga MB/s':>14}")
+        for streams in stream_counts:
+            destination = os.path.join(workdir, f'destino_{streams}.bin')
+            upload = timed(lambda: client.upload_file_parallel(source, streams))
+            download = timed(lambda: client.download_file_parallel('origen.bin', destination, streams))
+            print(f"{streams:>8} {size_mb / upload:>12.1f} {size_mb / download:>14.1f}")
+            os.remove(destination)
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.disconnect()
+
+def bench_name(size, worker_id):
+    """Nombre del archivo que sube o descarga cada cliente"""
+    return f"bench_{format_size(size)}_{worker_id}.bin"
+
+def run_scenario(server, operation, size, concurrency, iterations, workdir, source):
+    """Ejecuta iterations operaciones por cliente con concurrency clientes y mide cada una;
+    la CPU se mide por separado en el proceso servidor y en este (los clientes)"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    
+    def worker(worker_id):
+        client = FileClient('127.0.0.1', server.port)
+        client.connect()
+        # Cada cliente sube/descarga su propio nombre para no pisarse (los de descarga
+        # ya están en el servidor: los deja benchmark_suite)
+        name = bench_name(size, worker_id)
+        local_path = os.path.join(workdir, name)
+        if operation == 'upload' and not os.path.exists(local_path):
+            link_or_copy(source, local_path)
+        destination = os.path.join(workdir, f"descarga_{worker_id}.bin")
+        
+        for _ in range(iterations):
+            start = time.perf_counter()
+            try:
+                if operation == 'upload':
+                    ok = client.upload_file(local_path)
+                elif operation == 'download':
+                    ok = client.download_file(name, destination)
+                else:
+                    ok = sum(1 for _ in client.iter_files()) >= 0
+            except Exception as e:
+                ok = False
+                print(f"Error en {operation}: {e}")
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(elapsed)
+        client.disconnect()
+        if os.path.exists(destination):
+            os.remove(destination)
+    
+    server_before = server.usage()
+    client_before = usage_report(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall_time = time.perf_counter() - start
+    client_after = usage_report(resource.RUSAGE_SELF)
+    server_after = server.usage()
+    
+    latencies.sort()
+    transferred = size * len(latencies) if operation != 'list' else 0
+    return {
+        'operation': operation,
+        'size': size,
+        'concurrency': concurrency,
+        'operations': len(latencies),
+        'errors': len(errors),
+        'wall_time_s': wall_time,
+        'throughput_mb_s': transferred / (1024 * 1024) / wall_time if wall_time else 0.0,
+        'ops_per_s': len(latencies) / wall_time if wall_time else 0.0,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'server_cpu_user_s': server_after['cpu_user_s'] - server_before['cpu_user_s'],
+        'server_cpu_system_s': server_after['cpu_system_s'] - server_before['cpu_system_s'],
+        'client_cpu_user_s': client_after['cpu_user_s'] - client_before['cpu_user_s'],
+        'client_cpu_system_s': client_after['cpu_system_s'] - client_before['cpu_system_s'],
+        # Picos desde que arrancó cada proceso: no bajan entre escenarios
+        'server_peak_rss_mb': server_after['peak_rss_mb'],
+        'client_peak_rss_mb': client_after['peak_rss_mb']
+    }
+
+def benchmark_suite(server_name, sizes, concurrencies, operations, iterations, list_files):
+    """Corre subidas, descargas y LIST contra un servidor en loopback y retorna los resultados"""
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        shared = os.path.join(workdir, 'shared')
+        with ServerProcess(shared, server_name) as server:
+            # Archivos extra para que LIST tenga algo que paginar
+            for i in range(list_files):
+                with open(os.path.join(shared, f"lista_{i:06d}.txt"), 'wb') as f:
+                    f.write(b'x')
+            server.refresh()
+            
+            print(f"Servidor {server_name}, {iterations} operaciones por cliente")
+            print(f"{'operación':>10} {'tamaño':>7} {'clientes':>8} {'MB/s':>9} {'ops/s':>9} "
+                  f"{'p50 ms':>9} {'p99 ms':>9} {'CPU srv':>7} {'CPU cli':>7} {'RSS srv':>7} {'errores':>7}")
+            print("(CPU en segundos por escenario; RSS srv: pico del proceso servidor hasta ese escenario, en MB)")
+            
+            for size in sizes:
+                source = os.path.join(workdir, f"origen_{format_size(size)}.bin")
+                create_sized_file(source, size)
+                # Las descargas no dependen de que antes haya corrido una subida
+                if 'download' in operations:
+                    for worker_id in range(max(concurrencies)):
+                        link_or_copy(source, os.path.join(shared, bench_name(size, worker_id)))
+                    server.refresh()
+                for concurrency in concurrencies:
+                    for operation in operations:
+                        if operation == 'list' and size != sizes[0]:
+                            continue  # LIST no depende del tamaño de archivo
+                        result = run_scenario(
+                            server, operation, size, concurrency, iterations, workdir, source
+                        )
+                        results.append(result)
+                        print(f"{operation:>10} {format_size(size):>7} {concurrency:>8} "
+                              f"{result['throughput_mb_s']:>9.1f} {result['ops_per_s']:>9.1f} "
+                              f"{result['latency_p50_ms']:>9.2f} {result['latency_p99_ms']:>9.2f} "
+                              f"{result['server_cpu_user_s'] + result['server_cpu_system_s']:>7.2f} "
+                              f"{result['client_cpu_user_s'] + result['client_cpu_system_s']:>7.2f} "
+                              f"{result['server_peak_rss_mb']:>7.1f} {result['errors']:>7}")
+                
+                # Liberar disco antes del siguiente tamaño
+                for directory in (workdir, shared):
+                    for name in os.listdir(directory):
+                        if name.startswith(('origen_', 'bench_')):
+                            os.remove(os.path.join(directory, name))
+                server.refresh()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del protocolo de transferencia")
+    parser.add_argument('--size', type=int, default=256, help="Tamaño del archivo en MB")
+    parser.add_argument('--streams', default='1,2,4,8', help="Cantidades de streams a comparar")
+    parser.add_argument('--suite', action='store_true',
+                        help="Suite de subidas/descargas/LIST con latencias, CPU y memoria")
+    parser.add_argument('--server', choices=sorted(SERVER_CLASSES), default='threads',
+                        help="Servidor a medir en la suite")
+    parser.add_argument('--sizes', default='1K,1M,64M', help="Tamaños de archivo de la suite (1K a 1G)")
+    parser.add_argument('--concurrency', default='1,8', help="Clientes simultáneos de la suite")
+    parser.add_argument('--operations', default='upload,download,list', help="Operaciones de la suite")
+    parser.add_argument('--iterations', type=int, default=20, help="Operaciones por cliente")
+    parser.add_argument('--list-files', type=int, default=1000, help="Archivos extra para medir LIST")
+    parser.add_argument('--json', help="Archivo donde guardar los resultados de la suite")
+    parser.add_argument('--serve', metavar='DIRECTORIO', help=argparse.SUPPRESS)  # Proceso servidor de la suite
+    args = parser.parse_args()
+    
+    if args.serve:
+        serve(args.serve, args.server)
+        return
+    if not args.suite:
+        benchmark_streams(args.size, [int(n) for n in args.streams.split(',')])
+        return
+    
+    results = benchmark_suite(
+        args.server,
+        [parse_size(size) for size in args.sizes.split(',')],
+        [int(n) for n in args.concurrency.split(',')],
+        args.operations.split(','),
+        args.iterations,
+        args.list_files
+    )
+    if args.json:
+        report = {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'server': args.server,
+            'iterations': args.iterations,
+            'results': results
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import json
+import os
+from delta import strong_checksum, weak_checksum
+
+class BlockIndex:
+    """Manifiestos de bloques de los archivos compartidos: firmas (débil, digest) en orden.
+    Los datos viven solo en el archivo; el bloque i de un manifiesto está en el offset i * block_size"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    def manifest_path(self, filename):
+        """Ruta del manifiesto de un archivo compartido"""
+        return os.path.join(self.directory, os.path.basename(filename) + '.json')
+    
+    def save_manifest(self, filename, block_size, blocks, stat):
+        """Guarda la lista de bloques (débil, digest) que forman un archivo"""
+        manifest = {
+            'block_size': block_size,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'blocks': [[weak, digest.hex()] for weak, digest in blocks]
+        }
+        temp_path = self.manifest_path(filename) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self.manifest_path(filename))
+    
+    def load_manifest(self, filename, stat, block_size):
+        """Carga el manifiesto si sigue describiendo el archivo actual"""
+        try:
+            with open(self.manifest_path(filename), 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if (manifest.get('size') != stat.st_size or manifest.get('mtime_ns') != stat.st_mtime_ns
+                or manifest.get('block_size') != block_size):
+            return None
+        return [(weak, bytes.fromhex(digest)) for weak, digest in manifest['blocks']]
+    
+    def remove_manifest(self, filename):
+        """Borra el manifiesto de un archivo reemplazado o eliminado"""
+        try:
+            os.remove(self.manifest_path(filename))
+        except FileNotFoundError:
+            pass
+    
+    def index_file(self, filename, path, block_size):
+        """Calcula las firmas de bloques de un archivo y guarda su manifiesto"""
+        blocks = []
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            for data in iter(lambda: f.read(block_size), b''):
+                blocks.append((weak_checksum(data), strong_checksum(data)))
+        self.save_manifest(filename, block_size, blocks, stat)
+        return blocks
+    
+    def remove_unreferenced(self, filenames):
+        """Elimina los manifiestos de archivos que ya no están en filenames"""
+        keep = {os.path.basename(filename) + '.json' for filename in filenames}
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name not in keep:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+        return removed
\ No newline at end of file
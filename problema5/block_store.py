@@ -0,0 +1,310 @@
+import collections
+import hashlib
+import json
+import os
+import stat as stat_module
+import tempfile
+import threading
+import time
+from delta import strong_checksum, weak_checksum
+
+# stat de un archivo guardado: mismos campos que usa el índice de metadata de un archivo plano
+StoredStat = collections.namedtuple('StoredStat', 'st_size st_mtime_ns st_ino st_mode')
+
+class BlockStore:
+    """Almacenamiento direccionado por contenido de los archivos subidos: cada bloque de
+    block_size bytes se guarda una sola vez en .blocks/<ab>/<digest> y cada archivo es un
+    manifiesto (.stored/<nombre>.json) con sus digests en orden. refcounts cuenta cuántas
+    veces aparece cada bloque en los manifiestos y en los archivos abiertos; un bloque que
+    llega a cero se borra en ese momento"""
+    
+    def __init__(self, base_directory, block_size):
+        self.blocks_directory = os.path.join(base_directory, '.blocks')
+        self.manifests_directory = os.path.join(base_directory, '.stored')
+        self.block_size = block_size
+        self.lock = threading.Lock()          # refcounts y bloques en disco
+        self.publish_lock = threading.Lock()  # Cambio de manifiesto vs. apertura de un archivo
+        self.refcounts = collections.Counter()  # digest -> referencias
+        self.unreferenced = set()  # Bloques que llegaron a cero y gc() todavía no borró
+        self.files = {}  # nombre -> StoredStat de cada archivo guardado
+        os.makedirs(self.blocks_directory, exist_ok=True)
+        os.makedirs(self.manifests_directory, exist_ok=True)
+        self.load()
+    
+    def load(self):
+        """Carga los manifiestos, cuenta las referencias y borra los bloques huérfanos (de
+        una subida o un reemplazo que se cortó)"""
+        for entry in os.scandir(self.manifests_directory):
+            manifest = self.read_manifest_path(entry.path) if entry.name.endswith('.json') else None
+            if manifest is None:
+                os.remove(entry.path)  # Temporal de una escritura cortada
+                continue
+            self.files[entry.name[:-len('.json')]] = self.manifest_stat(manifest)
+            self.refcounts.update(bytes.fromhex(digest) for digest in manifest['blocks'])
+        
+        for prefix in os.scandir(self.blocks_directory):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    referenced = bytes.fromhex(entry.name) in self.refcounts
+                except ValueError:
+                    referenced = False  # Temporal de un bloque a medio escribir
+                if not referenced:
+                    os.remove(entry.path)
+    
+    @staticmethod
+    def manifest_stat(manifest):
+        """StoredStat de un archivo según su manifiesto"""
+        return StoredStat(manifest['size'], manifest['mtime_ns'], 0, stat_module.S_IFREG | 0o644)
+    
+    def block_path(self, digest):
+        """Ruta de un bloque: .blocks/ab/abcdef..."""
+        hex_digest = digest.hex()
+        return os.path.join(self.blocks_directory, hex_digest[:2], hex_digest)
+    
+    def add_block(self, data):
+        """Guarda un bloque si no estaba y le suma una referencia; retorna su digest"""
+        digest = strong_checksum(data)
+        path = self.block_path(digest)
+        with self.lock:
+            self.refcounts[digest] += 1
+            if os.path.exists(path):
+                return digest
+        # Bloque nuevo: se escribe fuera del lock (con la referencia tomada gc() no lo borra)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return digest
+    
+    def read_block(self, digest):
+        """Lee un bloque por su digest"""
+        with open(self.block_path(digest), 'rb') as f:
+            return f.read()
+    
+    def acquire(self, digests):
+        """Suma una referencia a cada bloque (un archivo abierto para leer)"""
+        with self.lock:
+            self.refcounts.update(digests)
+    
+    def release(self, digests):
+        """Resta una referencia a cada bloque y borra los que quedaron sin ninguna"""
+        with self.lock:
+            for digest in digests:
+                self.refcounts[digest] -= 1
+                if self.refcounts[digest] <= 0:
+                    del self.refcounts[digest]
+                    self.unreferenced.add(digest)
+        return self.gc()
+    
+    def gc(self):
+        """Borra los bloques sin referencias; retorna cuántos borró"""
+        removed = 0
+        with self.lock:
+            while self.unreferenced:
+                digest = self.unreferenced.pop()
+                if digest in self.refcounts:
+                    continue  # Otro archivo lo volvió a usar
+                try:
+                    os.remove(self.block_path(digest))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+    
+    def ingest(self, path, md5=None):
+        """Agrega los bloques de un archivo plano; retorna (digests, tamaño, md5)"""
+        digests = []
+        hasher = hashlib.md5() if md5 is None else None
+        size = 0
+        try:
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(self.block_size), b''):
+                    digests.append(self.add_block(data))
+                    if hasher:
+                        hasher.update(data)
+                    size += len(data)
+        except BaseException:
+            self.release(digests)
+            raise
+        return digests, size, md5 or hasher.hexdigest()
+    
+    def manifest_path(self, name):
+        """Ruta del manifiesto de un archivo guardado"""
+        return os.path.join(self.manifests_directory, name + '.json')
+    
+    @staticmethod
+    def read_manifest_path(path):
+        """Manifiesto guardado en path, o None si no existe o está incompleto"""
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def write_manifest(self, name, manifest):
+        """Guarda un manifiesto de forma atómica"""
+        temp_path = self.manifest_path(name) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self.manifest_path(name))
+    
+    def publish(self, name, digests, size, md5):
+        """Publica un archivo con bloques ya agregados (sus referencias pasan al manifiesto)
+        y libera los de la versión que reemplaza; retorna su StoredStat"""
+        manifest = {
+            'block_size': self.block_size,
+            'size': size,
+            'mtime_ns': time.time_ns(),
+            'md5': md5,
+            'blocks': [digest.hex() for digest in digests]
+        }
+        stat = self.manifest_stat(manifest)
+        with self.publish_lock:
+            old = self.read_manifest_path(self.manifest_path(name)) if name in self.files else None
+            self.write_manifest(name, manifest)
+            self.files[name] = stat
+        if old:
+            self.release(bytes.fromhex(digest) for digest in old['blocks'])
+        return stat
+    
+    def remove(self, name):
+        """Elimina un archivo guardado y libera sus bloques"""
+        with self.publish_lock:
+            if self.files.pop(name, None) is None:
+                return
+            old = self.read_manifest_path(self.manifest_path(name))
+            os.remove(self.manifest_path(name))
+        if old:
+            self.release(bytes.fromhex(digest) for digest in old['blocks'])
+    
+    def stat(self, name):
+        """StoredStat de un archivo guardado, o None"""
+        return self.files.get(name)
+    
+    def items(self):
+        """Copia de los archivos guardados [(nombre, StoredStat)]"""
+        with self.publish_lock:
+            return list(self.files.items())
+    
+    def open(self, name):
+        """Abre un archivo guardado para leerlo; sus bloques quedan referenciados hasta close()"""
+        with self.publish_lock:
+            manifest = self.read_manifest_path(self.manifest_path(name)) if name in self.files else None
+            if manifest is None:
+                raise FileNotFoundError("Archivo no encontrado")
+            digests = [bytes.fromhex(digest) for digest in manifest['blocks']]
+            self.acquire(digests)
+        return StoredFile(self, name, manifest, digests)
+    
+    def signatures(self, name):
+        """Firmas (débil, digest) de un archivo guardado; las débiles se calculan la primera
+        vez que se piden y quedan en el manifiesto"""
+        with self.open(name) as f:
+            weak = f.manifest.get('weak')
+            if weak is None:
+                weak = [weak_checksum(self.read_block(digest)) for digest in f.digests]
+                with self.publish_lock:
+                    current = self.read_manifest_path(self.manifest_path(name))
+                    if current and current['mtime_ns'] == f.manifest['mtime_ns']:
+                        current['weak'] = weak
+                        self.write_manifest(name, current)
+            return list(zip(weak, f.digests))
+
+
+class StoredFile:
+    """Archivo del block store abierto para leer, con la interfaz de archivo que usan los
+    comandos (read, readinto, seek, tell) más lecturas por offset y envío con sendfile
+    bloque por bloque"""
+    
+    def __init__(self, store, name, manifest, digests):
+        self.store = store
+        self.name = name
+        self.manifest = manifest
+        self.digests = digests
+        self.block_size = manifest['block_size']
+        self.size = manifest['size']
+        self.position = 0
+        self.closed = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        """Libera los bloques del archivo"""
+        if not self.closed:
+            self.closed = True
+            self.store.release(self.digests)
+    
+    def stat(self):
+        """StoredStat del archivo"""
+        return self.store.manifest_stat(self.manifest)
+    
+    def ranges(self, offset, size):
+        """Tramos (ruta del bloque, offset en el bloque, largo) que cubren size bytes desde offset"""
+        end = min(offset + size, self.size)
+        while offset < end:
+            index, block_offset = divmod(offset, self.block_size)
+            length = min(self.block_size - block_offset, end - offset)
+            yield self.store.block_path(self.digests[index]), block_offset, length
+            offset += length
+    
+    def readinto_at(self, view, offset):
+        """Lee en view desde offset (como preadv); retorna los bytes leídos"""
+        view = memoryview(view)
+        filled = 0
+        for path, block_offset, length in self.ranges(offset, len(view)):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                n = os.preadv(fd, [view[filled:filled + length]], block_offset)
+            finally:
+                os.close(fd)
+            if n != length:
+                raise IOError(f"Bloque incompleto en {self.name}")
+            filled += n
+        return filled
+    
+    def pread(self, size, offset):
+        """Lee hasta size bytes desde offset"""
+        buffer = bytearray(max(0, min(size, self.size - offset)))
+        return bytes(buffer[:self.readinto_at(buffer, offset)])
+    
+    def readinto(self, view):
+        """Lee en view desde la posición actual"""
+        n = self.readinto_at(view, self.position)
+        self.position += n
+        return n
+    
+    def read(self, size=-1):
+        """Lee hasta size bytes (todo el resto si es negativo) desde la posición actual"""
+        if size < 0:
+            size = self.size - self.position
+        data = self.pread(size, self.position)
+        self.position += len(data)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Mueve la posición actual"""
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return offset
+    
+    def tell(self):
+        """Posición actual"""
+        return self.position
+    
+    def send_to(self, sock, size, offset):
+        """Envía size bytes desde offset con sendfile, un bloque a la vez; retorna los enviados"""
+        sent = 0
+        for path, block_offset, length in self.ranges(offset, size):
+            with open(path, 'rb') as block:
+                sent += sock.sendfile(block, block_offset, length)
+        return sent
\ No newline at end of file
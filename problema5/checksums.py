@@ -0,0 +1,133 @@
+import hashlib
+import os
+import queue
+import threading
+import zlib
+
+# Algoritmos de checksum del protocolo. El id viaja en el campo reservado del
+# header versión 2; 0 es el MD5 truncado a 32 bits de siempre.
+ALGORITHMS = {'md5': 0, 'crc32': 1, 'adler32': 2, 'blake2b': 3}
+ALGORITHM_NAMES = {algorithm_id: name for name, algorithm_id in ALGORITHMS.items()}
+PREFERENCE = ('crc32', 'adler32', 'blake2b', 'md5')  # Orden en que el servidor elige en HELO
+
+PIPELINE_MIN_SIZE = 1024 * 1024  # Debajo de esto no compensa lanzar el hilo de hash
+PIPELINE_BUFFERS = 4             # Buffers en vuelo entre la E/S y el hash
+
+def available_cpus():
+    """CPUs que puede usar este proceso"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Con una sola CPU el hilo de hash no puede solaparse con la E/S, solo suma cambios de contexto
+PIPELINE_ENABLED = available_cpus() > 1
+
+def use_pipeline(size):
+    """Indica si conviene hashear size bytes en un hilo aparte"""
+    return PIPELINE_ENABLED and size >= PIPELINE_MIN_SIZE
+
+def negotiate(proposed, default='md5'):
+    """Algoritmo de la sesión: el primero de PREFERENCE que el cliente propuso"""
+    return next((algorithm for algorithm in PREFERENCE if algorithm in proposed), default)
+
+def algorithm_name(algorithm_id):
+    """Nombre del algoritmo a partir del id del header"""
+    try:
+        return ALGORITHM_NAMES[algorithm_id]
+    except KeyError:
+        raise ValueError(f"Algoritmo de checksum no soportado: {algorithm_id}")
+
+class Checksum:
+    """Checksum incremental con el algoritmo elegido; value() da el entero del header"""
+    
+    def __init__(self, algorithm='md5'):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Algoritmo de checksum no soportado: {algorithm}")
+        self.algorithm = algorithm
+        self.algorithm_id = ALGORITHMS[algorithm]
+        self.hash = None
+        self.running = 0
+        if algorithm == 'md5':
+            self.hash = hashlib.md5()
+        elif algorithm == 'blake2b':
+            self.hash = hashlib.blake2b(digest_size=8)
+        elif algorithm == 'adler32':
+            self.running = 1
+    
+    def update(self, data):
+        """Agrega datos al checksum (zlib y hashlib liberan el GIL con buffers grandes)"""
+        if self.hash is not None:
+            self.hash.update(data)
+        elif self.algorithm == 'crc32':
+            self.running = zlib.crc32(data, self.running)
+        else:
+            self.running = zlib.adler32(data, self.running)
+    
+    def value(self):
+        """Checksum final: 32 bits para md5/crc32/adler32, 64 bits para blake2b"""
+        if self.algorithm == 'md5':
+            return int(self.hash.hexdigest()[:8], 16)
+        if self.algorithm == 'blake2b':
+            return int.from_bytes(self.hash.digest(), 'big')
+        return self.running & 0xFFFFFFFF
+    
+    def md5_hexdigest(self):
+        """MD5 completo (para el índice de metadata) o None si el algoritmo es otro"""
+        return self.hash.hexdigest() if self.algorithm == 'md5' else None
+
+class HashPipeline:
+    """Productor/consumidor: el llamador llena buffers del pool (red o disco) y
+    un hilo aparte los hashea, así el hash no frena la transferencia"""
+    
+    def __init__(self, hasher, buffer_size, buffers=PIPELINE_BUFFERS):
+        self.hasher = hasher
+        self.free = queue.Queue()     # Buffers listos para volver a llenarse
+        self.pending = queue.Queue()  # (buffer, largo) esperando el hash
+        for _ in range(buffers):
+            self.free.put(bytearray(buffer_size))
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def acquire(self):
+        """Toma un buffer libre (bloquea si el hash va atrasado)"""
+        return self.free.get()
+    
+    def submit(self, buffer, length):
+        """Entrega los primeros length bytes del buffer para hashear"""
+        self.pending.put((buffer, length))
+    
+    def run(self):
+        """Hilo consumidor: hashea en orden y devuelve los buffers al pool"""
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            buffer, length = item
+            if self.error is None:
+                try:
+                    self.hasher.update(memoryview(buffer)[:length])
+                except Exception as e:
+                    self.error = e
+            self.free.put(buffer)
+    
+    def close(self):
+        """Espera a que se hashee todo lo entregado"""
+        self.pending.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Ya hubo un error: solo detener el hilo
+            self.pending.put(None)
+            self.thread.join()
+        return False
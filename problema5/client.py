@@ -1,29 +1,77 @@
 import socket
 import struct
 import os
+import tempfile
+import threading
+import queue
+import time
+import argparse
 from protocol import FileTransferProtocol
+from journal import TransferJournal
+import delta
 
 class FileClient:
-    def __init__(self, host='localhost', port=9000):
+    def __init__(self, host='localhost', port=9000, compression=None,
+                 compression_level=FileTransferProtocol.DEFAULT_COMPRESSION_LEVEL,
+                 checksum=FileTransferProtocol.DEFAULT_CHECKSUM):
         self.host = host
         self.port = port
         self.socket = None
+        self.requested_compression = compression  # Codec pedido ('zlib', 'lzma' o None)
+        self.compression = None                   # Codec aceptado por el servidor
+        self.compression_level = compression_level
+        self.requested_checksum = checksum                  # Algoritmo pedido para los comandos v2
+        self.checksum = FileTransferProtocol.DEFAULT_CHECKSUM  # Algoritmo aceptado por el servidor
     
     def connect(self):
         """Conecta al servidor"""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect((self.host, self.port))
+        # Sin Nagle: el header de un comando no espera al ACK retrasado del anterior
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         print(f"Conectado al servidor {self.host}:{self.port}")
+        if self.needs_negotiation():
+            self.negotiate()
+            print(f"Compresión negociada: {self.compression or 'ninguna'}, checksum: {self.checksum}")
+    
+    def needs_negotiation(self):
+        """Indica si se pidió algo distinto de lo que el servidor asume sin HELO"""
+        return bool(self.requested_compression) or self.requested_checksum != FileTransferProtocol.DEFAULT_CHECKSUM
+    
+    def negotiate(self):
+        """Negocia con HELO las capacidades de la conexión"""
+        payload = FileTransferProtocol.encode_hello({
+            'compression': [self.requested_compression] if self.requested_compression else [],
+            'level': self.compression_level,
+            'checksum': [self.requested_checksum]
+        })
+        header = FileTransferProtocol.create_header_v2(FileTransferProtocol.CMD_HELLO, len(payload))
+        self.socket.sendall(header + payload)
+        
+        response = self.receive_v2_response()
+        if response is None:
+            return
+        reply = FileTransferProtocol.decode_hello(
+            FileTransferProtocol.recv_exact(self.socket, response[2])
+        )
+        self.compression = reply.get('compression')
+        self.checksum = reply.get('checksum') or FileTransferProtocol.DEFAULT_CHECKSUM
     
     def disconnect(self):
         """Desconecta del servidor"""
         if self.socket:
             end_header = FileTransferProtocol.create_header(FileTransferProtocol.CMD_END)
-            self.socket.send(end_header)
+            self.socket.sendall(end_header)
             self.socket.close()
             self.socket = None
             print("Desconectado del servidor")
     
+    def send_command(self, header, filename):
+        """Envía el header del comando y el nombre de archivo (precedido por su longitud) en
+        un solo sendall: en dos, el segundo segmento espera el ACK retrasado del primero"""
+        filename_encoded = filename.encode()
+        self.socket.sendall(header + struct.pack('!I', len(filename_encoded)) + filename_encoded)
+    
     def upload_file(self, filepath):
         """Sube un archivo al servidor"""
         try:
@@ -33,39 +81,31 @@ class FileClient:
             
             filename = os.path.basename(filepath)
             
-            # Leer archivo y calcular checksum
             with open(filepath, 'rb') as f:
-                file_data = f.read()
-            
-            checksum = FileTransferProtocol.calculate_checksum(file_data)
-            
-            # Enviar header de upload
-            header = FileTransferProtocol.create_header(
-                FileTransferProtocol.CMD_UPLOAD, len(file_data), checksum
-            )
-            self.socket.send(header)
-            
-            # Enviar nombre del archivo
-            filename_encoded = filename.encode()
-            self.socket.send(struct.pack('!I', len(filename_encoded)))
-            self.socket.send(filename_encoded)
-            
-            # Enviar datos del archivo
-            bytes_sent = 0
-            while bytes_sent < len(file_data):
-                chunk = file_data[bytes_sent:bytes_sent + FileTransferProtocol.BUFFER_SIZE]
-                self.socket.send(chunk)
-                bytes_sent += len(chunk)
+                # Calcular checksum por bloques sin cargar el archivo en memoria
+                file_size = os.fstat(f.fileno()).st_size
+                checksum = FileTransferProtocol.calculate_file_checksum(f, file_size)
+                
+                # Enviar header de upload y nombre del archivo
+                header = FileTransferProtocol.create_header(
+                    FileTransferProtocol.CMD_UPLOAD, file_size, checksum
+                )
+                self.send_command(header, filename)
+                
+                # Enviar datos del archivo con sendfile
+                FileTransferProtocol.send_from_file(self.socket, f, file_size)
             
             # Esperar confirmación
-            response_header = self.socket.recv(FileTransferProtocol.HEADER_SIZE)
+            response_header = FileTransferProtocol.recv_exact(
+                self.socket, FileTransferProtocol.HEADER_SIZE
+            )
             command, data_size, _ = FileTransferProtocol.parse_header(response_header)
             
             if command == FileTransferProtocol.CMD_ACK:
                 print("Archivo subido exitosamente")
                 return True
             else:
-                error_data = self.socket.recv(data_size)
+                error_data = FileTransferProtocol.recv_exact(self.socket, data_size)
                 print(f"Error: {error_data.decode()}")
                 return False
                 
@@ -75,46 +115,41 @@ class FileClient:
     
     def download_file(self, filename, save_path):
         """Descarga un archivo del servidor"""
+        temp_path = None
         try:
-            # Enviar header de download
+            # Enviar header de download y nombre del archivo
             header = FileTransferProtocol.create_header(FileTransferProtocol.CMD_DOWNLOAD)
-            self.socket.send(header)
-            
-            # Enviar nombre del archivo
-            filename_encoded = filename.encode()
-            self.socket.send(struct.pack('!I', len(filename_encoded)))
-            self.socket.send(filename_encoded)
+            self.send_command(header, filename)
             
             # Recibir respuesta
-            response_header = self.socket.recv(FileTransferProtocol.HEADER_SIZE)
+            response_header = FileTransferProtocol.recv_exact(
+                self.socket, FileTransferProtocol.HEADER_SIZE
+            )
             command, data_size, expected_checksum = FileTransferProtocol.parse_header(response_header)
             
             if command == FileTransferProtocol.CMD_ERROR:
-                error_data = self.socket.recv(data_size)
+                error_data = FileTransferProtocol.recv_exact(self.socket, data_size)
                 print(f"Error: {error_data.decode()}")
                 return False
             
-            # Recibir datos del archivo
-            received_data = b''
-            bytes_received = 0
-            
-            while bytes_received < data_size:
-                chunk_size = min(FileTransferProtocol.BUFFER_SIZE, data_size - bytes_received)
-                chunk = self.socket.recv(chunk_size)
-                if not chunk:
-                    break
-                received_data += chunk
-                bytes_received += len(chunk)
+            # Recibir datos del archivo directo a un temporal junto al destino
+            save_dir = os.path.dirname(os.path.abspath(save_path))
+            fd, temp_path = tempfile.mkstemp(
+                dir=save_dir, prefix=f".{os.path.basename(save_path)}.", suffix=".tmp"
+            )
+            hasher = FileTransferProtocol.new_checksum()
+            with os.fdopen(fd, 'wb') as f:
+                FileTransferProtocol.recv_to_file(self.socket, f, data_size, hasher)
             
             # Verificar checksum
-            actual_checksum = FileTransferProtocol.calculate_checksum(received_data)
+            actual_checksum = FileTransferProtocol.finish_checksum(hasher)
             if actual_checksum != expected_checksum:
                 print("Error: Checksum no coincide")
                 return False
             
-            # Guardar archivo
-            with open(save_path, 'wb') as f:
-                f.write(received_data)
+            # Guardar archivo de forma atómica
+            os.replace(temp_path, save_path)
+            temp_path = None
             
             print(f"Archivo descargado exitosamente: {save_path}")
             return True
@@ -122,29 +157,446 @@ class FileClient:
         except Exception as e:
             print(f"Error al descargar archivo: {e}")
             return False
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
     
-    def list_files(self):
-        """Lista archivos disponibles en el servidor"""
+    def receive_v2_response(self):
+        """Recibe un header versión 2; si es un error lo muestra y retorna None"""
+        response = FileTransferProtocol.recv_header_v2(self.socket)
+        if response[0] == FileTransferProtocol.CMD_ERROR:
+            error_data = FileTransferProtocol.recv_exact(self.socket, response[2])
+            print(f"Error: {error_data.decode()}")
+            return None
+        return response
+    
+    def send_segment(self, filename, f, length, offset, flags=0):
+        """Envía un segmento RSUM, comprimido si se negoció y la muestra se reduce"""
+        checksum = FileTransferProtocol.calculate_file_checksum(f, length, offset, algorithm=self.checksum)
+        codec = FileTransferProtocol.choose_compression(
+            self.compression, self.compression_level, f, length, offset
+        )
+        if codec:
+            flags |= FileTransferProtocol.COMPRESSION_FLAGS[codec]
+        
+        header = FileTransferProtocol.create_header_v2(
+            FileTransferProtocol.CMD_RESUME, length, offset, checksum, flags, self.checksum
+        )
+        self.send_command(header, filename)
+        FileTransferProtocol.send_segment_from_file(
+            self.socket, f, length, offset, codec, self.compression_level
+        )
+    
+    def upload_file_resumable(self, filepath):
+        """Sube un archivo por segmentos, retomando desde el último offset verificado"""
         try:
-            # Enviar comando LIST
-            header = FileTransferProtocol.create_header(FileTransferProtocol.CMD_LIST)
-            self.socket.send(header)
+            if not os.path.exists(filepath):
+                print("Archivo no encontrado")
+                return False
             
-            # Recibir respuesta
-            response_header = self.socket.recv(FileTransferProtocol.HEADER_SIZE)
-            command, data_size, _ = FileTransferProtocol.parse_header(response_header)
+            filename = os.path.basename(filepath)
             
-            if command == FileTransferProtocol.CMD_ERROR:
-                error_data = self.socket.recv(data_size)
-                print(f"Error: {error_data.decode()}")
+            with open(filepath, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                file_size = stat.st_size
+                journal = TransferJournal.load(filepath, {
+                    'direction': 'upload', 'filename': filename,
+                    'size': file_size, 'mtime_ns': stat.st_mtime_ns
+                })
+                
+                # Consultar cuánto tiene ya el servidor
+                self.send_command(FileTransferProtocol.create_header_v2(
+                    FileTransferProtocol.CMD_RESUME, flags=FileTransferProtocol.FLAG_QUERY
+                ), filename)
+                response = self.receive_v2_response()
+                if response is None:
+                    return False
+                offset = min(journal.offset, response[3])
+                if offset:
+                    print(f"Reanudando subida desde el byte {offset} de {file_size}")
+                
+                while True:
+                    length = min(FileTransferProtocol.RESUME_SEGMENT_SIZE, file_size - offset)
+                    final = offset + length == file_size
+                    self.send_segment(
+                        filename, f, length, offset, FileTransferProtocol.FLAG_FINAL if final else 0
+                    )
+                    
+                    response = self.receive_v2_response()
+                    if response is None:
+                        return False
+                    offset = response[3]
+                    journal.advance(offset)
+                    if final:
+                        break
+            
+            journal.remove()
+            print("Archivo subido exitosamente")
+            return True
+            
+        except Exception as e:
+            print(f"Error al subir archivo: {e}")
+            return False
+    
+    def query_remote_file(self, filename):
+        """Tamaño y mtime_ns del archivo en el servidor, o None si hubo un error"""
+        self.send_command(FileTransferProtocol.create_header_v2(
+            FileTransferProtocol.CMD_RANGE, flags=FileTransferProtocol.FLAG_QUERY
+        ), filename)
+        response = self.receive_v2_response()
+        if response is None:
+            return None
+        return response[2], response[3]
+    
+    def download_file_resumable(self, filename, save_path):
+        """Descarga un archivo por rangos, retomando desde el último offset verificado"""
+        try:
+            remote = self.query_remote_file(filename)
+            if remote is None:
                 return False
+            file_size, mtime_ns = remote
+            
+            # Si el archivo cambió en el servidor la bitácora no coincide y se empieza de cero
+            partial_path = save_path + '.part'
+            journal = TransferJournal.load(save_path, {
+                'direction': 'download', 'filename': filename,
+                'size': file_size, 'mtime_ns': mtime_ns
+            })
+            
+            # Solo se confía en la parte del archivo parcial que registra la bitácora
+            fd = os.open(partial_path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, 'r+b') as f:
+                offset = min(journal.offset, os.fstat(f.fileno()).st_size)
+                f.truncate(offset)
+                if offset:
+                    print(f"Reanudando descarga desde el byte {offset}")
+                
+                while True:
+                    header = FileTransferProtocol.create_header_v2(
+                        FileTransferProtocol.CMD_RANGE, FileTransferProtocol.RESUME_SEGMENT_SIZE, offset
+                    )
+                    self.send_command(header, filename)
+                    
+                    response = self.receive_v2_response()
+                    if response is None:
+                        return False
+                    _, flags, data_size, _, expected_checksum, algorithm = response
+                    
+                    hasher = FileTransferProtocol.new_checksum(algorithm)
+                    FileTransferProtocol.recv_segment_to_fd(
+                        self.socket, f.fileno(), data_size, offset, flags, hasher
+                    )
+                    if FileTransferProtocol.finish_checksum(hasher) != expected_checksum:
+                        f.truncate(offset)
+                        print("Error: Checksum no coincide")
+                        return False
+                    
+                    f.flush()
+                    os.fsync(f.fileno())
+                    offset += data_size
+                    journal.advance(offset)
+                    if flags & FileTransferProtocol.FLAG_FINAL:
+                        break
             
-            # Recibir lista de archivos
-            file_list_data = self.socket.recv(data_size)
-            file_list = file_list_data.decode()
+            # Los segmentos deben ser todos de la misma versión del archivo
+            if self.query_remote_file(filename) != remote:
+                journal.reset()
+                print("Error: El archivo cambió en el servidor durante la descarga")
+                return False
+            
+            os.replace(partial_path, save_path)
+            journal.remove()
+            print(f"Archivo descargado exitosamente: {save_path}")
+            return True
+            
+        except Exception as e:
+            print(f"Error al descargar archivo: {e}")
+            return False
+    
+    def open_stream(self):
+        """Abre una conexión adicional al servidor para un stream paralelo"""
+        stream = FileClient(
+            self.host, self.port, self.requested_compression, self.compression_level,
+            self.requested_checksum
+        )
+        stream.socket = socket.create_connection((self.host, self.port))
+        stream.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if stream.needs_negotiation():
+            stream.negotiate()
+        return stream
+    
+    def run_parallel(self, blocks, streams, transfer_block):
+        """Reparte los bloques entre varias conexiones paralelas al servidor"""
+        pending = queue.Queue()
+        for index in blocks:
+            pending.put(index)
+        
+        def worker():
+            stream = None
+            try:
+                stream = self.open_stream()
+                while True:
+                    try:
+                        index = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if not transfer_block(stream, index):
+                        break
+            except Exception as e:
+                print(f"Error en stream paralelo: {e}")
+            finally:
+                if stream and stream.socket:
+                    try:
+                        stream.socket.sendall(
+                            FileTransferProtocol.create_header(FileTransferProtocol.CMD_END)
+                        )
+                    except OSError:
+                        pass
+                    stream.socket.close()
+        
+        threads = [threading.Thread(target=worker) for _ in range(max(1, min(streams, len(blocks))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    
+    def report_throughput(self, transferred, elapsed, streams):
+        """Muestra el throughput agregado de una transferencia"""
+        mb = transferred / (1024 * 1024)
+        rate = mb / elapsed if elapsed > 0 else 0.0
+        print(f"{mb:.1f} MB en {elapsed:.2f} s ({rate:.1f} MB/s con {streams} streams)")
+    
+    def upload_file_parallel(self, filepath, streams=4):
+        """Sube un archivo por bloques con checksum propio usando N conexiones"""
+        try:
+            if not os.path.exists(filepath):
+                print("Archivo no encontrado")
+                return False
+            
+            filename = os.path.basename(filepath)
+            block_size = FileTransferProtocol.PARALLEL_BLOCK_SIZE
+            stat = os.stat(filepath)
+            file_size = stat.st_size
+            total_blocks = (file_size + block_size - 1) // block_size
+            journal = TransferJournal.load(filepath, {
+                'direction': 'upload', 'mode': 'parallel', 'filename': filename,
+                'size': file_size, 'mtime_ns': stat.st_mtime_ns, 'block_size': block_size
+            })
+            
+            # Si el servidor perdió el archivo parcial no se puede reanudar
+            self.send_command(FileTransferProtocol.create_header_v2(
+                FileTransferProtocol.CMD_RESUME, flags=FileTransferProtocol.FLAG_QUERY
+            ), filename)
+            response = self.receive_v2_response()
+            if response is None:
+                return False
+            if response[3] == 0 and journal.blocks:
+                journal.reset()
+            
+            transferred = [0]
+            transferred_lock = threading.Lock()
+            
+            def upload_block(stream, index):
+                offset = index * block_size
+                length = min(block_size, file_size - offset)
+                with open(filepath, 'rb') as f:
+                    stream.send_segment(filename, f, length, offset)
+                if stream.receive_v2_response() is None:
+                    return False
+                journal.mark_block(index)
+                with transferred_lock:
+                    transferred[0] += length
+                return True
+            
+            start = time.perf_counter()
+            pending = [i for i in range(total_blocks) if i not in journal.blocks]
+            self.run_parallel(pending, streams, upload_block)
+            
+            missing = total_blocks - len(journal.blocks)
+            if missing:
+                print(f"Faltan {missing} bloques; vuelve a intentar para reanudar")
+                return False
             
+            # Confirmar: el servidor recorta al tamaño final y publica el archivo
+            header = FileTransferProtocol.create_header_v2(
+                FileTransferProtocol.CMD_RESUME, 0, file_size,
+                FileTransferProtocol.calculate_checksum(b'', self.checksum),
+                FileTransferProtocol.FLAG_FINAL, self.checksum
+            )
+            self.send_command(header, filename)
+            if self.receive_v2_response() is None:
+                return False
+            
+            journal.remove()
+            self.report_throughput(transferred[0], time.perf_counter() - start, streams)
+            print("Archivo subido exitosamente")
+            return True
+            
+        except Exception as e:
+            print(f"Error al subir archivo: {e}")
+            return False
+    
+    def download_file_parallel(self, filename, save_path, streams=4):
+        """Descarga un archivo por bloques con checksum propio usando N conexiones"""
+        fd = None
+        try:
+            # Consultar el tamaño y el mtime del archivo (identifican la versión)
+            remote = self.query_remote_file(filename)
+            if remote is None:
+                return False
+            file_size, mtime_ns = remote
+            
+            block_size = FileTransferProtocol.PARALLEL_BLOCK_SIZE
+            total_blocks = (file_size + block_size - 1) // block_size
+            partial_path = save_path + '.part'
+            journal = TransferJournal.load(save_path, {
+                'direction': 'download', 'mode': 'parallel', 'filename': filename,
+                'size': file_size, 'mtime_ns': mtime_ns, 'block_size': block_size
+            })
+            if not os.path.exists(partial_path) and journal.blocks:
+                journal.reset()
+            
+            fd = os.open(partial_path, os.O_RDWR | os.O_CREAT, 0o644)
+            os.ftruncate(fd, file_size)
+            
+            transferred = [0]
+            transferred_lock = threading.Lock()
+            
+            def download_block(stream, index):
+                offset = index * block_size
+                length = min(block_size, file_size - offset)
+                header = FileTransferProtocol.create_header_v2(
+                    FileTransferProtocol.CMD_RANGE, length, offset
+                )
+                stream.send_command(header, filename)
+                
+                response = stream.receive_v2_response()
+                if response is None:
+                    return False
+                _, flags, data_size, _, expected_checksum, algorithm = response
+                if data_size != length:
+                    print("Error: El archivo cambió en el servidor")
+                    return False
+                
+                hasher = FileTransferProtocol.new_checksum(algorithm)
+                FileTransferProtocol.recv_segment_to_fd(
+                    stream.socket, fd, data_size, offset, flags, hasher
+                )
+                if FileTransferProtocol.finish_checksum(hasher) != expected_checksum:
+                    print(f"Error: Checksum del bloque {index} no coincide")
+                    return True  # Queda pendiente para el próximo intento
+                
+                journal.mark_block(index)
+                with transferred_lock:
+                    transferred[0] += length
+                return True
+            
+            start = time.perf_counter()
+            pending = [i for i in range(total_blocks) if i not in journal.blocks]
+            self.run_parallel(pending, streams, download_block)
+            
+            missing = total_blocks - len(journal.blocks)
+            if missing:
+                print(f"Faltan {missing} bloques; vuelve a intentar para reanudar")
+                return False
+            
+            # Los bloques deben ser todos de la misma versión del archivo
+            if self.query_remote_file(filename) != remote:
+                journal.reset()
+                print("Error: El archivo cambió en el servidor durante la descarga")
+                return False
+            
+            os.fsync(fd)
+            os.close(fd)
+            fd = None
+            os.replace(partial_path, save_path)
+            journal.remove()
+            self.report_throughput(transferred[0], time.perf_counter() - start, streams)
+            print(f"Archivo descargado exitosamente: {save_path}")
+            return True
+            
+        except Exception as e:
+            print(f"Error al descargar archivo: {e}")
+            return False
+        finally:
+            if fd is not None:
+                os.close(fd)
+    
+    def sync_file(self, filepath):
+        """Sube un archivo enviando solo los bloques que el servidor no tiene (delta)"""
+        try:
+            if not os.path.exists(filepath):
+                print("Archivo no encontrado")
+                return False
+            
+            filename = os.path.basename(filepath)
+            
+            # Pedir las firmas de la versión que tiene el servidor
+            self.send_command(FileTransferProtocol.create_header_v2(FileTransferProtocol.CMD_SIGNATURES), filename)
+            response = self.receive_v2_response()
+            if response is None:
+                return False
+            _, _, data_size, block_size, _, _ = response
+            payload = FileTransferProtocol.recv_exact(self.socket, data_size)
+            signatures = list(struct.iter_unpack(FileTransferProtocol.SIGNATURE_FORMAT, payload))
+            
+            with open(filepath, 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                checksum = FileTransferProtocol.calculate_file_checksum(f, file_size, algorithm=self.checksum)
+                
+                header = FileTransferProtocol.create_header_v2(
+                    FileTransferProtocol.CMD_DELTA, file_size, 0, checksum, algorithm=self.checksum
+                )
+                self.send_command(header, filename)
+                
+                # Enviar las operaciones a medida que se calculan
+                literal_bytes = 0
+                for op, value in delta.compute_delta(f, signatures, block_size):
+                    if op == 'copy':
+                        self.socket.sendall(FileTransferProtocol.DELTA_COPY + value)
+                    else:
+                        literal_bytes += len(value)
+                        self.socket.sendall(
+                            FileTransferProtocol.DELTA_LITERAL + struct.pack('!I', len(value)) + value
+                        )
+                self.socket.sendall(FileTransferProtocol.DELTA_END)
+            
+            if self.receive_v2_response() is None:
+                return False
+            
+            print(f"Archivo sincronizado: {literal_bytes} de {file_size} bytes enviados como datos nuevos")
+            return True
+            
+        except Exception as e:
+            print(f"Error al sincronizar archivo: {e}")
+            return False
+    
+    def iter_files(self, prefix='', sort_key='name', page_size=FileTransferProtocol.LIST_PAGE_SIZE):
+        """Genera (nombre, tamaño, mtime_ns) pidiendo el listado página por página"""
+        cursor_data = b''
+        while True:
+            payload = FileTransferProtocol.encode_list_request(sort_key, page_size, prefix, cursor_data)
+            header = FileTransferProtocol.create_header_v2(
+                FileTransferProtocol.CMD_LIST_PAGE, len(payload)
+            )
+            self.socket.sendall(header + payload)
+            
+            command, flags, data_size, _, _, _ = FileTransferProtocol.recv_header_v2(self.socket)
+            page = FileTransferProtocol.recv_exact(self.socket, data_size)
+            if command == FileTransferProtocol.CMD_ERROR:
+                raise IOError(page.decode())
+            
+            cursor_data, records = FileTransferProtocol.decode_list_page(page)
+            yield from records
+            if flags & FileTransferProtocol.FLAG_FINAL:
+                break
+    
+    def list_files(self, prefix='', sort_key='name'):
+        """Lista archivos disponibles en el servidor"""
+        try:
             print("\nArchivos disponibles:")
-            print(file_list)
+            for name, size, _ in self.iter_files(prefix, sort_key):
+                print(f"{name} ({size} bytes)")
             return True
             
         except Exception as e:
@@ -152,7 +604,21 @@ class FileClient:
             return False
 
 def main():
-    client = FileClient()
+    parser = argparse.ArgumentParser(description="Cliente de transferencia de archivos")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--streams', type=int, default=1,
+                        help="Conexiones paralelas para subir/descargar (1 = un solo stream)")
+    parser.add_argument('--compress', choices=FileTransferProtocol.COMPRESSION_CODECS,
+                        help="Comprimir las transferencias por segmentos con este codec")
+    parser.add_argument('--level', type=int, default=FileTransferProtocol.DEFAULT_COMPRESSION_LEVEL,
+                        help="Nivel de compresión")
+    parser.add_argument('--checksum', choices=sorted(FileTransferProtocol.CHECKSUM_ALGORITHMS),
+                        default=FileTransferProtocol.DEFAULT_CHECKSUM,
+                        help="Algoritmo de checksum de las transferencias por segmentos")
+    args = parser.parse_args()
+    
+    client = FileClient(args.host, args.port, args.compress, args.level, args.checksum)
     
     try:
         client.connect()
@@ -162,26 +628,52 @@ def main():
             print("1. Listar archivos")
             print("2. Subir archivo")
             print("3. Descargar archivo")
-            print("4. Salir")
+            print("4. Subir archivo (reanudable)")
+            print("5. Descargar archivo (reanudable)")
+            print("6. Sincronizar archivo (delta)")
+            print("7. Salir")
             
             choice = input("Selecciona una opción: ")
             
             if choice == '1':
-                client.list_files()
+                prefix = input("Prefijo (Enter para todos): ")
+                sort_key = input("Ordenar por name/size/mtime_ns (Enter = name): ") or 'name'
+                if sort_key in FileTransferProtocol.LIST_SORT_KEYS:
+                    client.list_files(prefix, sort_key)
+                else:
+                    print("Orden no válido")
                 
             elif choice == '2':
                 filepath = input("Ruta del archivo a subir: ")
-                if os.path.exists(filepath):
-                    client.upload_file(filepath)
-                else:
+                if not os.path.exists(filepath):
                     print("Archivo no encontrado")
+                elif args.streams > 1:
+                    client.upload_file_parallel(filepath, args.streams)
+                else:
+                    client.upload_file(filepath)
                     
             elif choice == '3':
                 filename = input("Nombre del archivo a descargar: ")
                 save_path = input("Ruta donde guardar: ")
-                client.download_file(filename, save_path)
+                if args.streams > 1:
+                    client.download_file_parallel(filename, save_path, args.streams)
+                else:
+                    client.download_file(filename, save_path)
                 
             elif choice == '4':
+                filepath = input("Ruta del archivo a subir: ")
+                client.upload_file_resumable(filepath)
+                
+            elif choice == '5':
+                filename = input("Nombre del archivo a descargar: ")
+                save_path = input("Ruta donde guardar: ")
+                client.download_file_resumable(filename, save_path)
+                
+            elif choice == '6':
+                filepath = input("Ruta del archivo a sincronizar: ")
+                client.sync_file(filepath)
+                
+            elif choice == '7':
                 break
                 
             else:
@@ -0,0 +1,200 @@
+import os
+import struct
+from protocol import FileTransferProtocol
+
+# Lógica de los comandos compartida por FileServer (un hilo por cliente) y AsyncFileServer
+# (asyncio): cada servidor solo lee y escribe en su tipo de conexión. Las funciones que tocan
+# el disco son bloqueantes; el servidor asíncrono las corre en su pool de hilos.
+
+def new_session():
+    """Capacidades de una conexión antes de negociar con HELO"""
+    return {'compression': None, 'level': FileTransferProtocol.DEFAULT_COMPRESSION_LEVEL,
+            'checksum': FileTransferProtocol.DEFAULT_CHECKSUM}
+
+def error_reply(error):
+    """Respuesta de error con header versión 1"""
+    error_msg = str(error).encode()
+    return FileTransferProtocol.create_header(FileTransferProtocol.CMD_ERROR, len(error_msg)) + error_msg
+
+def error_reply_v2(error):
+    """Respuesta de error con header versión 2"""
+    error_msg = str(error).encode()
+    return FileTransferProtocol.create_header_v2(FileTransferProtocol.CMD_ERROR, len(error_msg)) + error_msg
+
+def open_shared_file(file_handler, filename):
+    """Abre un archivo compartido para leerlo (plano o del block store)"""
+    return file_handler.open_file(filename)
+
+def hello(payload, session):
+    """Negocia las capacidades de la conexión (compresión, nivel y checksum); retorna la respuesta"""
+    proposal = FileTransferProtocol.decode_hello(payload)
+    
+    # Primer codec del cliente que el servidor también soporta
+    session['compression'] = next(
+        (codec for codec in proposal.get('compression', [])
+         if codec in FileTransferProtocol.COMPRESSION_CODECS),
+        None
+    )
+    session['level'] = int(proposal.get('level', FileTransferProtocol.DEFAULT_COMPRESSION_LEVEL))
+    # Algoritmo de checksum según la preferencia del servidor entre los propuestos
+    session['checksum'] = FileTransferProtocol.negotiate_checksum(proposal.get('checksum', []))
+    
+    reply = FileTransferProtocol.encode_hello({
+        'compression': session['compression'], 'level': session['level'],
+        'checksum': session['checksum']
+    })
+    return FileTransferProtocol.create_header_v2(FileTransferProtocol.CMD_ACK, len(reply)) + reply
+
+def resume_query(file_handler, filename):
+    """Respuesta a la consulta de RSUM: cuánto tiene ya el archivo parcial"""
+    partial_path = file_handler.get_partial_path(filename)
+    partial_size = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    return FileTransferProtocol.create_header_v2(FileTransferProtocol.CMD_ACK, offset=partial_size)
+
+def open_resume_segment(file_handler, filename):
+    """Abre el archivo parcial para escribir un segmento con pwrite (otros streams pueden
+    estar escribiendo bloques distintos del mismo archivo)"""
+    return os.open(file_handler.get_partial_path(filename), os.O_WRONLY | os.O_CREAT, 0o644)
+
+def finish_resume_segment(file_handler, fd, filename, flags, offset, data_size, hasher, expected_checksum):
+    """Verifica un segmento ya escrito en fd, publica el archivo si es el último y retorna el ACK"""
+    os.fsync(fd)
+    
+    # Un segmento inválido no se confirma; el cliente lo reenvía
+    end_offset = offset + data_size
+    if FileTransferProtocol.finish_checksum(hasher) != expected_checksum:
+        raise ValueError("Checksum del segmento no coincide")
+    
+    if flags & FileTransferProtocol.FLAG_FINAL:
+        os.ftruncate(fd, end_offset)
+        file_handler.commit_temp_file(file_handler.get_partial_path(filename), filename)
+        print(f"Archivo {filename} recibido exitosamente (reanudable)")
+    
+    return FileTransferProtocol.create_header_v2(FileTransferProtocol.CMD_ACK, offset=end_offset)
+
+def plan_range(file_handler, f, filename, flags, data_size, offset, session):
+    """Prepara la respuesta a RANG sobre el archivo abierto f: (header, largo, codec).
+    En una consulta el header es toda la respuesta y el largo es 0"""
+    stat = FileTransferProtocol.file_stat(f)
+    file_size = stat.st_size
+    
+    # Consulta: retorna el tamaño total del archivo y su mtime (identifican la versión)
+    if flags & FileTransferProtocol.FLAG_QUERY:
+        return FileTransferProtocol.create_header_v2(
+            FileTransferProtocol.CMD_ACK, file_size, max(stat.st_mtime_ns, 0)
+        ), 0, None
+    
+    if offset > file_size:
+        raise ValueError("Offset fuera del archivo")
+    
+    # data_size == 0 pide el resto del archivo
+    length = file_size - offset
+    if data_size:
+        length = min(data_size, length)
+    flags = FileTransferProtocol.FLAG_FINAL if offset + length == file_size else 0
+    
+    # Comprimir solo si se negoció y la muestra realmente se reduce
+    codec = FileTransferProtocol.choose_compression(
+        session['compression'], session['level'], f, length, offset
+    )
+    if codec:
+        flags |= FileTransferProtocol.COMPRESSION_FLAGS[codec]
+    
+    # Checksum con el algoritmo negociado en HELO
+    algorithm = session['checksum']
+    if offset == 0 and length == file_size:
+        checksum = file_handler.get_file_checksum(filename, f, algorithm)
+    else:
+        checksum = FileTransferProtocol.calculate_file_checksum(f, length, offset, algorithm=algorithm)
+    header = FileTransferProtocol.create_header_v2(
+        FileTransferProtocol.CMD_DATA, length, offset, checksum, flags, algorithm
+    )
+    return header, length, codec
+
+def signatures(file_handler, filename):
+    """Respuesta a SIGS: firmas de bloques del archivo actual para una sincronización delta"""
+    block_size = FileTransferProtocol.DELTA_BLOCK_SIZE
+    payload = b''.join(
+        struct.pack(FileTransferProtocol.SIGNATURE_FORMAT, weak, strong)
+        for weak, strong in file_handler.get_signatures(filename, block_size)
+    )
+    return FileTransferProtocol.create_header_v2(
+        FileTransferProtocol.CMD_DATA, len(payload), block_size
+    ) + payload
+
+def start_delta(file_handler, filename, algorithm):
+    """Inicia la reconstrucción de un archivo subido con DLTA"""
+    return DeltaStream(file_handler.start_delta_upload(
+        filename, FileTransferProtocol.DELTA_BLOCK_SIZE, algorithm
+    ))
+
+def list_page(file_handler, payload):
+    """Respuesta a LSTP: una página del listado según el pedido en payload"""
+    sort_key, page_size, prefix, cursor_data = FileTransferProtocol.decode_list_request(payload)
+    page_size = max(1, min(page_size, FileTransferProtocol.LIST_MAX_PAGE_SIZE))
+    cursor = FileTransferProtocol.decode_list_cursor(sort_key, cursor_data)
+    
+    records, next_cursor = file_handler.list_page(sort_key, prefix, cursor, page_size)
+    page = FileTransferProtocol.encode_list_page(
+        records, FileTransferProtocol.encode_list_cursor(sort_key, next_cursor)
+    )
+    flags = FileTransferProtocol.FLAG_FINAL if next_cursor is None else 0
+    return FileTransferProtocol.create_header_v2(
+        FileTransferProtocol.CMD_DATA, len(page), flags=flags
+    ) + page
+
+
+class DeltaStream:
+    """Interpreta el stream de operaciones de DLTA a medida que llega: needed es cuántos
+    bytes leer a continuación (0 tras DELTA_END) y feed() los consume"""
+    
+    def __init__(self, upload):
+        self.upload = upload
+        self.needed = 1
+        self.state = 'op'  # op, copy, length o literal
+    
+    @property
+    def writes(self):
+        """Indica si el próximo feed() escribe en disco (COPY o LITERAL)"""
+        return self.state in ('copy', 'literal')
+    
+    def expect(self, state, needed):
+        """Pasa a esperar needed bytes en el estado indicado"""
+        self.state = state
+        self.needed = needed
+    
+    def feed(self, data):
+        """Consume los needed bytes pedidos"""
+        if self.state == 'op':
+            if data == FileTransferProtocol.DELTA_END:
+                self.expect('op', 0)
+            elif data == FileTransferProtocol.DELTA_COPY:
+                self.expect('copy', 16)
+            elif data == FileTransferProtocol.DELTA_LITERAL:
+                self.expect('length', 4)
+            else:
+                raise ValueError("Operación delta inválida")
+        elif self.state == 'length':
+            length = struct.unpack('!I', data)[0]
+            if length > FileTransferProtocol.DELTA_MAX_LITERAL:
+                raise ValueError("Literal delta demasiado grande")
+            if length:
+                self.expect('literal', length)
+            else:
+                self.expect('op', 1)
+        elif self.state == 'copy':
+            self.upload.copy(data)
+            self.expect('op', 1)
+        else:
+            self.upload.literal(data)
+            self.expect('op', 1)
+    
+    def finish(self, filename, data_size, expected_checksum):
+        """Verifica y publica el archivo reconstruido; retorna el ACK"""
+        self.upload.finish(data_size, expected_checksum)
+        print(f"Archivo {filename} sincronizado por delta")
+        return FileTransferProtocol.create_header_v2(FileTransferProtocol.CMD_ACK, data_size)
+    
+    def abort(self):
+        """Descarta la reconstrucción incompleta"""
+        self.upload.abort()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import hashlib
+from itertools import accumulate
+
+# Sincronización delta estilo rsync: el receptor envía firmas (débil + fuerte)
+# de los bloques que ya tiene y el emisor solo transmite lo que cambió.
+
+READ_SIZE = 1024 * 1024  # Lectura del archivo local por bloques grandes
+
+def strong_checksum(data):
+    """Hash fuerte de un bloque (identifica el bloque en los manifiestos)"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def weak_parts(data):
+    """Componentes (a, b) del checksum rodante de rsync"""
+    a = sum(data) & 0xFFFF
+    b = sum(accumulate(data)) & 0xFFFF
+    return a, b
+
+def weak_checksum(data):
+    """Checksum rodante de rsync de un bloque completo"""
+    a, b = weak_parts(data)
+    return a | (b << 16)
+
+def compute_delta(fileobj, signatures, block_size):
+    """Genera las operaciones ('copy', digest) / ('data', bytes) para reconstruir fileobj"""
+    table = {}
+    for weak, strong in signatures:
+        table.setdefault(weak, set()).add(strong)
+    strongs_known = {strong for _, strong in signatures}
+    max_literal = block_size  # El servidor rechaza LITERAL más largos que un bloque
+    
+    # Sin firmas no hay nada que reutilizar: todo el archivo es literal
+    if not signatures:
+        for chunk in iter(lambda: fileobj.read(max_literal), b''):
+            yield 'data', chunk
+        return
+    
+    buf = bytearray()
+    pos = 0            # Inicio de la ventana actual
+    literal_start = 0  # Inicio de los bytes aún no emitidos
+    eof = False
+    a = b = None
+    
+    while True:
+        # Mantener al menos un bloque + 1 byte para poder rodar la ventana
+        if not eof and len(buf) - pos <= block_size:
+            del buf[:literal_start]
+            pos -= literal_start
+            literal_start = 0
+            chunk = fileobj.read(READ_SIZE)
+            if chunk:
+                buf += chunk
+            else:
+                eof = True
+            continue
+        
+        if len(buf) - pos < block_size:
+            break  # Cola más corta que un bloque: se envía literal
+        
+        if a is None:
+            a, b = weak_parts(buf[pos:pos + block_size])
+        
+        strongs = table.get(a | (b << 16))
+        if strongs:
+            strong = strong_checksum(buf[pos:pos + block_size])
+            if strong in strongs:
+                if literal_start < pos:
+                    yield 'data', bytes(buf[literal_start:pos])
+                yield 'copy', strong
+                pos += block_size
+                literal_start = pos
+                a = b = None
+                continue
+        
+        if pos + block_size >= len(buf):
+            break  # Fin del archivo: no hay más bytes para rodar
+        
+        # Rodar la ventana un byte
+        out_byte = buf[pos]
+        in_byte = buf[pos + block_size]
+        a = (a - out_byte + in_byte) & 0xFFFF
+        b = (b - block_size * out_byte + a) & 0xFFFF
+        pos += 1
+        
+        if pos - literal_start >= max_literal:
+            yield 'data', bytes(buf[literal_start:pos])
+            literal_start = pos
+    
+    if literal_start < pos:
+        yield 'data', bytes(buf[literal_start:pos])
+    
+    # La cola puede coincidir con el último bloque (más corto) del servidor
+    tail = bytes(buf[pos:])
+    if tail:
+        strong = strong_checksum(tail)
+        if strong in strongs_known:
+            yield 'copy', strong
+        else:
+            yield 'data', tail
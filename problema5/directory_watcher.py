@@ -0,0 +1,108 @@
+import ctypes
+import os
+import select
+import struct
+import time
+
+# Eventos de inotify que cambian la metadata de un archivo del directorio
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+RESCAN_EVENTS = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF  # Se perdió el rastro
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, largo del nombre
+
+def load_inotify():
+    """Funciones de inotify de la libc, o None si el sistema no las tiene"""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)  # Símbolos ya cargados en el proceso (la libc)
+        return libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+INOTIFY = load_inotify()
+
+class DirectoryWatcher:
+    """Avisa qué archivos de un directorio cambiaron. Con inotify (Linux) recibe los nombres
+    del kernel; si no está disponible compara el mtime del directorio, que cambia al crear,
+    borrar o renombrar, y cada full_scan_interval pide un escaneo completo por las
+    modificaciones en el lugar (que no tocan el directorio)"""
+    
+    READ_SIZE = 64 * 1024
+    
+    def __init__(self, directory, interval=2.0, full_scan_interval=60.0):
+        self.directory = directory
+        self.interval = interval
+        self.full_scan_interval = full_scan_interval
+        self.fd = self.open_inotify()
+        self.last_mtime_ns = self.directory_mtime()
+        self.last_full_scan = time.monotonic()
+    
+    def open_inotify(self):
+        """Descriptor de inotify con el directorio vigilado, o None si no se pudo"""
+        if INOTIFY is None:
+            return None
+        inotify_init1, inotify_add_watch = INOTIFY
+        fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None  # Sin instancias de inotify disponibles
+        if inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+    
+    def directory_mtime(self):
+        """mtime del directorio en ns (None si no existe)"""
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def wait(self):
+        """Espera hasta interval segundos y retorna los nombres que cambiaron, o None si hay
+        que escanear el directorio completo"""
+        if self.fd is None:
+            return self.poll_mtime()
+        
+        readable, _, _ = select.select([self.fd], [], [], self.interval)
+        if not readable:
+            return set()
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, self.READ_SIZE)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                if mask & RESCAN_EVENTS:
+                    if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                        # El directorio ya no es el vigilado: se sigue comparando mtimes
+                        os.close(self.fd)
+                        self.fd = None
+                    return None
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name:
+                    names.add(os.fsdecode(name))
+    
+    def poll_mtime(self):
+        """Espera interval segundos y pide un escaneo si el directorio cambió"""
+        time.sleep(self.interval)
+        mtime_ns = self.directory_mtime()
+        now = time.monotonic()
+        if mtime_ns != self.last_mtime_ns or now - self.last_full_scan >= self.full_scan_interval:
+            self.last_mtime_ns = mtime_ns
+            self.last_full_scan = now
+            return None
+        return set()
\ No newline at end of file
@@ -1,38 +1,212 @@
 import os
-import hashlib
+import tempfile
+from block_index import BlockIndex
+from block_store import BlockStore
+from metadata_index import MetadataIndex
+from protocol import FileTransferProtocol
+import delta
 
 class FileHandler:
-    def __init__(self, base_directory):
+    def __init__(self, base_directory, watch=True):
         self.base_directory = base_directory
         os.makedirs(base_directory, exist_ok=True)
+        self.block_index = BlockIndex(os.path.join(base_directory, '.manifests'))
+        # Lo que llega por el protocolo se guarda por bloques; un archivo plano del mismo
+        # nombre (puesto por fuera del servidor) tiene prioridad y descarta la versión guardada
+        self.block_store = BlockStore(base_directory, FileTransferProtocol.DELTA_BLOCK_SIZE)
+        for name, _ in self.block_store.items():
+            if os.path.isfile(self.get_safe_path(name)):
+                self.block_store.remove(name)
+        # Un archivo eliminado se lleva su manifiesto; al iniciar se limpian los que quedaron huérfanos
+        self.index = MetadataIndex(
+            base_directory, on_remove=self.block_index.remove_manifest, store=self.block_store
+        )
+        self.block_index.remove_unreferenced(name for name, _ in self.index.items())
+        if watch:
+            self.index.start_watcher()
     
     def list_files(self):
         """Lista todos los archivos en el directorio compartido"""
         try:
-            files = []
-            for filename in os.listdir(self.base_directory):
-                filepath = os.path.join(self.base_directory, filename)
-                if os.path.isfile(filepath):
-                    size = os.path.getsize(filepath)
-                    files.append(f"{filename} ({size} bytes)")
-            return files
+            return [f"{name} ({entry['size']} bytes)" for name, entry in self.index.items()]
         except Exception as e:
             return [f"Error al listar archivos: {str(e)}"]
     
+    def list_page(self, sort_key, prefix, cursor, page_size):
+        """Una página del listado desde el índice: ([(nombre, tamaño, mtime_ns)], cursor)"""
+        return self.index.page(sort_key, prefix, cursor, page_size)
+    
     def file_exists(self, filename):
         """Verifica si un archivo existe"""
         safe_path = self.get_safe_path(filename)
-        return os.path.exists(safe_path)
+        return os.path.exists(safe_path) or self.block_store.stat(os.path.basename(filename)) is not None
+    
+    def open_file(self, filename):
+        """Abre un archivo compartido para leerlo: el plano si existe, si no el del block store"""
+        try:
+            return open(self.get_safe_path(filename), 'rb')
+        except FileNotFoundError:
+            return self.block_store.open(os.path.basename(filename))
     
     def get_safe_path(self, filename):
         """Obtiene una ruta segura para el archivo"""
         # Implementaríamos la validación de seguridad aquí
         return os.path.join(self.base_directory, filename)
     
+    def open_temp_file(self, filename):
+        """Crea un archivo temporal oculto junto al destino final"""
+        fd, temp_path = tempfile.mkstemp(
+            dir=self.base_directory, prefix=f".{os.path.basename(filename)}.", suffix=".tmp"
+        )
+        return os.fdopen(fd, 'wb'), temp_path
+    
+    def commit_temp_file(self, temp_path, filename, md5=None):
+        """Guarda el temporal en el block store (sin duplicar los bloques que ya estaban) y
+        publica el archivo"""
+        try:
+            digests, size, md5 = self.block_store.ingest(temp_path, md5)
+        finally:
+            self.discard_temp_file(temp_path)
+        self.publish(filename, digests, size, md5)
+    
+    def publish(self, filename, digests, size, md5):
+        """Reemplaza atómicamente el archivo por la versión de bloques digests y actualiza el índice"""
+        name = os.path.basename(filename)
+        stat = self.block_store.publish(name, digests, size, md5)
+        # Una versión plana anterior dejaría oculta a la nueva
+        try:
+            os.remove(self.get_safe_path(filename))
+        except FileNotFoundError:
+            pass
+        self.block_index.remove_manifest(filename)  # Firmas de esa versión plana
+        self.index.set_entry(name, stat, md5)
+    
+    def discard_temp_file(self, temp_path):
+        """Elimina un archivo temporal de una transferencia fallida"""
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+    
+    def get_partial_path(self, filename):
+        """Ruta del archivo parcial de una subida reanudable"""
+        return os.path.join(self.base_directory, f".{os.path.basename(filename)}.part")
+    
+    def start_delta_upload(self, filename, block_size, algorithm='md5'):
+        """Inicia la reconstrucción de un archivo a partir de operaciones delta"""
+        return DeltaUpload(self, filename, block_size, algorithm)
+    
+    def get_signatures(self, filename, block_size):
+        """Firmas de bloques del archivo actual (se indexa si el manifiesto no está al día)"""
+        safe_path = self.get_safe_path(filename)
+        if not os.path.isfile(safe_path):
+            try:
+                return self.block_store.signatures(os.path.basename(filename))
+            except FileNotFoundError:
+                return []
+        signatures = self.block_index.load_manifest(filename, os.stat(safe_path), block_size)
+        if signatures is None:
+            signatures = self.block_index.index_file(filename, safe_path, block_size)
+        return signatures
+    
     def calculate_file_checksum(self, filepath):
-        """Calcula el checksum MD5 de un archivo"""
-        hash_md5 = hashlib.md5()
+        """Calcula el checksum MD5 de un archivo (cacheado en el índice si no cambió)"""
         with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
\ No newline at end of file
+            if os.path.dirname(os.path.abspath(filepath)) != os.path.abspath(self.base_directory):
+                return MetadataIndex.hash_file(f)  # Fuera del directorio compartido: sin caché
+            return self.index.get_md5(os.path.basename(filepath), f)
+    
+    def get_file_checksum(self, filename, fileobj, algorithm='md5'):
+        """Checksum de protocolo de un archivo compartido abierto, sin releerlo si no cambió"""
+        name = os.path.basename(filename)
+        if algorithm == 'md5':
+            return FileTransferProtocol.checksum_from_md5(self.index.get_md5(name, fileobj))
+        return self.index.get_checksum(
+            name, fileobj, algorithm,
+            lambda: FileTransferProtocol.calculate_file_checksum(
+                fileobj, FileTransferProtocol.file_stat(fileobj).st_size, algorithm=algorithm
+            )
+        )
+
+
+class DeltaUpload:
+    """Reconstruye un archivo con operaciones COPY/LITERAL directo en el block store; los COPY
+    se leen de la versión actual (plana o guardada)"""
+    
+    def __init__(self, file_handler, filename, block_size, algorithm='md5'):
+        self.file_handler = file_handler
+        self.block_store = file_handler.block_store
+        self.filename = filename
+        self.block_size = block_size
+        self.hasher = FileTransferProtocol.new_checksum(algorithm)
+        self.digests = []           # Bloques del archivo resultante, ya agregados al store
+        self.size = 0
+        self.pending = bytearray()  # Datos aún no cortados en bloques
+        self.error = None
+        self.source = None          # Versión actual del archivo, de donde salen los COPY
+        self.offsets = {}           # digest -> offset del bloque en la versión actual
+        try:
+            self.source = file_handler.open_file(filename)
+        except FileNotFoundError:
+            return
+        digests = getattr(self.source, 'digests', None)
+        if digests is None:
+            signatures = file_handler.block_index.load_manifest(
+                filename, os.fstat(self.source.fileno()), block_size
+            )
+            digests = [digest for _, digest in signatures or []]
+        for position, digest in enumerate(digests):
+            self.offsets.setdefault(digest, position * block_size)
+    
+    def copy(self, digest):
+        """Agrega un bloque existente; si falta se recuerda el error y se sigue consumiendo el stream"""
+        if self.error:
+            return
+        offset = self.offsets.get(digest)
+        data = FileTransferProtocol.pread(self.source, self.block_size, offset) if offset is not None else b''
+        # El archivo pudo cambiar desde que se enviaron las firmas: se verifica el bloque leído
+        if delta.strong_checksum(data) != digest:
+            self.error = KeyError(f"Bloque {digest.hex()} no encontrado")
+            return
+        self.write(data)
+    
+    def literal(self, data):
+        """Agrega datos nuevos enviados por el cliente"""
+        if not self.error:
+            self.write(data)
+    
+    def write(self, data):
+        """Agrega los datos al checksum y guarda en el store cada bloque completo"""
+        self.hasher.update(data)
+        self.size += len(data)
+        self.pending += data
+        while len(self.pending) >= self.block_size:
+            self.digests.append(self.block_store.add_block(bytes(self.pending[:self.block_size])))
+            del self.pending[:self.block_size]
+    
+    def finish(self, expected_size, expected_checksum):
+        """Verifica tamaño y checksum y publica el archivo"""
+        if self.pending and not self.error:
+            self.digests.append(self.block_store.add_block(bytes(self.pending)))
+            self.pending.clear()
+        self.close()
+        
+        if self.error:
+            raise self.error
+        if self.size != expected_size or FileTransferProtocol.finish_checksum(self.hasher) != expected_checksum:
+            raise ValueError("Checksum no coincide")
+        
+        self.file_handler.publish(self.filename, self.digests, self.size, self.hasher.md5_hexdigest())
+        self.digests = []  # Ahora son del manifiesto
+    
+    def close(self):
+        """Cierra la versión anterior del archivo"""
+        if self.source:
+            self.source.close()
+            self.source = None
+    
+    def abort(self):
+        """Libera los bloques de una reconstrucción que no se completó"""
+        self.close()
+        digests, self.digests = self.digests, []
+        self.block_store.release(digests)
\ No newline at end of file
@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+
+class TransferJournal:
+    """Bitácora lateral (.journal) con los offsets/bloques verificados de una transferencia"""
+    
+    SUFFIX = '.journal'
+    
+    def __init__(self, path, identity, offset=0, blocks=()):
+        self.path = path
+        self.identity = identity  # Describe la transferencia (archivo, tamaño, mtime...)
+        self.offset = offset      # Prefijo verificado (transferencias secuenciales)
+        self.blocks = set(blocks) # Bloques verificados (transferencias multi-stream)
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, target_path, identity):
+        """Carga la bitácora de target_path; si es de otra transferencia empieza de cero"""
+        path = target_path + cls.SUFFIX
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state.get('identity') == identity:
+                return cls(path, identity, state.get('offset', 0), state.get('blocks', []))
+        except (FileNotFoundError, ValueError):
+            pass
+        return cls(path, identity)
+    
+    def save(self):
+        """Guarda la bitácora de forma atómica"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'identity': self.identity,
+                'offset': self.offset,
+                'blocks': sorted(self.blocks)
+            }, f)
+        os.replace(temp_path, self.path)
+    
+    def advance(self, offset):
+        """Registra un nuevo offset verificado"""
+        with self.lock:
+            self.offset = offset
+            self.save()
+    
+    def mark_block(self, index):
+        """Registra un bloque verificado (seguro entre hilos)"""
+        with self.lock:
+            self.blocks.add(index)
+            self.save()
+    
+    def reset(self):
+        """Descarta el progreso registrado"""
+        with self.lock:
+            self.offset = 0
+            self.blocks.clear()
+            self.save()
+    
+    def remove(self):
+        """Elimina la bitácora al terminar la transferencia"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,296 @@
+import bisect
+import hashlib
+import json
+import os
+import stat as stat_module
+import threading
+from directory_watcher import DirectoryWatcher
+from protocol import FileTransferProtocol
+
+class MetadataIndex:
+    """Índice persistente (nombre, tamaño, mtime, inodo, MD5) del directorio compartido.
+    Se guarda como un snapshot (.index.json) más un log de cambios (.index.log) con una
+    línea [nombre, entrada] por cambio (entrada null = borrado); el log se compacta en el
+    snapshot cuando crece más que el índice"""
+    
+    INDEX_FILENAME = '.index.json'
+    LOG_FILENAME = '.index.log'
+    COMPACT_MIN_ENTRIES = 1000  # Cambios en el log antes de considerar compactarlo
+    READ_SIZE = 1024 * 1024
+    VIEW_KEYS = ('size', 'mtime_ns')  # Órdenes del listado además del nombre
+    
+    def __init__(self, directory, scan_interval=2.0, on_remove=None, store=None):
+        self.directory = directory
+        self.store = store  # Archivos guardados fuera del directorio (stat(nombre) e items()); el plano gana
+        self.index_path = os.path.join(directory, self.INDEX_FILENAME)
+        self.log_path = os.path.join(directory, self.LOG_FILENAME)
+        self.scan_interval = scan_interval
+        self.on_remove = on_remove  # Se llama con el nombre de cada archivo que desaparece
+        self.entries = {}  # nombre -> {'size', 'mtime_ns', 'inode', 'md5', 'checksums'}
+        self.sorted_names = []  # Nombres ordenados, mantenidos con bisect
+        self.sorted_views = {}  # clave de orden -> [(valor, nombre)] ordenada, mantenida con bisect
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()  # Una escritura del log o compactación a la vez
+        self.pending = {}  # nombre -> entrada (o None si se borró) todavía no guardada
+        self.log_entries = 0  # Cambios en el log desde la última compactación
+        self.load()
+        self.refresh()
+    
+    def load(self):
+        """Carga el índice guardado y reaplica su log (los MD5 siguen siendo válidos si el
+        archivo no cambió)"""
+        try:
+            with open(self.index_path, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+        self.replay_log()
+        self.sorted_names = sorted(self.entries)
+        self.sorted_views = {
+            key: sorted((entry[key], name) for name, entry in self.entries.items())
+            for key in self.VIEW_KEYS
+        }
+    
+    def replay_log(self):
+        """Aplica los cambios del log sobre el snapshot y descarta una última línea incompleta"""
+        try:
+            with open(self.log_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        valid_size = 0
+        self.log_entries = 0
+        while True:
+            end = data.find(b'\n', valid_size)
+            if end < 0:
+                break
+            try:
+                name, entry = json.loads(data[valid_size:end])
+            except ValueError:
+                break
+            if entry is None:
+                self.entries.pop(name, None)
+            else:
+                self.entries[name] = entry
+            self.log_entries += 1
+            valid_size = end + 1
+        if valid_size < len(data):
+            # Escritura cortada: lo que se agregue después no debe quedar pegado a ella
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(valid_size)
+    
+    def save(self):
+        """Agrega al log los cambios pendientes; compacta en el snapshot cuando el log ya es
+        más grande que el índice (así cada cambio cuesta O(1) amortizado)"""
+        with self.save_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                lines = ''.join(json.dumps([name, entry]) + '\n' for name, entry in self.pending.items())
+                self.log_entries += len(self.pending)
+                self.pending = {}
+                snapshot = None
+                if self.log_entries > max(self.COMPACT_MIN_ENTRIES, len(self.entries)):
+                    snapshot = json.dumps(self.entries)
+                    self.log_entries = 0
+            if snapshot is None:
+                with open(self.log_path, 'a') as f:
+                    f.write(lines)
+                return
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                f.write(snapshot)
+            os.replace(temp_path, self.index_path)
+            # Si se corta antes de vaciar el log, reaplicarlo sobre el snapshot nuevo da lo mismo
+            open(self.log_path, 'w').close()
+    
+    @staticmethod
+    def matches(entry, stat):
+        """Indica si una entrada del índice describe el archivo con ese stat"""
+        return (entry is not None and entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns and entry['inode'] == stat.st_ino)
+    
+    def refresh(self):
+        """Compara el directorio con el índice y actualiza solo lo que cambió"""
+        seen = set()
+        with os.scandir(self.directory) as entries:
+            for dir_entry in entries:
+                if dir_entry.name.startswith('.') or not dir_entry.is_file():
+                    continue  # Temporales, parciales y datos internos
+                seen.add(dir_entry.name)
+                stat = dir_entry.stat()
+                with self.lock:
+                    if not self.matches(self.entries.get(dir_entry.name), stat):
+                        self.set_entry(dir_entry.name, stat)
+        
+        # Los archivos del block store no aparecen en el directorio
+        for name, stat in self.store.items() if self.store else ():
+            if name in seen:
+                continue
+            seen.add(name)
+            with self.lock:
+                if not self.matches(self.entries.get(name), stat):
+                    self.set_entry(name, stat)
+        
+        with self.lock:
+            removed = set(self.entries) - seen
+        for name in removed:
+            self.remove_entry(name)
+        self.save()
+    
+    def set_entry(self, name, stat, md5=None):
+        """Registra la metadata de un archivo (el MD5 se calcula después si no se conoce)"""
+        with self.lock:
+            old = self.entries.get(name)
+            if old is None:
+                bisect.insort(self.sorted_names, name)
+            entry = self.entries[name] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'inode': stat.st_ino,
+                'md5': md5,
+                'checksums': {}  # algoritmo -> checksum del protocolo
+            }
+            self.pending[name] = entry
+            for key, view in self.sorted_views.items():
+                if old is not None and old[key] == entry[key]:
+                    continue
+                if old is not None:
+                    del view[bisect.bisect_left(view, (old[key], name))]
+                bisect.insort(view, (entry[key], name))
+    
+    def remove_entry(self, name):
+        """Quita un archivo del índice"""
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is None:
+                return
+            del self.sorted_names[bisect.bisect_left(self.sorted_names, name)]
+            for key, view in self.sorted_views.items():
+                del view[bisect.bisect_left(view, (entry[key], name))]
+            self.pending[name] = None
+        if self.on_remove:
+            self.on_remove(name)
+    
+    def sync_entry(self, name):
+        """Actualiza un archivo que cambió por fuera del servidor (conserva el MD5 si no cambió)"""
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            stat = None
+        if (stat is None or not stat_module.S_ISREG(stat.st_mode)) and self.store:
+            stat = self.store.stat(name)
+        if stat is None or not stat_module.S_ISREG(stat.st_mode):
+            self.remove_entry(name)
+            return
+        with self.lock:
+            if not self.matches(self.entries.get(name), stat):
+                self.set_entry(name, stat)
+    
+    def get(self, name):
+        """Metadata de un archivo según el índice"""
+        with self.lock:
+            return self.entries.get(name)
+    
+    def items(self):
+        """Copia de las entradas del índice"""
+        with self.lock:
+            return list(self.entries.items())
+    
+    def page(self, sort_key, prefix, cursor, page_size):
+        """Retorna una página [(nombre, tamaño, mtime_ns)] y el cursor de la siguiente (o None)"""
+        results = []
+        with self.lock:
+            if sort_key == 'name':
+                # Los nombres con el prefijo son contiguos en el orden por nombre
+                names = self.sorted_names
+                start = bisect.bisect_left(names, prefix)
+                if cursor is not None:
+                    start = max(start, bisect.bisect_right(names, cursor))
+                position = start
+                while position < len(names) and len(results) < page_size:
+                    name = names[position]
+                    if not name.startswith(prefix):
+                        return results, None
+                    entry = self.entries[name]
+                    results.append((name, entry['size'], entry['mtime_ns']))
+                    position += 1
+                more = position < len(names) and names[position].startswith(prefix)
+                return results, (results[-1][0] if more and results else None)
+            
+            view = self.sorted_views[sort_key]
+            position = bisect.bisect_right(view, cursor) if cursor is not None else 0
+            last_key = None
+            while position < len(view) and len(results) < page_size:
+                last_key = view[position]
+                position += 1
+                name = last_key[1]
+                if name.startswith(prefix):
+                    entry = self.entries[name]
+                    results.append((name, entry['size'], entry['mtime_ns']))
+            return results, (last_key if position < len(view) else None)
+    
+    def get_md5(self, name, fileobj):
+        """MD5 de un archivo abierto; solo se recalcula si cambió desde la última vez"""
+        stat = FileTransferProtocol.file_stat(fileobj)
+        with self.lock:
+            entry = self.entries.get(name)
+            if self.matches(entry, stat) and entry['md5']:
+                return entry['md5']
+        
+        md5 = self.hash_file(fileobj)
+        self.set_entry(name, stat, md5)
+        return md5
+    
+    def get_checksum(self, name, fileobj, algorithm, compute):
+        """Checksum de protocolo con otro algoritmo; compute() solo se llama si cambió el archivo"""
+        stat = FileTransferProtocol.file_stat(fileobj)
+        with self.lock:
+            entry = self.entries.get(name)
+            if self.matches(entry, stat) and algorithm in entry.get('checksums', {}):
+                return entry['checksums'][algorithm]
+        
+        checksum = compute()
+        with self.lock:
+            entry = self.entries.get(name)
+            if not self.matches(entry, stat):
+                self.set_entry(name, stat)
+                entry = self.entries[name]
+            entry.setdefault('checksums', {})[algorithm] = checksum
+            self.pending[name] = entry
+        return checksum
+    
+    @classmethod
+    def hash_file(cls, fileobj):
+        """Calcula el MD5 completo de un archivo abierto leyendo bloques grandes"""
+        hash_md5 = hashlib.md5()
+        position = fileobj.tell()
+        fileobj.seek(0)
+        for chunk in iter(lambda: fileobj.read(cls.READ_SIZE), b""):
+            hash_md5.update(chunk)
+        fileobj.seek(position)
+        return hash_md5.hexdigest()
+    
+    def start_watcher(self):
+        """Inicia un hilo que mantiene el índice al día con cambios externos: solo reescanea
+        el directorio completo cuando el watcher no puede decir qué archivos cambiaron"""
+        watcher = DirectoryWatcher(self.directory, self.scan_interval)
+        
+        def watch():
+            while True:
+                try:
+                    changed = watcher.wait()
+                    if changed is None:
+                        self.refresh()
+                        continue
+                    for name in changed:
+                        if not name.startswith('.'):  # Temporales, parciales y datos internos
+                            self.sync_entry(name)
+                    # También guarda lo que registraron las transferencias del servidor
+                    self.save()
+                except Exception as e:
+                    print(f"Error actualizando índice: {e}")
+        
+        watcher_thread = threading.Thread(target=watch)
+        watcher_thread.daemon = True
+        watcher_thread.start()
@@ -1,6 +1,9 @@
 import struct
-import hashlib
 import os
+import json
+import zlib
+import lzma
+import checksums
 
 class FileTransferProtocol:
     # Comandos
@@ -12,10 +15,55 @@ class FileTransferProtocol:
     CMD_DATA = b'DATA'
     CMD_END = b'END'
     
+    # Comandos que usan el header versión 2 (tamaños y offsets de 64 bits)
+    CMD_RESUME = b'RSUM'  # Sube un segmento del archivo a partir de un offset
+    CMD_RANGE = b'RANG'   # Descarga un rango del archivo a partir de un offset
+    CMD_SIGNATURES = b'SIGS'  # Pide las firmas de bloques de un archivo del servidor
+    CMD_DELTA = b'DLTA'       # Sube un archivo como delta contra esas firmas
+    CMD_LIST_PAGE = b'LSTP'   # Lista una página de archivos (cursor, prefijo, orden)
+    CMD_HELLO = b'HELO'       # Negociación de capacidades al conectar
+    V2_COMMANDS = (CMD_RESUME, CMD_RANGE, CMD_SIGNATURES, CMD_DELTA, CMD_LIST_PAGE, CMD_HELLO)
+    
+    # Operaciones del stream delta
+    DELTA_COPY = b'C'     # + 16 bytes digest de un bloque existente
+    DELTA_LITERAL = b'L'  # + 4 bytes longitud + datos nuevos
+    DELTA_END = b'E'
+    SIGNATURE_FORMAT = '!I16s'  # checksum débil + digest fuerte por bloque
+    
+    # Listado paginado
+    LIST_SORT_KEYS = ('name', 'size', 'mtime_ns')
+    LIST_REQUEST_FORMAT = '!BI'  # clave de orden + tamaño de página
+    LIST_RECORD_FORMAT = '!QQH'  # tamaño + mtime_ns + largo del nombre, seguido del nombre
+    LIST_PAGE_SIZE = 1000
+    LIST_MAX_PAGE_SIZE = 10000
+    
     # Tamaño del buffer
     BUFFER_SIZE = 4096
+    STREAM_BUFFER_SIZE = 256 * 1024  # Buffer reutilizable para transferencias en streaming
     HEADER_SIZE = 12  # 4 bytes comando + 4 bytes tamaño + 4 bytes checksum
     
+    # Header versión 2: 4 comando + 1 versión + 1 flags + 2 algoritmo de checksum
+    #                   + 8 tamaño + 8 offset + 8 checksum
+    PROTOCOL_VERSION = 2
+    HEADER_V2_FORMAT = '!4sBBHQQQ'
+    HEADER_V2_SIZE = 32
+    FLAG_FINAL = 0x01  # El segmento termina el archivo
+    FLAG_QUERY = 0x02  # Solo consulta el estado (offset parcial o tamaño del archivo)
+    
+    # Algoritmos de checksum (id en el header v2); md5 es el único de los comandos v1
+    CHECKSUM_ALGORITHMS = checksums.ALGORITHMS
+    DEFAULT_CHECKSUM = 'md5'
+    
+    # Compresión por transferencia: el flag indica el codec del payload
+    COMPRESSION_FLAGS = {'zlib': 0x04, 'lzma': 0x08}
+    COMPRESSION_CODECS = ('zlib', 'lzma')  # Orden de preferencia
+    DEFAULT_COMPRESSION_LEVEL = 6
+    COMPRESSION_MIN_RATIO = 0.9  # Si la muestra no baja de 90% se envía sin comprimir
+    RESUME_SEGMENT_SIZE = 8 * 1024 * 1024  # Granularidad de los offsets verificados
+    PARALLEL_BLOCK_SIZE = 4 * 1024 * 1024  # Bloque de las transferencias multi-stream
+    DELTA_BLOCK_SIZE = 64 * 1024  # Bloque de la sincronización delta y de sus manifiestos
+    DELTA_MAX_LITERAL = DELTA_BLOCK_SIZE  # Un LITERAL no supera un bloque: acota lo que el servidor reserva
+    
     @staticmethod
     def create_header(command, data_size=0, checksum=0):
         """Crea un header para el protocolo"""
@@ -26,14 +74,400 @@ class FileTransferProtocol:
         """Parsea el header del protocolo"""
         try:
             command, data_size, checksum = struct.unpack('!4sII', header)
-            return command, data_size, checksum
+            # Los comandos de 3 bytes (ACK, ERR, END) llegan rellenos con \x00
+            return command.rstrip(b'\x00'), data_size, checksum
         except:
             return None, 0, 0
     
     @staticmethod
-    def calculate_checksum(data):
-        """Calcula checksum MD5 de los datos"""
-        return int(hashlib.md5(data).hexdigest()[:8], 16) & 0xFFFFFFFF
+    def create_header_v2(command, data_size=0, offset=0, checksum=0, flags=0, algorithm='md5'):
+        """Crea un header versión 2 con tamaño y offset de 64 bits"""
+        return struct.pack(
+            FileTransferProtocol.HEADER_V2_FORMAT, command,
+            FileTransferProtocol.PROTOCOL_VERSION, flags,
+            FileTransferProtocol.CHECKSUM_ALGORITHMS[algorithm], data_size, offset, checksum
+        )
+    
+    @staticmethod
+    def parse_header_v2(header):
+        """Parsea un header versión 2: (comando, flags, tamaño, offset, checksum, algoritmo)"""
+        try:
+            command, version, flags, algorithm_id, data_size, offset, checksum = struct.unpack(
+                FileTransferProtocol.HEADER_V2_FORMAT, header
+            )
+        except struct.error:
+            return None, 0, 0, 0, 0, None
+        if version != FileTransferProtocol.PROTOCOL_VERSION:
+            return None, 0, 0, 0, 0, None
+        return (command.rstrip(b'\x00'), flags, data_size, offset, checksum,
+                checksums.algorithm_name(algorithm_id))
+    
+    @staticmethod
+    def recv_header_v2(sock):
+        """Recibe y parsea un header versión 2 completo"""
+        header = FileTransferProtocol.recv_exact(sock, FileTransferProtocol.HEADER_V2_SIZE)
+        return FileTransferProtocol.parse_header_v2(header)
+    
+    @staticmethod
+    def recv_header(sock):
+        """Recibe un header completo; retorna None si la conexión se cerró"""
+        first = sock.recv(FileTransferProtocol.HEADER_SIZE)
+        if not first:
+            return None
+        if len(first) < FileTransferProtocol.HEADER_SIZE:
+            first += FileTransferProtocol.recv_exact(
+                sock, FileTransferProtocol.HEADER_SIZE - len(first)
+            )
+        return first
+    
+    @staticmethod
+    def recv_exact(sock, size):
+        """Recibe exactamente size bytes del socket"""
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:], size - received)
+            if n == 0:
+                raise ConnectionError("Conexión cerrada antes de completar la lectura")
+            received += n
+        return bytes(buffer)
+    
+    @staticmethod
+    def calculate_checksum(data, algorithm='md5'):
+        """Calcula el checksum de los datos con el algoritmo indicado"""
+        hasher = FileTransferProtocol.new_checksum(algorithm)
+        hasher.update(data)
+        return hasher.value()
+    
+    @staticmethod
+    def new_checksum(algorithm='md5'):
+        """Crea un hasher para calcular el checksum de forma incremental"""
+        return checksums.Checksum(algorithm)
+    
+    @staticmethod
+    def finish_checksum(hasher):
+        """Convierte un hasher incremental al checksum del protocolo"""
+        return hasher.value()
+    
+    @staticmethod
+    def checksum_from_md5(hexdigest):
+        """Checksum de 32 bits del protocolo a partir de un MD5 completo"""
+        return int(hexdigest[:8], 16) & 0xFFFFFFFF
+    
+    @staticmethod
+    def file_stat(fileobj):
+        """stat de un archivo abierto; un archivo del block store (StoredFile) da el suyo"""
+        stat = getattr(fileobj, 'stat', None)
+        return stat() if stat else os.fstat(fileobj.fileno())
+    
+    @staticmethod
+    def pread(fileobj, size, offset):
+        """Lee hasta size bytes desde offset de un archivo abierto o de un StoredFile"""
+        pread = getattr(fileobj, 'pread', None)
+        return pread(size, offset) if pread else os.pread(fileobj.fileno(), size, offset)
+    
+    @staticmethod
+    def read_into(fileobj, view, offset):
+        """preadv en view desde offset; un StoredFile no tiene un único descriptor"""
+        readinto_at = getattr(fileobj, 'readinto_at', None)
+        return readinto_at(view, offset) if readinto_at else os.preadv(fileobj.fileno(), [view], offset)
+    
+    @staticmethod
+    def calculate_file_checksum(fileobj, size, offset=0, buffer=None, algorithm='md5'):
+        """Calcula el checksum de size bytes de un archivo abierto desde offset"""
+        hasher = FileTransferProtocol.new_checksum(algorithm)
+        if checksums.use_pipeline(size):
+            # Leer el siguiente bloque mientras otro hilo hashea el anterior
+            with checksums.HashPipeline(hasher, FileTransferProtocol.STREAM_BUFFER_SIZE) as pipeline:
+                position = offset
+                remaining = size
+                while remaining > 0:
+                    buffer = pipeline.acquire()
+                    view = memoryview(buffer)[:min(len(buffer), remaining)]
+                    n = FileTransferProtocol.read_into(fileobj, view, position)
+                    if not n:
+                        raise IOError("El archivo es más corto de lo esperado")
+                    pipeline.submit(buffer, n)
+                    position += n
+                    remaining -= n
+            fileobj.seek(offset)
+            return FileTransferProtocol.finish_checksum(hasher)
+        
+        if buffer is None:
+            buffer = bytearray(FileTransferProtocol.STREAM_BUFFER_SIZE)
+        view = memoryview(buffer)
+        fileobj.seek(offset)
+        remaining = size
+        while remaining > 0:
+            n = fileobj.readinto(view[:min(len(view), remaining)])
+            if not n:
+                raise IOError("El archivo es más corto de lo esperado")
+            hasher.update(view[:n])
+            remaining -= n
+        fileobj.seek(offset)
+        return FileTransferProtocol.finish_checksum(hasher)
+    
+    @staticmethod
+    def recv_to_file(sock, fileobj, size, hasher=None, buffer=None):
+        """Recibe size bytes directo del socket al archivo con un buffer reutilizable"""
+        if hasher is not None and checksums.use_pipeline(size):
+            fileobj.flush()
+            FileTransferProtocol.recv_to_fd_pipelined(sock, fileobj.fileno(), size, fileobj.tell(), hasher)
+            fileobj.seek(size, os.SEEK_CUR)
+            return
+        if buffer is None:
+            buffer = bytearray(FileTransferProtocol.STREAM_BUFFER_SIZE)
+        view = memoryview(buffer)
+        remaining = size
+        while remaining > 0:
+            n = sock.recv_into(view, min(len(view), remaining))
+            if n == 0:
+                raise ConnectionError("Conexión cerrada durante la transferencia")
+            chunk = view[:n]
+            if hasher is not None:
+                hasher.update(chunk)
+            fileobj.write(chunk)
+            remaining -= n
+    
+    @staticmethod
+    def recv_to_fd(sock, fd, size, offset, hasher=None, buffer=None):
+        """Recibe size bytes del socket y los escribe con pwrite desde offset"""
+        if hasher is not None and checksums.use_pipeline(size):
+            FileTransferProtocol.recv_to_fd_pipelined(sock, fd, size, offset, hasher)
+            return
+        if buffer is None:
+            buffer = bytearray(FileTransferProtocol.STREAM_BUFFER_SIZE)
+        view = memoryview(buffer)
+        writer = SegmentWriter(fd, size, offset, hasher=hasher)
+        remaining = size
+        while remaining > 0:
+            n = sock.recv_into(view, min(len(view), remaining))
+            if n == 0:
+                raise ConnectionError("Conexión cerrada durante la transferencia")
+            writer.write(view[:n])
+            remaining -= n
+    
+    @staticmethod
+    def recv_to_fd_pipelined(sock, fd, size, offset, hasher):
+        """Como recv_to_fd, pero el hash corre en otro hilo mientras se sigue recibiendo"""
+        writer = SegmentWriter(fd, size, offset)
+        with checksums.HashPipeline(hasher, FileTransferProtocol.STREAM_BUFFER_SIZE) as pipeline:
+            remaining = size
+            while remaining > 0:
+                buffer = pipeline.acquire()
+                view = memoryview(buffer)
+                n = sock.recv_into(view, min(len(view), remaining))
+                if n == 0:
+                    raise ConnectionError("Conexión cerrada durante la transferencia")
+                writer.write(view[:n])
+                pipeline.submit(buffer, n)
+                remaining -= n
+    
+    @staticmethod
+    def new_compressor(codec, level):
+        """Compresor en streaming para el codec negociado"""
+        if codec == 'zlib':
+            return zlib.compressobj(level)
+        if codec == 'lzma':
+            return lzma.LZMACompressor(preset=level)
+        raise ValueError(f"Codec no soportado: {codec}")
+    
+    @staticmethod
+    def new_decompressor(codec):
+        """Descompresor en streaming para el codec negociado"""
+        if codec == 'zlib':
+            return zlib.decompressobj()
+        if codec == 'lzma':
+            return lzma.LZMADecompressor()
+        raise ValueError(f"Codec no soportado: {codec}")
+    
+    @staticmethod
+    def codec_from_flags(flags):
+        """Codec de compresión indicado en los flags del header (None = sin comprimir)"""
+        for codec, flag in FileTransferProtocol.COMPRESSION_FLAGS.items():
+            if flags & flag:
+                return codec
+        return None
+    
+    @staticmethod
+    def negotiate_checksum(proposed):
+        """Algoritmo de checksum que elige el servidor entre los que propuso el cliente"""
+        return checksums.negotiate(proposed, FileTransferProtocol.DEFAULT_CHECKSUM)
+    
+    @staticmethod
+    def choose_compression(codec, level, fileobj, size, offset):
+        """Comprime una muestra del segmento y decide si vale la pena comprimirlo"""
+        if codec is None or size == 0:
+            return None
+        sample = FileTransferProtocol.pread(fileobj, min(size, FileTransferProtocol.STREAM_BUFFER_SIZE), offset)
+        compressor = FileTransferProtocol.new_compressor(codec, level)
+        compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+        if compressed_size < len(sample) * FileTransferProtocol.COMPRESSION_MIN_RATIO:
+            return codec
+        return None
+    
+    @staticmethod
+    def send_compressed_from_file(sock, fileobj, size, offset, codec, level, buffer=None):
+        """Envía un segmento comprimido como frames [4 bytes largo + datos], terminando en 0"""
+        if buffer is None:
+            buffer = bytearray(FileTransferProtocol.STREAM_BUFFER_SIZE)
+        view = memoryview(buffer)
+        compressor = FileTransferProtocol.new_compressor(codec, level)
+        remaining = size
+        while remaining > 0:
+            n = FileTransferProtocol.read_into(fileobj, view[:min(len(view), remaining)], offset)
+            if not n:
+                raise IOError("El archivo es más corto de lo esperado")
+            compressed = compressor.compress(view[:n])
+            if compressed:
+                sock.sendall(struct.pack('!I', len(compressed)) + compressed)
+            offset += n
+            remaining -= n
+        compressed = compressor.flush()
+        if compressed:
+            sock.sendall(struct.pack('!I', len(compressed)) + compressed)
+        sock.sendall(struct.pack('!I', 0))
+    
+    @staticmethod
+    def iter_decompressed(decompressor, data, max_length):
+        """Descomprime data en pedazos de a lo sumo max_length bytes"""
+        if isinstance(decompressor, lzma.LZMADecompressor):
+            chunk = decompressor.decompress(data, max_length)
+            while chunk:
+                yield chunk
+                if decompressor.eof or decompressor.needs_input:
+                    break
+                chunk = decompressor.decompress(b'', max_length)
+        else:
+            chunk = decompressor.decompress(data, max_length)
+            while chunk:
+                yield chunk
+                chunk = decompressor.decompress(decompressor.unconsumed_tail, max_length)
+    
+    @staticmethod
+    def recv_compressed_to_fd(sock, fd, size, offset, codec, hasher=None):
+        """Recibe un segmento comprimido, lo descomprime y lo escribe con pwrite"""
+        writer = SegmentWriter(fd, size, offset, codec, hasher)
+        while True:
+            length = struct.unpack('!I', FileTransferProtocol.recv_exact(sock, 4))[0]
+            if length == 0:
+                break
+            writer.write_compressed(FileTransferProtocol.recv_exact(sock, length))
+        writer.finish()
+    
+    @staticmethod
+    def recv_segment_to_fd(sock, fd, size, offset, flags, hasher=None):
+        """Recibe un segmento (comprimido o no, según los flags) y lo escribe desde offset"""
+        codec = FileTransferProtocol.codec_from_flags(flags)
+        if codec:
+            FileTransferProtocol.recv_compressed_to_fd(sock, fd, size, offset, codec, hasher)
+        else:
+            FileTransferProtocol.recv_to_fd(sock, fd, size, offset, hasher)
+    
+    @staticmethod
+    def send_segment_from_file(sock, fileobj, size, offset, codec=None, level=DEFAULT_COMPRESSION_LEVEL):
+        """Envía un segmento comprimido con codec, o con sendfile si codec es None"""
+        if codec:
+            FileTransferProtocol.send_compressed_from_file(sock, fileobj, size, offset, codec, level)
+        else:
+            FileTransferProtocol.send_from_file(sock, fileobj, size, offset)
+    
+    @staticmethod
+    def encode_hello(capabilities):
+        """Payload JSON de HELO con las capacidades propuestas o elegidas"""
+        return json.dumps(capabilities).encode()
+    
+    @staticmethod
+    def decode_hello(payload):
+        """Decodifica el payload JSON de HELO"""
+        return json.loads(payload.decode()) if payload else {}
+    
+    @staticmethod
+    def send_from_file(sock, fileobj, size, offset=0):
+        """Envía size bytes de un archivo usando sendfile (sin copiar a Python); un StoredFile
+        hace un sendfile por bloque"""
+        if size == 0:
+            return
+        send_to = getattr(fileobj, 'send_to', None)
+        sent = send_to(sock, size, offset) if send_to else sock.sendfile(fileobj, offset, size)
+        if sent != size:
+            raise IOError("El archivo cambió durante el envío")
+    
+    @staticmethod
+    def pack_bytes(data):
+        """Bytes precedidos por su longitud (2 bytes)"""
+        return struct.pack('!H', len(data)) + data
+    
+    @staticmethod
+    def unpack_bytes(payload, offset):
+        """Lee bytes precedidos por su longitud; retorna (bytes, nuevo offset)"""
+        (length,) = struct.unpack_from('!H', payload, offset)
+        offset += 2
+        return payload[offset:offset + length], offset + length
+    
+    @staticmethod
+    def encode_list_cursor(sort_key, cursor):
+        """Codifica el cursor de paginación: nombre, o valor de orden + nombre"""
+        if cursor is None:
+            return b''
+        if sort_key == 'name':
+            return cursor.encode()
+        value, name = cursor
+        return struct.pack('!Q', value) + name.encode()
+    
+    @staticmethod
+    def decode_list_cursor(sort_key, data):
+        """Decodifica un cursor generado por encode_list_cursor"""
+        if not data:
+            return None
+        if sort_key == 'name':
+            return data.decode()
+        return struct.unpack('!Q', data[:8])[0], data[8:].decode()
+    
+    @staticmethod
+    def encode_list_request(sort_key, page_size, prefix, cursor_data):
+        """Payload de LSTP: orden, tamaño de página, prefijo y cursor opaco"""
+        return (struct.pack(FileTransferProtocol.LIST_REQUEST_FORMAT,
+                            FileTransferProtocol.LIST_SORT_KEYS.index(sort_key), page_size)
+                + FileTransferProtocol.pack_bytes(prefix.encode())
+                + FileTransferProtocol.pack_bytes(cursor_data))
+    
+    @staticmethod
+    def decode_list_request(payload):
+        """Decodifica el payload de LSTP: (orden, tamaño de página, prefijo, cursor)"""
+        sort_index, page_size = struct.unpack_from(FileTransferProtocol.LIST_REQUEST_FORMAT, payload)
+        offset = struct.calcsize(FileTransferProtocol.LIST_REQUEST_FORMAT)
+        prefix, offset = FileTransferProtocol.unpack_bytes(payload, offset)
+        cursor_data, offset = FileTransferProtocol.unpack_bytes(payload, offset)
+        sort_key = FileTransferProtocol.LIST_SORT_KEYS[sort_index]
+        return sort_key, page_size, prefix.decode(), cursor_data
+    
+    @staticmethod
+    def encode_list_page(records, cursor_data):
+        """Payload de una página: cursor siguiente + registros binarios de largo prefijado"""
+        parts = [FileTransferProtocol.pack_bytes(cursor_data)]
+        for name, size, mtime_ns in records:
+            name_encoded = name.encode()
+            parts.append(struct.pack(FileTransferProtocol.LIST_RECORD_FORMAT,
+                                     size, mtime_ns, len(name_encoded)))
+            parts.append(name_encoded)
+        return b''.join(parts)
+    
+    @staticmethod
+    def decode_list_page(payload):
+        """Decodifica una página: (cursor siguiente, [(nombre, tamaño, mtime_ns)])"""
+        cursor_data, offset = FileTransferProtocol.unpack_bytes(payload, 0)
+        record_size = struct.calcsize(FileTransferProtocol.LIST_RECORD_FORMAT)
+        records = []
+        while offset < len(payload):
+            size, mtime_ns, name_length = struct.unpack_from(
+                FileTransferProtocol.LIST_RECORD_FORMAT, payload, offset
+            )
+            offset += record_size
+            records.append((payload[offset:offset + name_length].decode(), size, mtime_ns))
+            offset += name_length
+        return cursor_data, records
     
     @staticmethod
     def safe_path(base_path, filename):
@@ -45,4 +479,39 @@ class FileTransferProtocol:
         if not full_path.startswith(base_path):
             raise ValueError("Intento de acceso a ruta no permitida")
         
-        return full_path
\ No newline at end of file
+        return full_path
+
+
+class SegmentWriter:
+    """Escribe un segmento (crudo o comprimido) con pwrite desde offset, calculando su checksum"""
+    
+    def __init__(self, fd, size, offset, codec=None, hasher=None):
+        self.fd = fd
+        self.size = size
+        self.offset = offset
+        self.hasher = hasher
+        self.received = 0
+        self.decompressor = FileTransferProtocol.new_decompressor(codec) if codec else None
+    
+    def write(self, data):
+        """Escribe datos sin comprimir a continuación de lo ya recibido"""
+        self.received += len(data)
+        if self.received > self.size:
+            raise ValueError("Los datos exceden el tamaño anunciado")
+        if self.hasher is not None:
+            self.hasher.update(data)
+        written = 0
+        while written < len(data):
+            written += os.pwrite(self.fd, data[written:], self.offset + written)
+        self.offset += len(data)
+    
+    def write_compressed(self, frame):
+        """Descomprime un frame en pedazos acotados y los escribe"""
+        for chunk in FileTransferProtocol.iter_decompressed(
+                self.decompressor, frame, FileTransferProtocol.STREAM_BUFFER_SIZE):
+            self.write(chunk)
+    
+    def finish(self):
+        """Verifica que se recibió exactamente el tamaño anunciado"""
+        if self.received != self.size:
+            raise ValueError("Los datos recibidos no tienen el tamaño anunciado")
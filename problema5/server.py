@@ -4,12 +4,13 @@ import os
 import struct
 from protocol import FileTransferProtocol
 from file_handler import FileHandler
+import commands
 
 class FileServer:
-    def __init__(self, host='localhost', port=9000):
+    def __init__(self, host='localhost', port=9000, base_directory='shared_files'):
         self.host = host
         self.port = port
-        self.file_handler = FileHandler('shared_files')
+        self.file_handler = FileHandler(base_directory)
         self.running = False
     
     def start(self):
@@ -18,6 +19,7 @@ class FileServer:
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.host, self.port))
         self.socket.listen(5)
+        self.port = self.socket.getsockname()[1]  # Puerto real si se pidió el 0
         
         print(f"Servidor escuchando en {self.host}:{self.port}")
         self.running = True
@@ -25,6 +27,8 @@ class FileServer:
         while self.running:
             try:
                 client_socket, address = self.socket.accept()
+                # Las respuestas cortas (ACK, header antes del archivo) salen sin esperar al ACK retrasado
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 print(f"Conexión aceptada de {address}")
                 
                 # Manejar cliente en hilo separado
@@ -42,16 +46,25 @@ class FileServer:
     
     def handle_client(self, client_socket, address):
         """Maneja la comunicación con un cliente"""
+        # Capacidades negociadas con HELO para esta conexión
+        session = commands.new_session()
         try:
             while True:
                 # Recibir header
-                header = client_socket.recv(FileTransferProtocol.HEADER_SIZE)
+                header = FileTransferProtocol.recv_header(client_socket)
                 if not header:
                     break
                 
                 command, data_size, checksum = FileTransferProtocol.parse_header(header)
                 
-                if command == FileTransferProtocol.CMD_UPLOAD:
+                if command in FileTransferProtocol.V2_COMMANDS:
+                    # Completar el header versión 2
+                    header += FileTransferProtocol.recv_exact(
+                        client_socket,
+                        FileTransferProtocol.HEADER_V2_SIZE - FileTransferProtocol.HEADER_SIZE
+                    )
+                    self.handle_v2_command(client_socket, header, session)
+                elif command == FileTransferProtocol.CMD_UPLOAD:
                     self.handle_upload(client_socket, data_size, checksum)
                 elif command == FileTransferProtocol.CMD_DOWNLOAD:
                     self.handle_download(client_socket, data_size)
@@ -66,88 +79,170 @@ class FileServer:
             client_socket.close()
             print(f"Conexión cerrada con {address}")
     
+    def receive_filename(self, client_socket):
+        """Recibe el nombre de archivo precedido por su longitud"""
+        filename_size = struct.unpack('!I', FileTransferProtocol.recv_exact(client_socket, 4))[0]
+        return FileTransferProtocol.recv_exact(client_socket, filename_size).decode()
+    
     def handle_upload(self, client_socket, data_size, expected_checksum):
         """Maneja subida de archivos"""
+        temp_path = None
         try:
             # Recibir nombre del archivo
-            filename_size = struct.unpack('!I', client_socket.recv(4))[0]
-            filename = client_socket.recv(filename_size).decode()
-            
-            safe_path = self.file_handler.get_safe_path(filename)
-            
-            # Recibir datos del archivo
-            received_data = b''
-            bytes_received = 0
+            filename = self.receive_filename(client_socket)
             
-            while bytes_received < data_size:
-                chunk_size = min(FileTransferProtocol.BUFFER_SIZE, data_size - bytes_received)
-                chunk = client_socket.recv(chunk_size)
-                if not chunk:
-                    break
-                received_data += chunk
-                bytes_received += len(chunk)
+            # Recibir datos del archivo directo a un temporal, calculando el checksum
+            hasher = FileTransferProtocol.new_checksum()
+            temp_file, temp_path = self.file_handler.open_temp_file(filename)
+            with temp_file:
+                FileTransferProtocol.recv_to_file(client_socket, temp_file, data_size, hasher)
             
             # Verificar checksum
-            actual_checksum = FileTransferProtocol.calculate_checksum(received_data)
+            actual_checksum = FileTransferProtocol.finish_checksum(hasher)
             if actual_checksum != expected_checksum:
                 raise ValueError("Checksum no coincide")
             
-            # Guardar archivo
-            with open(safe_path, 'wb') as f:
-                f.write(received_data)
+            # Publicar el archivo de forma atómica (el índice guarda el MD5 ya calculado)
+            self.file_handler.commit_temp_file(temp_path, filename, hasher.md5_hexdigest())
+            temp_path = None
             
             # Enviar confirmación
             ack_header = FileTransferProtocol.create_header(FileTransferProtocol.CMD_ACK)
-            client_socket.send(ack_header)
+            client_socket.sendall(ack_header)
             
             print(f"Archivo {filename} recibido exitosamente")
             
         except Exception as e:
-            error_msg = str(e).encode()
-            error_header = FileTransferProtocol.create_header(
-                FileTransferProtocol.CMD_ERROR, len(error_msg)
-            )
-            client_socket.send(error_header + error_msg)
+            client_socket.sendall(commands.error_reply(e))
+        finally:
+            if temp_path:
+                self.file_handler.discard_temp_file(temp_path)
     
     def handle_download(self, client_socket, data_size):
         """Maneja descarga de archivos"""
         try:
             # Recibir nombre del archivo
-            filename_size = struct.unpack('!I', client_socket.recv(4))[0]
-            filename = client_socket.recv(filename_size).decode()
+            filename = self.receive_filename(client_socket)
             
-            safe_path = self.file_handler.get_safe_path(filename)
+            with commands.open_shared_file(self.file_handler, filename) as f:
+                # Checksum desde el índice; solo se relee el archivo si cambió
+                file_size = FileTransferProtocol.file_stat(f).st_size
+                checksum = self.file_handler.get_file_checksum(filename, f)
+                
+                # Enviar header con información del archivo
+                header = FileTransferProtocol.create_header(
+                    FileTransferProtocol.CMD_DATA, file_size, checksum
+                )
+                client_socket.sendall(header)
+                
+                # Enviar datos del archivo con sendfile
+                FileTransferProtocol.send_from_file(client_socket, f, file_size)
+            
+            print(f"Archivo {filename} enviado exitosamente")
             
-            if not os.path.exists(safe_path):
-                raise FileNotFoundError("Archivo no encontrado")
+        except Exception as e:
+            client_socket.sendall(commands.error_reply(e))
+    
+    def handle_v2_command(self, client_socket, header, session):
+        """Despacha los comandos que usan el header versión 2"""
+        command, flags, data_size, offset, checksum, algorithm = FileTransferProtocol.parse_header_v2(header)
+        
+        if command == FileTransferProtocol.CMD_HELLO:
+            self.handle_hello(client_socket, data_size, session)
+        elif command == FileTransferProtocol.CMD_RESUME:
+            self.handle_resume(client_socket, flags, data_size, offset, checksum, algorithm)
+        elif command == FileTransferProtocol.CMD_RANGE:
+            self.handle_range(client_socket, flags, data_size, offset, session)
+        elif command == FileTransferProtocol.CMD_SIGNATURES:
+            self.handle_signatures(client_socket)
+        elif command == FileTransferProtocol.CMD_DELTA:
+            self.handle_delta(client_socket, data_size, checksum, algorithm)
+        elif command == FileTransferProtocol.CMD_LIST_PAGE:
+            self.handle_list_page(client_socket, data_size)
+        else:
+            raise ValueError("Versión de protocolo no soportada")
+    
+    def send_error_v2(self, client_socket, error):
+        """Envía un error con header versión 2"""
+        client_socket.sendall(commands.error_reply_v2(error))
+    
+    def handle_hello(self, client_socket, data_size, session):
+        """Negocia las capacidades de la conexión (compresión y nivel)"""
+        try:
+            payload = FileTransferProtocol.recv_exact(client_socket, data_size)
+            client_socket.sendall(commands.hello(payload, session))
             
-            # Leer archivo y calcular checksum
-            with open(safe_path, 'rb') as f:
-                file_data = f.read()
+        except Exception as e:
+            self.send_error_v2(client_socket, e)
+    
+    def handle_resume(self, client_socket, flags, data_size, offset, expected_checksum, algorithm):
+        """Maneja un segmento de una subida reanudable"""
+        try:
+            filename = self.receive_filename(client_socket)
             
-            checksum = FileTransferProtocol.calculate_checksum(file_data)
+            # Consulta: retorna cuánto tiene ya el archivo parcial
+            if flags & FileTransferProtocol.FLAG_QUERY:
+                client_socket.sendall(commands.resume_query(self.file_handler, filename))
+                return
             
-            # Enviar header con información del archivo
-            header = FileTransferProtocol.create_header(
-                FileTransferProtocol.CMD_DATA, len(file_data), checksum
-            )
-            client_socket.send(header)
+            fd = commands.open_resume_segment(self.file_handler, filename)
+            try:
+                hasher = FileTransferProtocol.new_checksum(algorithm)
+                FileTransferProtocol.recv_segment_to_fd(client_socket, fd, data_size, offset, flags, hasher)
+                ack = commands.finish_resume_segment(
+                    self.file_handler, fd, filename, flags, offset, data_size, hasher, expected_checksum
+                )
+            finally:
+                os.close(fd)
+            client_socket.sendall(ack)
             
-            # Enviar datos del archivo
-            bytes_sent = 0
-            while bytes_sent < len(file_data):
-                chunk = file_data[bytes_sent:bytes_sent + FileTransferProtocol.BUFFER_SIZE]
-                client_socket.send(chunk)
-                bytes_sent += len(chunk)
+        except Exception as e:
+            self.send_error_v2(client_socket, e)
+    
+    def handle_range(self, client_socket, flags, data_size, offset, session):
+        """Maneja la descarga de un rango del archivo"""
+        try:
+            filename = self.receive_filename(client_socket)
+            with commands.open_shared_file(self.file_handler, filename) as f:
+                header, length, codec = commands.plan_range(
+                    self.file_handler, f, filename, flags, data_size, offset, session
+                )
+                client_socket.sendall(header)
+                if length:
+                    FileTransferProtocol.send_segment_from_file(
+                        client_socket, f, length, offset, codec, session['level']
+                    )
             
-            print(f"Archivo {filename} enviado exitosamente")
+        except Exception as e:
+            self.send_error_v2(client_socket, e)
+    
+    def handle_signatures(self, client_socket):
+        """Envía las firmas de bloques del archivo actual para una sincronización delta"""
+        try:
+            filename = self.receive_filename(client_socket)
+            client_socket.sendall(commands.signatures(self.file_handler, filename))
             
         except Exception as e:
-            error_msg = str(e).encode()
-            error_header = FileTransferProtocol.create_header(
-                FileTransferProtocol.CMD_ERROR, len(error_msg)
-            )
-            client_socket.send(error_header + error_msg)
+            self.send_error_v2(client_socket, e)
+    
+    def handle_delta(self, client_socket, data_size, expected_checksum, algorithm):
+        """Reconstruye un archivo a partir de bloques existentes y datos nuevos"""
+        stream = None
+        try:
+            filename = self.receive_filename(client_socket)
+            stream = commands.start_delta(self.file_handler, filename, algorithm)
+            while stream.needed:
+                stream.feed(FileTransferProtocol.recv_exact(client_socket, stream.needed))
+            
+            ack = stream.finish(filename, data_size, expected_checksum)
+            stream = None
+            client_socket.sendall(ack)
+            
+        except Exception as e:
+            self.send_error_v2(client_socket, e)
+        finally:
+            if stream:
+                stream.abort()
     
     def handle_list(self, client_socket):
         """Maneja listado de archivos"""
@@ -158,14 +253,19 @@ class FileServer:
             header = FileTransferProtocol.create_header(
                 FileTransferProtocol.CMD_DATA, len(file_list)
             )
-            client_socket.send(header + file_list)
+            client_socket.sendall(header + file_list)
             
         except Exception as e:
-            error_msg = str(e).encode()
-            error_header = FileTransferProtocol.create_header(
-                FileTransferProtocol.CMD_ERROR, len(error_msg)
-            )
-            client_socket.send(error_header + error_msg)
+            client_socket.sendall(commands.error_reply(e))
+
+    def handle_list_page(self, client_socket, data_size):
+        """Maneja una página del listado paginado"""
+        try:
+            payload = FileTransferProtocol.recv_exact(client_socket, data_size)
+            client_socket.sendall(commands.list_page(self.file_handler, payload))
+            
+        except Exception as e:
+            self.send_error_v2(client_socket, e)
 
 if __name__ == "__main__":
     server = FileServer()
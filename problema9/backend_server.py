@@ -1,19 +1,51 @@
+import asyncio
 import socket
 import threading
 import time
 import json
+import queue
 from datetime import datetime
 from config import Config
+import framing
+from hash_ring import HashRing
+from wal import WriteAheadLog
+from data_sync import DataSync, record_version, SYNC_MAGIC, encode_sync, decode_sync
+from merkle import MerkleIndex
+from striped_store import StripedStore
+from record import Record, request_error, entry_error
+from health import HealthChecker
+from metrics import Metrics, MetricsServer
 
 class BackendServer:
     def __init__(self, server_id, port, other_servers):
         self.server_id = server_id
         self.port = port
         self.other_servers = other_servers  # Lista de puertos de otros servidores
-        self.data = Config.load_data(server_id)
+        # Lecturas sin lock; cada escritura bloquea solo el stripe de su clave
+        replayed = set()  # Claves escritas después del último snapshot
+        self.data = StripedStore(Config.load_data(server_id, replayed))
+        # Cada escritura se agrega al log; el snapshot completo se guarda en segundo plano
+        self.wal = WriteAheadLog(server_id)
+        self.snapshot_lock = threading.Lock()
+        # Versiones HLC por clave y deltas incrementales hacia cada peer
+        self.data_sync = DataSync(self, replayed)
+        # Mismo anillo que el balanceador: a cada peer solo se le envían sus claves
+        self.ring = HashRing([port] + list(other_servers))
+        # Árboles de Merkle para encontrar claves divergentes sin intercambiar todo
+        self.merkle = MerkleIndex(self)
         self.is_healthy = True
-        self.health_checks = {}  # Estado de otros servidores
-        self.sync_lock = threading.Lock()
+        # Estado de los otros servidores: probes simultáneos más fallos de sync y anti-entropy
+        self.health = HealthChecker([p for p in other_servers if p != port])
+        # Latencia por acción y gauges de replicación (acción STATS y puerto de scrape)
+        self.metrics = Metrics('backend', ('GET', 'SET', 'MGET', 'MSET', 'SYNC', 'SYNC_DATA', 'SYNC_FETCH',
+                                           'HEALTH_CHECK', 'MERKLE_ROOTS', 'MERKLE_NODES', 'MERKLE_KEYS'),
+                               labels={'server': server_id})
+        self.metrics.gauge('keys', 'Claves almacenadas', None, lambda: len(self.data))
+        self.metrics.gauge('wal_entries', 'Entradas en el log desde el último snapshot', None, lambda: self.wal.entries)
+        self.metrics.gauge('sync_lag_seconds', 'Segundos desde el último ack de cada peer con cambios pendientes',
+                           'peer', lambda: {peer: self.data_sync.lag(peer) for peer in self.health.ports})
+        self.metrics.gauge('peer_healthy', '1 si el peer está en rotación', 'peer',
+                           lambda: {peer: int(self.health.is_healthy(peer)) for peer in self.health.ports})
         
     def start(self):
         """Inicia el servidor backend"""
@@ -32,14 +64,28 @@ class BackendServer:
         sync_thread.daemon = True
         sync_thread.start()
         
+        # Hilo para anti-entropy (reparar réplicas que estuvieron caídas)
+        anti_entropy_thread = threading.Thread(target=self._anti_entropy_loop)
+        anti_entropy_thread.daemon = True
+        anti_entropy_thread.start()
+        
+        # Agregación de los histogramas y puerto de scrape
+        self.metrics.start()
+        if Config.METRICS_PORT_OFFSET is not None:
+            MetricsServer(self.metrics, self.port + Config.METRICS_PORT_OFFSET).start()
+        
         print(f"Servidor {self.server_id} iniciado en puerto {self.port}")
         
     def _start_server(self):
         """Inicia el socket del servidor"""
+        if Config.SERVER_MODE == 'asyncio':
+            asyncio.run(self._serve_async())
+            return
+        
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind(('localhost', self.port))
-            s.listen(5)
+            s.listen(Config.LISTEN_BACKLOG)
             
             while True:
                 conn, addr = s.accept()
@@ -53,65 +99,239 @@ class BackendServer:
     def _handle_client(self, conn, addr):
         """Maneja requests de clientes"""
         try:
+            if framing.accept_framed(conn):
+                self._handle_framed_client(conn)
+                return
+            
             data = conn.recv(1024).decode('utf-8')
             if data:
                 response = self._process_request(data)
+                self.wal.wait()
                 conn.send(response.encode('utf-8'))
         except Exception as e:
             print(f"Error manejando cliente: {e}")
         finally:
             conn.close()
     
+    def _handle_framed_client(self, conn):
+        """Atiende requests con framing en una conexión keep-alive hasta que se cierre"""
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        replies = queue.Queue()  # (id, respuesta, secuencia del log que debe estar en disco)
+        writer = threading.Thread(target=self._write_replies, args=(conn, replies))
+        writer.daemon = True
+        writer.start()
+        try:
+            while True:
+                frame = framing.recv_frame(conn)
+                if frame is None:
+                    break
+                # Los requests en vuelo se procesan en orden; la respuesta repite el id
+                request_id, payload = frame
+                replies.put((request_id, self._process_frame(payload), self.wal.last_seq))
+        finally:
+            replies.put(None)
+            writer.join()
+    
+    def _write_replies(self, conn, replies):
+        """Envía las respuestas cuando el log cubre lo escrito hasta ese request; un fsync libera muchas"""
+        while True:
+            item = replies.get()
+            if item is None:
+                break
+            request_id, response, seq = item
+            self.wal.wait(seq)
+            try:
+                framing.send_frame(conn, response, request_id)
+            except OSError:
+                pass  # El cliente se fue: se descartan las respuestas restantes
+    
+    async def _serve_async(self):
+        """Modo asyncio: un event loop atiende todas las conexiones, hasta MAX_CLIENT_CONNECTIONS a la vez"""
+        self.client_slots = asyncio.Semaphore(Config.MAX_CLIENT_CONNECTIONS)
+        server = await asyncio.start_server(
+            self._handle_client_async, 'localhost', self.port,
+            backlog=Config.LISTEN_BACKLOG, reuse_address=True
+        )
+        async with server:
+            await server.serve_forever()
+    
+    async def _handle_client_async(self, reader, writer):
+        """Versión asyncio de _handle_client"""
+        async with self.client_slots:
+            try:
+                framed, first = await framing.accept_framed_async(reader)
+                if framed:
+                    await self._handle_framed_client_async(reader, writer)
+                elif first:
+                    data = (first + await reader.read(1023)).decode('utf-8')
+                    response = self._process_request(data)
+                    await self._wait_durable_async(self.wal.last_seq)
+                    writer.write(response.encode('utf-8'))
+                    await writer.drain()
+            except Exception as e:
+                print(f"Error manejando cliente: {e}")
+            finally:
+                writer.close()
+    
+    async def _handle_framed_client_async(self, reader, writer):
+        """Versión asyncio de _handle_framed_client"""
+        replies = asyncio.Queue()  # (id, respuesta, secuencia del log que debe estar en disco)
+        writer_task = asyncio.create_task(self._write_replies_async(writer, replies))
+        try:
+            while True:
+                frame = await framing.read_frame_async(reader)
+                if frame is None:
+                    break
+                request_id, payload = frame
+                replies.put_nowait((request_id, self._process_frame(payload), self.wal.last_seq))
+        finally:
+            replies.put_nowait(None)
+            await writer_task
+    
+    async def _write_replies_async(self, writer, replies):
+        """Versión asyncio de _write_replies"""
+        while True:
+            item = await replies.get()
+            if item is None:
+                break
+            request_id, response, seq = item
+            await self._wait_durable_async(seq)
+            try:
+                framing.write_frame(writer, response, request_id)
+                await writer.drain()
+            except (ConnectionError, OSError):
+                pass  # El cliente se fue: se descartan las respuestas restantes
+    
+    async def _wait_durable_async(self, seq):
+        """Espera el fsync del log sin bloquear el event loop"""
+        if self.wal.sync_writes and self.wal.flushed_seq < seq:
+            await asyncio.get_running_loop().run_in_executor(None, self.wal.wait, seq)
+    
+    def _process_frame(self, payload):
+        """Procesa un request con framing: los registros entre peers viajan en binario"""
+        if payload.startswith(SYNC_MAGIC):
+            started = time.perf_counter_ns()
+            origin, clock, records = decode_sync(payload)
+            response = self._sync_data(records, origin, clock).encode('utf-8')
+            self.metrics.observe('SYNC', started)
+            return response
+        response = self._process_request(payload.decode('utf-8'))
+        return response if isinstance(response, bytes) else response.encode('utf-8')
+    
     def _process_request(self, data):
-        """Procesa diferentes tipos de requests"""
+        """Procesa diferentes tipos de requests y registra la latencia de cada acción"""
+        started = time.perf_counter_ns()
+        action = None
         try:
             request = json.loads(data)
             action = request.get('action')
-            
-            if action == 'GET':
-                key = request.get('key')
-                return self._get_data(key)
-            elif action == 'SET':
-                key = request.get('key')
-                value = request.get('value')
-                return self._set_data(key, value)
-            elif action == 'HEALTH_CHECK':
-                return self._health_check_response()
-            elif action == 'SYNC_DATA':
-                return self._sync_data(request.get('data'))
-            else:
-                return json.dumps({'error': 'Acción no válida'})
-                
+            response = self._handle_action(action, request)
         except json.JSONDecodeError:
-            return json.dumps({'error': 'JSON inválido'})
+            response = json.dumps({'error': 'JSON inválido'})
+        except Exception as e:
+            # Un request que falla responde un error: no corta la conexión ni los demás requests en vuelo
+            print(f"Error procesando request en {self.server_id}: {e}")
+            response = json.dumps({'error': f'Error interno: {str(e)}'})
+        self.metrics.observe(action, started, isinstance(response, str) and response.startswith('{"error"'))
+        return response
+    
+    def _handle_action(self, action, request):
+        """Ejecuta la acción de un request ya decodificado"""
+        error = request_error(action, request)
+        if error:
+            return json.dumps({'error': error})
+        if action == 'GET':
+            key = request.get('key')
+            return self._get_data(key)
+        elif action == 'SET':
+            key = request.get('key')
+            value = request.get('value')
+            return self._set_data(key, value)
+        elif action == 'MGET':
+            return self._get_many(request.get('keys') or [])
+        elif action == 'MSET':
+            return self._set_many(request.get('items') or {})
+        elif action == 'HEALTH_CHECK':
+            return self._health_check_response()
+        elif action == 'STATS':
+            return json.dumps(self.metrics.snapshot())
+        elif action == 'SYNC_DATA':
+            # Formato JSON de peers anteriores; los actuales envían el mensaje binario
+            records = {key: Record.from_dict(record) for key, record in (request.get('data') or {}).items()}
+            error = next((error for error in (entry_error(key, record) for key, record in records.items()) if error), None)
+            if error:
+                return json.dumps({'error': error})
+            return self._sync_data(records, request.get('origin'), request.get('clock', 0))
+        elif action == 'SYNC_FETCH':
+            return self._fetch_records(request.get('keys') or [])
+        elif action in ('MERKLE_ROOTS', 'MERKLE_NODES', 'MERKLE_KEYS'):
+            return json.dumps(self.merkle.handle_request(request))
+        else:
+            return json.dumps({'error': 'Acción no válida'})
     
     def _get_data(self, key):
         """Obtiene datos del almacenamiento"""
-        with self.sync_lock:
-            value = self.data.get(key, 'No encontrado')
-            return json.dumps({
-                'server_id': self.server_id,
-                'key': key,
-                'value': value,
-                'timestamp': datetime.now().isoformat()
-            })
+        record = self.data.get(key)
+        return json.dumps({
+            'server_id': self.server_id,
+            'key': key,
+            'value': record.to_dict() if record else 'No encontrado',
+            'timestamp': datetime.now().isoformat()
+        })
     
     def _set_data(self, key, value):
         """Establece datos en el almacenamiento"""
-        with self.sync_lock:
-            self.data[key] = {
-                'value': value,
-                'timestamp': datetime.now().isoformat(),
-                'server_id': self.server_id
-            }
-            Config.save_data(self.server_id, self.data)
-            
-            return json.dumps({
-                'server_id': self.server_id,
-                'status': 'OK',
-                'key': key,
-                'timestamp': datetime.now().isoformat()
-            })
+        with self.data.lock_for(key):
+            old_record = self.data.get(key)
+            record = Record(value, time.time_ns(), self.server_id, self.data_sync.record_change(key))
+            self.data[key] = record
+            self.merkle.update(key, old_record, record)
+            self.wal.append([(key, record)])
+        self._maybe_snapshot()
+        
+        return json.dumps({
+            'server_id': self.server_id,
+            'status': 'OK',
+            'key': key,
+            'version': record.version,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    def _get_many(self, keys):
+        """Obtiene varias claves sin tomar locks"""
+        values = {}
+        for key in keys:
+            record = self.data.get(key)
+            values[key] = record.to_dict() if record else 'No encontrado'
+        return json.dumps({
+            'server_id': self.server_id,
+            'values': values,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    def _set_many(self, items):
+        """Establece varias claves tomando cada stripe una vez, con una escritura al log por stripe"""
+        timestamp = time.time_ns()
+        version = 0  # La más alta escrita: el balanceador la usa para invalidar su cache
+        for stripe, keys in self.data.partition(items).items():
+            records = []
+            with self.data.locks[stripe]:
+                for key in keys:
+                    record = Record(items[key], timestamp, self.server_id, self.data_sync.record_change(key))
+                    self.merkle.update(key, self.data.get(key), record)
+                    self.data[key] = record
+                    records.append((key, record))
+                    version = max(version, record.version)
+                self.wal.append(records)
+        self._maybe_snapshot()
+        
+        return json.dumps({
+            'server_id': self.server_id,
+            'status': 'OK',
+            'count': len(items),
+            'version': version,
+            'timestamp': datetime.now().isoformat()
+        })
     
     def _health_check_response(self):
         """Responde a health checks"""
@@ -121,80 +341,88 @@ class BackendServer:
             'timestamp': datetime.now().isoformat()
         })
     
-    def _sync_data(self, incoming_data):
+    def _sync_data(self, incoming_data, origin=None, clock=0):
         """Sincroniza datos recibidos de otro servidor"""
-        with self.sync_lock:
-            for key, value in incoming_data.items():
-                # Mantener el dato más reciente
-                current_timestamp = self.data.get(key, {}).get('timestamp', '')
-                incoming_timestamp = value.get('timestamp', '')
+        self.data_sync.clock.update(clock)
+        # Un stripe a la vez: las lecturas y escrituras de los demás siguen mientras tanto
+        for stripe, keys in self.data.partition(incoming_data).items():
+            changed = []
+            with self.data.locks[stripe]:
+                for key in keys:
+                    value = incoming_data[key]
+                    # Mantener el dato más reciente
+                    if record_version(value) > record_version(self.data.get(key)):
+                        self.merkle.update(key, self.data.get(key), value)
+                        self.data[key] = value
+                        self.data_sync.record_change(key, origin)
+                        changed.append((key, value))
                 
-                if incoming_timestamp > current_timestamp:
-                    self.data[key] = value
-            
-            Config.save_data(self.server_id, self.data)
-            return json.dumps({'status': 'sync_ok'})
+                # Solo las claves que cambiaron van al log
+                if changed:
+                    self.wal.append(changed)
+        self._maybe_snapshot()
+        return json.dumps({'status': 'sync_ok', 'clock': self.data_sync.clock.now()})
+    
+    def _fetch_records(self, keys):
+        """Registros pedidos por un peer, como mensaje binario de sincronización (solo con framing)"""
+        records = {key: self.data[key] for key in keys if key in self.data}
+        return encode_sync(records, self.port, self.data_sync.clock.now())
+    
+    def _maybe_snapshot(self):
+        """Compacta el log en un snapshot en segundo plano cuando crece demasiado"""
+        if self.wal.entries >= Config.WAL_SNAPSHOT_ENTRIES and self.snapshot_lock.acquire(blocking=False):
+            snapshot_thread = threading.Thread(target=self._snapshot)
+            snapshot_thread.daemon = True
+            snapshot_thread.start()
+    
+    def _snapshot(self):
+        """Guarda un snapshot completo y descarta el log que ya cubre"""
+        try:
+            # Lo escrito después de rotar queda también en el log nuevo y se reaplica sobre el snapshot
+            self.wal.rotate()
+            # Lo que cambie desde acá queda en el log nuevo: el estado de replicación más ese log cubren todo
+            sync_state = self.data_sync.state()
+            # Los registros no se modifican, se reemplazan: alcanza con una copia superficial
+            data = self.data.copy()
+            Config.save_data(self.server_id, data)
+            Config.save_sync_state(self.server_id, sync_state)
+            self.wal.discard_rotated()
+        except Exception as e:
+            print(f"Error guardando snapshot de {self.server_id}: {e}")
+        finally:
+            self.snapshot_lock.release()
     
     def _health_check_loop(self):
         """Loop para verificar salud de otros servidores"""
         while True:
-            for server_port in self.other_servers:
-                if server_port != self.port:  # No verificar a sí mismo
-                    self._check_server_health(server_port)
+            self.health.check_all()
             time.sleep(Config.HEALTH_CHECK_INTERVAL)
     
-    def _check_server_health(self, server_port):
-        """Verifica la salud de un servidor específico"""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(Config.HEALTH_CHECK_TIMEOUT)
-                s.connect(('localhost', server_port))
-                
-                request = json.dumps({'action': 'HEALTH_CHECK'})
-                s.send(request.encode('utf-8'))
-                
-                response = s.recv(1024).decode('utf-8')
-                health_data = json.loads(response)
-                
-                self.health_checks[server_port] = {
-                    'status': health_data.get('status', 'unknown'),
-                    'last_check': datetime.now().isoformat()
-                }
-                
-        except Exception as e:
-            self.health_checks[server_port] = {
-                'status': 'unhealthy',
-                'last_check': datetime.now().isoformat(),
-                'error': str(e)
-            }
-    
     def _sync_loop(self):
         """Loop para sincronizar datos entre servidores"""
         while True:
             time.sleep(Config.SYNC_INTERVAL)
             self._sync_with_other_servers()
     
+    def _anti_entropy_loop(self):
+        """Loop que compara árboles de Merkle con cada peer y repara las diferencias"""
+        while True:
+            time.sleep(Config.ANTI_ENTROPY_INTERVAL)
+            for server_port in self.health.healthy_ports():
+                try:
+                    repaired = self.merkle.repair(server_port)
+                    if repaired:
+                        print(f"Servidor {self.server_id}: {repaired} claves reparadas con {server_port}")
+                except Exception as e:
+                    self.health.report_failure(server_port, hard=isinstance(e, ConnectionError))
+                    print(f"Error en anti-entropy con servidor {server_port}: {e}")
+    
     def _sync_with_other_servers(self):
-        """Sincroniza datos con otros servidores saludables"""
-        healthy_servers = [
-            port for port, status in self.health_checks.items() 
-            if status.get('status') == 'healthy'
-        ]
-        
-        for server_port in healthy_servers:
+        """Envía a cada servidor saludable las claves que cambiaron desde su último ack"""
+        for server_port in self.health.healthy_ports():
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(5)
-                    s.connect(('localhost', server_port))
-                    
-                    request = json.dumps({
-                        'action': 'SYNC_DATA',
-                        'data': self.data
-                    })
-                    s.send(request.encode('utf-8'))
-                    
-                    # Esperar respuesta (aunque no es crítico)
-                    s.recv(1024)
-                    
+                self.data_sync.sync_peer(server_port)
             except Exception as e:
+                # Un peer que no responde deja de recibir deltas hasta que un probe lo recupere
+                self.health.report_failure(server_port, hard=isinstance(e, ConnectionError))
                 print(f"Error sincronizando con servidor {server_port}: {e}")
\ No newline at end of file
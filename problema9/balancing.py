@@ -0,0 +1,133 @@
+import itertools
+import random
+import threading
+import time
+from config import Config
+
+class BackendStats:
+    """Contadores por backend que mantiene el balanceador: requests en vuelo y latencia EWMA"""
+    
+    def __init__(self, alpha=None):
+        self.alpha = alpha or Config.EWMA_ALPHA
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.ewma_latency = 0.0  # segundos; 0 = todavía sin medir
+    
+    def start(self):
+        """Registra un request enviado; retorna el instante para finish()"""
+        with self.lock:
+            self.outstanding += 1
+            self.requests += 1
+        return time.perf_counter()
+    
+    def finish(self, started, ok=True):
+        """Registra la respuesta (o el error) de un request; retorna su latencia"""
+        latency = time.perf_counter() - started
+        # Un error cuenta como un request que tardó el timeout: un backend que rechaza
+        # conexiones al instante no debe parecer el más rápido
+        sample = latency if ok else max(latency, Config.BACKEND_REQUEST_TIMEOUT)
+        with self.lock:
+            self.outstanding -= 1
+            if not ok:
+                self.errors += 1
+            if self.ewma_latency == 0:
+                self.ewma_latency = sample
+            else:
+                self.ewma_latency += self.alpha * (sample - self.ewma_latency)
+        return latency
+    
+    def cost(self):
+        """Latencia esperada si se le manda un request más"""
+        return self.ewma_latency * (self.outstanding + 1)
+    
+    def snapshot(self):
+        """Contadores para las métricas"""
+        with self.lock:
+            return {
+                'outstanding': self.outstanding,
+                'requests': self.requests,
+                'errors': self.errors,
+                'ewma_latency_ms': round(self.ewma_latency * 1000, 3)
+            }
+
+class RoundRobin:
+    """Turnos en el orden de la lista de candidatos"""
+    
+    def __init__(self):
+        self.counter = itertools.count()  # next() es atómico
+    
+    def select(self, candidates, stats):
+        """Siguiente candidato en turno"""
+        return candidates[next(self.counter) % len(candidates)]
+
+class LeastOutstanding:
+    """El backend con menos requests en vuelo (empates al azar)"""
+    
+    def select(self, candidates, stats):
+        """Candidato con menos requests en vuelo"""
+        return min(candidates, key=lambda port: (stats[port].outstanding, random.random()))
+
+class EwmaLatency:
+    """El backend con menor latencia EWMA ponderada por sus requests en vuelo"""
+    
+    def select(self, candidates, stats):
+        """Candidato con menor costo esperado"""
+        return min(candidates, key=lambda port: (stats[port].cost(), random.random()))
+
+class PowerOfTwoChoices:
+    """Dos candidatos al azar y se queda con el de menos carga: casi tan bueno
+    como mirar todos, sin que todos los balanceadores elijan el mismo"""
+    
+    def select(self, candidates, stats):
+        """El menos cargado de dos candidatos al azar"""
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        if (stats[second].outstanding, stats[second].cost()) < (stats[first].outstanding, stats[first].cost()):
+            return second
+        return first
+
+class RecentWrites:
+    """Backend que recibió cada escritura reciente: durante la ventana las lecturas de esa clave
+    van ahí (read-your-writes) y no a una réplica que todavía no la sincronizó"""
+    
+    def __init__(self, window=None):
+        self.window = window or Config.STICKY_READ_WINDOW
+        self.lock = threading.Lock()
+        self.writes = {}  # clave -> (backend, vencimiento); el orden de inserción es el de vencimiento
+    
+    def record(self, key, backend_server):
+        """Registra que key se escribió en backend_server"""
+        now = time.monotonic()
+        with self.lock:
+            self.writes.pop(key, None)
+            self.writes[key] = (backend_server, now + self.window)
+            # Descartar las vencidas (están al principio)
+            for old in list(itertools.islice(self.writes, 64)):
+                if self.writes[old][1] > now:
+                    break
+                del self.writes[old]
+    
+    def backend_for(self, key):
+        """Backend donde se escribió key dentro de la ventana, o None"""
+        entry = self.writes.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+STRATEGIES = {
+    'round_robin': RoundRobin,
+    'least_outstanding': LeastOutstanding,
+    'ewma': EwmaLatency,
+    'p2c': PowerOfTwoChoices
+}
+
+def create_strategy(name=None):
+    """Estrategia de balanceo por nombre (por defecto Config.BALANCING_STRATEGY)"""
+    name = name or Config.BALANCING_STRATEGY
+    try:
+        return STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(f"Estrategia de balanceo desconocida: {name}")
\ No newline at end of file
@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import framing
+
+SERVER_MODES = ('threaded', 'asyncio')
+CLIENT_KINDS = ('legacy', 'framed')
+
+# Levanta el sistema completo (backends + balanceador) en otro proceso para que
+# el generador de carga no compita por el GIL con los servidores
+CLUSTER_SCRIPT = """
+import sys
+sys.path.insert(0, {path!r})
+from config import Config
+Config.SERVER_MODE = {mode!r}
+Config.LOAD_BALANCER_PORT = {port}
+Config.BACKEND_PORTS = {backends!r}
+import main
+main.main()
+"""
+
+def percentile(sorted_values, fraction):
+    """Percentil de una lista ya ordenada (0 si está vacía)"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def start_cluster(mode, port, workdir):
+    """Inicia backends y balanceador en un subproceso y espera a que el balanceador acepte conexiones"""
+    script = CLUSTER_SCRIPT.format(
+        path=os.path.dirname(os.path.abspath(__file__)),
+        mode=mode,
+        port=port,
+        backends=[port + 1, port + 2, port + 3]
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-c', script], cwd=workdir,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"El sistema en modo {mode} no arrancó")
+
+def build_request(client_id, i):
+    """GET o SET alternados sobre unas pocas claves"""
+    request = {'action': 'GET' if i % 2 else 'SET', 'key': f"clave_{i % 100}", 'client_id': client_id}
+    if request['action'] == 'SET':
+        request['value'] = f"valor_{i}"
+    return json.dumps(request).encode('utf-8')
+
+async def legacy_client(port, client_id, requests, latencies, errors):
+    """Cliente antiguo: una conexión por request"""
+    for i in range(requests):
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection('localhost', port)
+            writer.write(build_request(client_id, i))
+            await writer.drain()
+            response = json.loads(await reader.read(65536))
+            writer.close()
+            if 'error' in response:
+                errors.append(response['error'])
+            else:
+                latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(str(e))
+
+async def framed_client(port, client_id, requests, latencies, errors):
+    """Cliente con framing: una conexión keep-alive, un request a la vez"""
+    try:
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(framing.FRAME_MAGIC)
+    except Exception as e:
+        errors.extend([str(e)] * requests)
+        return
+    try:
+        for i in range(requests):
+            started = time.perf_counter()
+            framing.write_frame(writer, build_request(client_id, i), i + 1)
+            await writer.drain()
+            frame = await framing.read_frame_async(reader)
+            if frame is None:
+                raise ConnectionError("El balanceador cerró la conexión")
+            response = json.loads(frame[1])
+            if 'error' in response:
+                errors.append(response['error'])
+            else:
+                latencies.append(time.perf_counter() - started)
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        writer.close()
+
+async def run_load(port, kind, concurrency, requests):
+    """Lanza concurrency clientes a la vez y mide requests/s y latencias"""
+    latencies = []
+    errors = []
+    client = legacy_client if kind == 'legacy' else framed_client
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, f"bench_{n}", requests, latencies, errors) for n in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'kind': kind,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'elapsed_s': elapsed,
+        'requests_per_s': len(latencies) / elapsed if elapsed else 0,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000
+    }
+
+def benchmark_modes(modes, kinds, concurrencies, requests, port):
+    """Mide cada modo de servidor con cada tipo de cliente y concurrencia"""
+    results = []
+    print(f"{'modo':>9} {'cliente':>8} {'clientes':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errores':>7}")
+    for mode in modes:
+        with tempfile.TemporaryDirectory() as workdir:
+            process = start_cluster(mode, port, workdir)
+            try:
+                time.sleep(1)  # Primer health check del balanceador
+                for kind in kinds:
+                    for concurrency in concurrencies:
+                        result = asyncio.run(run_load(port, kind, concurrency, requests))
+                        result['mode'] = mode
+                        results.append(result)
+                        print(f"{mode:>9} {kind:>8} {concurrency:>8} {result['requests_per_s']:>9.0f} "
+                              f"{result['latency_p50_ms']:>9.2f} {result['latency_p99_ms']:>9.2f} "
+                              f"{result['errors']:>7}")
+            finally:
+                process.kill()
+                process.wait()
+        port += 10  # El puerto anterior puede quedar en TIME_WAIT
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/s del sistema en modo threaded vs asyncio")
+    parser.add_argument('--modes', default=','.join(SERVER_MODES), help="Modos de servidor a comparar")
+    parser.add_argument('--clients', default=','.join(CLIENT_KINDS),
+                        help="Tipos de cliente: legacy (una conexión por request) y framed (keep-alive)")
+    parser.add_argument('--concurrency', default='10,100,1000', help="Clientes simultáneos")
+    parser.add_argument('--requests', type=int, default=20, help="Requests por cliente")
+    parser.add_argument('--port', type=int, default=8100, help="Puerto del balanceador (backends en los 3 siguientes)")
+    parser.add_argument('--json', help="Archivo donde guardar los resultados")
+    args = parser.parse_args()
+    
+    results = benchmark_modes(
+        args.modes.split(','),
+        args.clients.split(','),
+        [int(n) for n in args.concurrency.split(',')],
+        args.requests,
+        args.port
+    )
+    if args.json:
+        report = {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests_per_client': args.requests,
+            'results': results
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
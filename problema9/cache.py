@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+ENTRY_OVERHEAD = 200  # Bytes aproximados por entrada además de la clave y la respuesta
+
+class ResponseCache:
+    """Cache LRU de respuestas GET con TTL y tope de memoria. Cada entrada guarda la
+    versión del registro: una respuesta más vieja que un SET ya visto no se cachea"""
+    
+    def __init__(self, max_bytes=None, ttl=None):
+        self.max_bytes = max_bytes or Config.CACHE_MAX_BYTES
+        self.ttl = ttl or Config.CACHE_TTL
+        # clave -> (respuesta o None si solo se recuerda la versión, versión, vencimiento, tamaño)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+    
+    def get(self, key):
+        """Respuesta cacheada de la clave, o None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                self.metrics['expirations'] += 1
+                entry = None
+            if entry is None or entry[0] is None:
+                self.metrics['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.metrics['hits'] += 1
+            return entry[0]
+    
+    def put(self, key, response, version=0):
+        """Guarda una respuesta, salvo que ya se conozca una versión más nueva de la clave"""
+        with self.lock:
+            current = self.entries.get(key)
+            if current is not None and current[1] > version:
+                return
+            self._store(key, response, version)
+    
+    def invalidate(self, key, version=0):
+        """Descarta la respuesta cacheada; con version, además recuerda que lo anterior ya no sirve"""
+        with self.lock:
+            current = self.entries.get(key)
+            if current is not None and current[0] is not None:
+                self.metrics['invalidations'] += 1
+            if version:
+                self._store(key, None, max(version, current[1] if current else 0))
+            else:
+                self._remove(key)
+    
+    def observe(self, key, version):
+        """Un backend reportó la versión actual de la clave: si la cacheada es más vieja, se descarta"""
+        with self.lock:
+            current = self.entries.get(key)
+            if current is not None and current[1] < version:
+                if current[0] is not None:
+                    self.metrics['invalidations'] += 1
+                self._remove(key)
+    
+    def _store(self, key, response, version):
+        """Inserta la entrada como la más reciente y desaloja las más viejas si se pasa del tope"""
+        self._remove(key)
+        size = len(str(key)) + (len(response) if response else 0) + ENTRY_OVERHEAD
+        self.entries[key] = (response, version, time.monotonic() + self.ttl, size)
+        self.size += size
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted[3]
+            self.metrics['evictions'] += 1
+    
+    def _remove(self, key):
+        """Quita una entrada si existe"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[3]
+    
+    def get_metrics(self):
+        """Métricas del cache"""
+        with self.lock:
+            metrics = dict(self.metrics)
+            lookups = metrics['hits'] + metrics['misses']
+            metrics.update({
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hit_ratio': round(metrics['hits'] / lookups, 4) if lookups else 0
+            })
+            return metrics
\ No newline at end of file
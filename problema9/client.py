@@ -1,36 +1,75 @@
-import socket
 import json
 import random
+import threading
 import time
 from config import Config
+import framing
 
 class Client:
-    def __init__(self, client_id):
+    def __init__(self, client_id, max_in_flight=None):
         self.client_id = client_id
+        self.max_in_flight = max_in_flight or Config.PIPELINE_WINDOW
+        self.connection = None  # Conexión persistente con framing al balanceador
+        self.connection_lock = threading.Lock()
     
-    def send_request(self, action, key=None, value=None):
+    def _get_connection(self):
+        """Conexión con framing al balanceador (se reabre si se cerró)"""
+        with self.connection_lock:
+            if self.connection is None or self.connection.closed:
+                sock = framing.open_framed_connection(Config.LOAD_BALANCER_PORT, Config.CLIENT_TIMEOUT)
+                self.connection = framing.PipelinedConnection(sock, self.max_in_flight, Config.CLIENT_TIMEOUT)
+            return self.connection
+    
+    def _build_request(self, action, key=None, value=None, **fields):
+        """Serializa un request (fields agrega campos propios de la acción)"""
+        request = {
+            'action': action,
+            'key': key,
+            'value': value,
+            'client_id': self.client_id,
+            'timestamp': time.time()
+        }
+        request.update(fields)
+        return json.dumps(request).encode('utf-8')
+    
+    def send_request(self, action, key=None, value=None, **fields):
         """Envía un request al balanceador de carga"""
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(10)
-                s.connect(('localhost', Config.LOAD_BALANCER_PORT))
-                
-                request = {
-                    'action': action,
-                    'key': key,
-                    'value': value,
-                    'client_id': self.client_id,
-                    'timestamp': time.time()
-                }
-                
-                s.send(json.dumps(request).encode('utf-8'))
-                response = s.recv(1024).decode('utf-8')
-                
-                return json.loads(response)
-                
+            response = self._get_connection().request(self._build_request(action, key, value, **fields))
+            return json.loads(response)
+        
         except Exception as e:
+            self.close()
             return {'error': str(e)}
     
+    def submit(self, action, key=None, value=None, **fields):
+        """Envía un request sin esperar la respuesta; retorna un Future con la respuesta sin decodificar"""
+        return self._get_connection().submit(self._build_request(action, key, value, **fields))
+    
+    def send_pipelined(self, requests, **fields):
+        """Envía muchos requests (action, key, value) sin esperar respuestas; retorna las respuestas en orden"""
+        try:
+            connection = self._get_connection()
+            futures = [connection.submit(self._build_request(*request, **fields)) for request in requests]
+        except Exception as e:
+            self.close()
+            return [{'error': str(e)} for _ in requests]
+        
+        responses = []
+        for future in futures:
+            try:
+                responses.append(json.loads(future.result(Config.CLIENT_TIMEOUT)))
+            except Exception as e:
+                responses.append({'error': str(e)})
+        return responses
+    
+    def close(self):
+        """Cierra la conexión con el balanceador"""
+        with self.connection_lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+    
     def set_data(self, key, value):
         """Envía un comando SET"""
         return self.send_request('SET', key, value)
@@ -38,6 +77,47 @@ class Client:
     def get_data(self, key):
         """Envía un comando GET"""
         return self.send_request('GET', key)
+    
+    def mset(self, items):
+        """Establece muchas claves: lotes MSET de BATCH_SIZE enviados con pipelining"""
+        items = list(items.items())
+        batches = [dict(items[i:i + Config.BATCH_SIZE]) for i in range(0, len(items), Config.BATCH_SIZE)]
+        try:
+            connection = self._get_connection()
+            futures = [connection.submit(self._build_request('MSET', items=batch)) for batch in batches]
+            result = {'status': 'OK', 'count': 0, 'errors': []}
+            for future in futures:
+                response = json.loads(future.result(Config.CLIENT_TIMEOUT))
+                result['count'] += response.get('count', 0)
+                errors = response.get('errors', []) + ([response['error']] if 'error' in response else [])
+                if errors:
+                    result['status'] = 'PARTIAL'
+                    result['errors'].extend(errors)
+            return result
+        
+        except Exception as e:
+            self.close()
+            return {'error': str(e)}
+    
+    def mget(self, keys):
+        """Obtiene muchas claves: lotes MGET de BATCH_SIZE enviados con pipelining"""
+        keys = list(keys)
+        batches = [keys[i:i + Config.BATCH_SIZE] for i in range(0, len(keys), Config.BATCH_SIZE)]
+        try:
+            connection = self._get_connection()
+            futures = [connection.submit(self._build_request('MGET', keys=batch)) for batch in batches]
+            result = {'values': {}, 'errors': []}
+            for future in futures:
+                response = json.loads(future.result(Config.CLIENT_TIMEOUT))
+                result['values'].update(response.get('values', {}))
+                result['errors'].extend(response.get('errors', []))
+                if 'error' in response:
+                    result['errors'].append(response['error'])
+            return result
+        
+        except Exception as e:
+            self.close()
+            return {'error': str(e)}
 
 def demo_client_usage():
     """Demostración del uso del cliente"""
@@ -50,7 +130,6 @@ def demo_client_usage():
         value = f"valor_{i}_desde_cliente"
         result = client.set_data(key, value)
         print(f"SET {key}: {result}")
-        time.sleep(1)
     
     # Leer datos
     print("\n=== Leyendo datos ===")
@@ -58,7 +137,20 @@ def demo_client_usage():
         key = f"clave_{i}"
         result = client.get_data(key)
         print(f"GET {key}: {result}")
-        time.sleep(1)
+    
+    # Operaciones por lotes
+    print("\n=== Escribiendo y leyendo por lotes ===")
+    items = {f"lote_{i}": f"valor_{i}" for i in range(1000)}
+    start = time.perf_counter()
+    result = client.mset(items)
+    print(f"MSET {len(items)} claves: {result['count'] if 'count' in result else result} "
+          f"en {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    result = client.mget(items)
+    print(f"MGET {len(items)} claves: {len(result.get('values', {}))} valores "
+          f"en {time.perf_counter() - start:.2f} s")
+    
+    client.close()
 
 if __name__ == "__main__":
     demo_client_usage()
\ No newline at end of file
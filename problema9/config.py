@@ -1,5 +1,7 @@
 import json
+import os
 import time
+from record import Record, encode_entry, decode_entries
 
 class Config:
     # Configuración de puertos y direcciones
@@ -7,26 +9,187 @@ class Config:
     BACKEND_PORTS = [8001, 8002, 8003]
     SYNC_PORT = 9000
     
+    # Servidores: 'threaded' (un hilo por conexión) o 'asyncio' (un event loop para todas)
+    SERVER_MODE = 'threaded'
+    LISTEN_BACKLOG = 1024           # conexiones esperando accept()
+    MAX_CLIENT_CONNECTIONS = 10000  # conexiones atendidas a la vez en modo asyncio
+    ASYNC_DISPATCH_WORKERS = 64     # hilos que reenvían requests al backend en modo asyncio (pueden bloquearse)
+    
     # Configuración de health checks
     HEALTH_CHECK_INTERVAL = 5  # segundos
     HEALTH_CHECK_TIMEOUT = 3   # segundos
+    HEALTH_CHECK_WORKERS = 64  # probes simultáneos como máximo
+    
+    # Circuit breaker por servidor (balanceador y backends), con probes y requests reales
+    BREAKER_FAILURE_THRESHOLD = 3   # timeouts o requests lentos seguidos para sacarlo de rotación
+    BREAKER_SLOW_REQUEST = 5        # segundos; un request más lento cuenta como fallo (un lote grande puede tardar varios)
+    BREAKER_RESET_TIMEOUT = 2       # segundos abierto antes del intento half-open
+    BREAKER_MAX_RESET_TIMEOUT = 60  # tope de la espera, que se duplica con cada intento fallido
     
     # Configuración de replicación
     SYNC_INTERVAL = 10  # segundos
+    SYNC_CHUNK_KEYS = 1000  # claves por frame al enviar deltas a un peer
+    REPLICATION_FACTOR = 2  # réplicas de cada clave en el anillo de hash
+    VIRTUAL_NODES = 160     # posiciones de cada backend en el anillo
+    ANTI_ENTROPY_INTERVAL = 60  # segundos entre comparaciones de árboles de Merkle
+    MERKLE_DEPTH = 16           # niveles del árbol: 2**16 buckets de claves por conjunto de réplicas
+    STORE_STRIPES = 64          # locks del almacenamiento de cada backend (por hash de la clave)
+    
+    # Balanceo entre backends: 'round_robin', 'least_outstanding', 'ewma' o 'p2c'.
+    # Las escrituras siempre van a la primera réplica sana de la clave; los GET se reparten con la
+    # estrategia entre sus réplicas sanas, salvo las claves escritas por este balanceador hace menos
+    # de STICKY_READ_WINDOW, que se leen del backend que recibió la escritura (read-your-writes)
+    BALANCING_STRATEGY = 'p2c'
+    EWMA_ALPHA = 0.3            # peso de la última latencia en el promedio móvil
+    READ_FROM_REPLICAS = True   # False: los GET van siempre a la primera réplica sana, como las escrituras
+    STICKY_READ_WINDOW = SYNC_INTERVAL * 3  # segundos; cubre una ronda de sincronización atrasada
+    
+    # Cache de respuestas GET en el balanceador (se invalida con los SET que pasan por él)
+    CACHE_ENABLED = True
+    CACHE_TTL = 5                       # segundos que una respuesta puede servirse sin ir al backend
+    CACHE_MAX_BYTES = 64 * 1024 * 1024  # tope aproximado de memoria del cache
+    
+    # Métricas: histograma de latencia por acción, acción STATS y puerto de scrape en texto plano
+    METRICS_HISTOGRAM_SUB_BITS = 4  # 2**4 buckets por potencia de 2: error relativo menor a 1/16
+    METRICS_PORT_OFFSET = 2000      # puerto de scrape = puerto del servidor + offset; None lo deshabilita
+    METRICS_FLUSH_INTERVAL = 0.1    # segundos entre agregaciones de las latencias registradas
+    
+    # Pool de conexiones del balanceador hacia cada backend
+    BACKEND_POOL_SIZE = 16          # conexiones máximas por backend
+    BACKEND_POOL_IDLE_TIMEOUT = 60  # segundos antes de cerrar una conexión ociosa
+    BACKEND_REQUEST_TIMEOUT = 5     # segundos
+    BACKEND_CONNECTION_IN_FLIGHT = 64  # requests en vuelo antes de abrir otra conexión
+    
+    # Pipelining: requests en vuelo por conexión con framing
+    PIPELINE_WINDOW = 1024
+    BATCH_SIZE = 5000    # claves por MGET/MSET que envía el cliente
+    CLIENT_TIMEOUT = 10  # segundos
+    
+    # Persistencia: write-ahead log + snapshots compactos
+    WAL_GROUP_COMMIT_INTERVAL = 0.001  # segundos que se juntan escrituras antes de cada fsync
+    WAL_SYNC_WRITES = True             # True: la respuesta espera el fsync; False: fsync en segundo plano
+    WAL_SNAPSHOT_ENTRIES = 100000      # entradas en el log antes de compactarlo en un snapshot
+    SNAPSHOT_BATCH_KEYS = 10000        # claves del snapshot por lote (un fsync parcial por lote)
     
     @staticmethod
-    def save_data(server_id, data):
-        """Guarda datos en archivo JSON"""
-        filename = f"server_{server_id}_data.json"
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+    def wal_path(server_id):
+        """Archivo del write-ahead log de un servidor"""
+        return f"server_{server_id}_data.log"
+    
+    @staticmethod
+    def snapshot_path(server_id):
+        """Archivo del snapshot binario de un servidor"""
+        return f"server_{server_id}_data.snap"
+    
+    @staticmethod
+    def sync_state_path(server_id):
+        """Acks de cada peer y cambios sin confirmar, guardados junto a cada snapshot"""
+        return f"server_{server_id}_sync.json"
+    
+    @staticmethod
+    def save_sync_state(server_id, state):
+        """Guarda el estado de replicación de forma atómica"""
+        filename = Config.sync_state_path(server_id)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename + '.tmp', filename)
     
     @staticmethod
-    def load_data(server_id):
-        """Carga datos desde archivo JSON"""
-        filename = f"server_{server_id}_data.json"
+    def load_sync_state(server_id):
+        """Estado de replicación del último snapshot, o None si no hay"""
         try:
-            with open(filename, 'r') as f:
+            with open(Config.sync_state_path(server_id), 'r') as f:
                 return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    @staticmethod
+    def save_data(server_id, data):
+        """Guarda un snapshot compacto de forma atómica (archivo temporal + rename)"""
+        filename = Config.snapshot_path(server_id)
+        temp_filename = filename + '.tmp'
+        items = list(data.items())
+        with open(temp_filename, 'wb') as f:
+            # Por lotes: el fsync por tramos evita que un único fsync gigante frene al del log
+            for start in range(0, len(items), Config.SNAPSHOT_BATCH_KEYS):
+                batch = items[start:start + Config.SNAPSHOT_BATCH_KEYS]
+                f.write(b''.join(encode_entry(key, record) for key, record in batch))
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+    
+    @staticmethod
+    def load_data(server_id, replayed=None):
+        """Carga el último snapshot y reaplica la cola del write-ahead log (sus claves se agregan a replayed)"""
+        data = Config._load_legacy_data(server_id)
+        try:
+            with open(Config.snapshot_path(server_id), 'rb') as f:
+                for key, record, _ in decode_entries(f.read()):
+                    data[key] = record
+        except FileNotFoundError:
+            pass
+        
+        # El .old es el log de un snapshot que no llegó a terminar
+        wal_filename = Config.wal_path(server_id)
+        for log_filename in (wal_filename + '.old', wal_filename):
+            Config._replay_log(log_filename, data, replayed)
+        return data
+    
+    @staticmethod
+    def _replay_log(filename, data, replayed=None):
+        """Aplica las entradas de un log y corta una última entrada incompleta o corrupta"""
+        try:
+            f = open(filename, 'r+b')
+        except FileNotFoundError:
+            return
+        with f:
+            valid_size = 0
+            for key, record, end in decode_entries(f.read()):
+                data[key] = record
+                if replayed is not None:
+                    replayed.add(key)
+                valid_size = end
+            f.truncate(valid_size)
+    
+    @staticmethod
+    def _load_legacy_data(server_id):
+        """Migra el snapshot y el log en JSON del formato anterior a un snapshot binario; {} si no hay"""
+        snapshot = f"server_{server_id}_data.json"
+        logs = [f"server_{server_id}_data.wal.old", f"server_{server_id}_data.wal"]
+        legacy = [filename for filename in [snapshot] + logs if os.path.exists(filename)]
+        if not legacy:
+            return {}
+        data = {}
+        if os.path.exists(snapshot):
+            with open(snapshot, 'r') as f:
+                data = json.load(f)
+        for log_filename in logs:
+            Config._replay_json_log(log_filename, data)
+        # Las claves quedan como texto, igual que al leerlas del formato binario
+        data = {str(key): Record.from_dict(record) for key, record in data.items()}
+        Config.save_data(server_id, data)
+        for filename in legacy:
+            os.remove(filename)
+        return data
+    
+    @staticmethod
+    def _replay_json_log(filename, data):
+        """Aplica las entradas de un log JSON del formato anterior y corta una última línea incompleta"""
+        try:
+            f = open(filename, 'r+b')
         except FileNotFoundError:
-            return {}
\ No newline at end of file
+            return
+        with f:
+            valid_size = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Caída a mitad de una escritura
+                try:
+                    key, value = json.loads(line)
+                except ValueError:
+                    break
+                data[key] = value
+                valid_size += len(line)
+            f.truncate(valid_size)
\ No newline at end of file
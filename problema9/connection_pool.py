@@ -0,0 +1,108 @@
+import threading
+import time
+import framing
+from config import Config
+
+class BackendPool:
+    """Pool de conexiones keep-alive con pipelining hacia un backend"""
+
+    def __init__(self, port, max_size=None, idle_timeout=None, timeout=None):
+        self.port = port
+        self.max_size = max_size or Config.BACKEND_POOL_SIZE
+        self.idle_timeout = idle_timeout or Config.BACKEND_POOL_IDLE_TIMEOUT
+        self.timeout = timeout or Config.BACKEND_REQUEST_TIMEOUT
+        self.connections = []  # PipelinedConnection abiertas
+        self.connecting = 0    # Conexiones abriéndose fuera del lock (ya ocupan cupo)
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # Terminó de abrirse (o falló) una conexión
+        self.metrics = {
+            'created': 0,       # Conexiones nuevas (handshakes)
+            'reused': 0,        # Requests enviados por una conexión existente
+            'evicted_idle': 0,  # Cerradas por superar idle_timeout
+            'discarded': 0      # Cerradas por error del backend
+        }
+
+    def _prune_locked(self, now):
+        """Quita las conexiones cerradas y las ociosas vencidas (requiere el lock)"""
+        alive = []
+        for conn in self.connections:
+            if conn.closed:
+                self.metrics['discarded'] += 1
+            elif conn.in_flight == 0 and now - conn.last_used > self.idle_timeout:
+                conn.close()
+                self.metrics['evicted_idle'] += 1
+            else:
+                alive.append(conn)
+        self.connections = alive
+
+    def evict_idle(self):
+        """Cierra las conexiones ociosas vencidas"""
+        with self.lock:
+            self._prune_locked(time.monotonic())
+
+    def _acquire(self):
+        """Conexión con menos requests en vuelo; abre otra si todas están cargadas y hay cupo.
+        El connect se hace fuera del lock: uno lento no frena a los que reusan conexiones"""
+        deadline = time.monotonic() + self.timeout
+        with self.lock:
+            while True:
+                self._prune_locked(time.monotonic())
+                conn = min(self.connections, key=lambda c: c.in_flight, default=None)
+                slots = len(self.connections) + self.connecting
+                if conn is not None and (conn.in_flight < Config.BACKEND_CONNECTION_IN_FLIGHT
+                                         or slots >= self.max_size):
+                    self.metrics['reused'] += 1
+                    return conn
+                if slots < self.max_size:
+                    self.connecting += 1
+                    break
+                # Todo el cupo se está abriendo: esperar la primera conexión lista
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Sin conexiones disponibles hacia el backend {self.port}")
+                self.changed.wait(remaining)
+
+        try:
+            sock = framing.open_framed_connection(self.port, self.timeout)
+            conn = framing.PipelinedConnection(sock, Config.PIPELINE_WINDOW, self.timeout)
+        except Exception:
+            with self.lock:
+                self.connecting -= 1
+                self.changed.notify_all()
+            raise
+        with self.lock:
+            self.connecting -= 1
+            self.connections.append(conn)
+            self.metrics['created'] += 1
+            self.changed.notify_all()
+        return conn
+
+    def submit(self, payload):
+        """Envía un mensaje sin esperar la respuesta; retorna un Future"""
+        return self._acquire().submit(payload)
+
+    def request(self, payload):
+        """Envía un mensaje y espera su respuesta"""
+        return self.submit(payload).result(self.timeout)
+
+    def clear(self):
+        """Cierra todas las conexiones (p. ej. cuando el backend cae)"""
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+    def get_metrics(self):
+        """Métricas del pool"""
+        with self.lock:
+            metrics = dict(self.metrics)
+            metrics.update({
+                'port': self.port,
+                'max_size': self.max_size,
+                'idle_timeout': self.idle_timeout,
+                'open': len(self.connections),
+                'connecting': self.connecting,
+                'in_flight': sum(conn.in_flight for conn in self.connections),
+                'window_waits': sum(conn.waits for conn in self.connections)
+            })
+            return metrics
@@ -0,0 +1,186 @@
+import json
+import struct
+import threading
+import time
+import framing
+from config import Config
+from record import encode_entry, decode_entries
+
+SYNC_MAGIC = b'\x00SYN'  # Ningún request JSON empieza con un byte nulo
+SYNC_HEADER = struct.Struct('!4sIQ')  # magia, puerto de origen (0 = ninguno), reloj HLC
+
+class HybridLogicalClock:
+    """Reloj lógico híbrido: milisegundos de pared en los bits altos y un contador
+    en los 16 bajos; nunca retrocede y siempre queda por delante de lo recibido"""
+    
+    def __init__(self, start=0):
+        self.last = start
+        self.lock = threading.Lock()
+    
+    def now(self):
+        """Marca para un evento local"""
+        with self.lock:
+            physical = int(time.time() * 1000) << 16
+            self.last = max(physical, self.last + 1)
+            return self.last
+    
+    def update(self, remote):
+        """Avanza el reloj al recibir la marca de otro servidor"""
+        with self.lock:
+            physical = int(time.time() * 1000) << 16
+            self.last = max(physical, self.last + 1, remote + 1)
+            return self.last
+
+def record_version(record):
+    """Orden de última escritura gana (ver Record.order); (0, 0, '') si la clave no existe"""
+    if not record:
+        return (0, 0, '')
+    return record.order()
+
+def encode_sync(records, origin, clock):
+    """Mensaje binario de sincronización con los registros {clave: Record}"""
+    header = SYNC_HEADER.pack(SYNC_MAGIC, origin or 0, clock)
+    return header + b''.join(encode_entry(key, record) for key, record in records.items())
+
+def decode_sync(payload):
+    """Inverso de encode_sync: (origen, reloj, {clave: Record})"""
+    _, origin, clock = SYNC_HEADER.unpack_from(payload)
+    records = {key: record for key, record, _ in decode_entries(payload, SYNC_HEADER.size)}
+    return origin or None, clock, records
+
+class DataSync:
+    """Replicación incremental: cada clave recuerda la marca de su último cambio
+    y a cada peer solo se le envían las claves cambiadas desde su último ack"""
+    
+    def __init__(self, server, replayed=()):
+        self.server = server
+        state = Config.load_sync_state(server.server_id)
+        latest = max((record_version(r)[0] for r in server.data.values()), default=0)
+        self.clock = HybridLogicalClock(max(latest, state['clock']) if state else latest)
+        # clave -> (marca, puerto de origen); el orden de inserción es el orden de los cambios
+        self.changes = {}
+        self.acks = {}  # puerto -> última marca confirmada por ese peer
+        self.lock = threading.Lock()  # Marca e inserción juntas: changes queda ordenado por marca
+        self.metrics = {'chunks_sent': 0, 'keys_sent': 0, 'bytes_sent': 0}
+        self._restore(state, replayed)
+    
+    def _restore(self, state, replayed):
+        """Reconstruye acks y cambios pendientes tras un reinicio; replayed son las claves del log"""
+        data = self.server.data
+        if state is None:
+            # Sin estado guardado no se sabe qué recibió cada peer: se reenvía todo una vez
+            for key, record in sorted(data.items(), key=lambda item: record_version(item[1])):
+                self.changes[key] = (self.clock.now(), None)
+            return
+        self.acks = {int(peer): mark for peer, mark in state['acks'].items()}
+        # Sin confirmar al guardar el snapshot, y lo escrito después (que solo está en el log):
+        # una escritura local tiene como marca su versión; una recibida de un peer se reenvía
+        marks = {key: (mark, origin) for key, mark, origin in state['pending'] if key in data}
+        received = []
+        for key in replayed:
+            record = data.get(key)
+            if record is None:
+                continue
+            if record.server_id == self.server.server_id:
+                marks[key] = (record.version, None)
+            else:
+                marks.pop(key, None)
+                received.append((record_version(record), key))
+        for key, change in sorted(marks.items(), key=lambda item: item[1][0]):
+            self.changes[key] = change
+        for _, key in sorted(received):
+            self.changes[key] = (self.clock.now(), None)
+    
+    def state(self):
+        """Acks y cambios que algún peer no confirmó todavía, para guardar junto al snapshot"""
+        acks = self.acks.copy()
+        peers = [peer for peer in self.server.other_servers if peer != self.server.port]
+        floor = min((acks.get(peer, 0) for peer in peers), default=None)
+        pending = []
+        with self.lock:
+            clock = self.clock.last
+            for key in reversed(self.changes):
+                mark, origin = self.changes[key]
+                if floor is not None and mark <= floor:
+                    break
+                if floor is not None:
+                    pending.append([key, mark, origin])
+        pending.reverse()
+        return {'clock': clock, 'acks': acks, 'pending': pending}
+    
+    def record_change(self, key, origin=None):
+        """Registra un cambio y retorna su marca (llamar con el lock del stripe de la clave tomado)"""
+        with self.lock:
+            mark = self.clock.now()
+            self.changes.pop(key, None)
+            self.changes[key] = (mark, origin)
+        return mark
+    
+    def _pending_for(self, peer):
+        """Marca más reciente y (marca, clave) que le corresponden al peer desde su último ack"""
+        acked = self.acks.get(peer, 0)
+        candidates = []
+        with self.lock:
+            latest = next((self.changes[key][0] for key in reversed(self.changes)), acked)
+            for key in reversed(self.changes):
+                mark, origin = self.changes[key]
+                if mark <= acked:
+                    break
+                if origin != peer:
+                    candidates.append((mark, key))
+        # El anillo se consulta fuera del lock
+        pending = [(mark, key) for mark, key in reversed(candidates)
+                   if peer in self.server.ring.get_nodes(key)]
+        return latest, pending
+    
+    def lag(self, peer):
+        """Segundos desde el último ack del peer si hay cambios más nuevos (0 si está al día)"""
+        acked = self.acks.get(peer, 0)
+        with self.lock:
+            if not self.changes:
+                return 0
+            latest = next(reversed(self.changes.values()))[0]
+            since = acked or next(iter(self.changes.values()))[0]
+        if latest <= acked:
+            return 0
+        return max(0, (self.clock.now() >> 16) - (since >> 16)) / 1000
+    
+    def sync_peer(self, peer):
+        """Envía al peer sus claves cambiadas en chunks con framing; retorna cuántas envió"""
+        latest, pending = self._pending_for(peer)
+        if pending:
+            with framing.open_framed_connection(peer, Config.BACKEND_REQUEST_TIMEOUT) as s:
+                for start in range(0, len(pending), Config.SYNC_CHUNK_KEYS):
+                    chunk = pending[start:start + Config.SYNC_CHUNK_KEYS]
+                    self._send_chunk(s, chunk)
+                    # Si la conexión se corta, lo ya confirmado no se reenvía
+                    self.acks[peer] = chunk[-1][0]
+        self.acks[peer] = max(latest, self.acks.get(peer, 0))
+        return len(pending)
+    
+    def _send_chunk(self, s, chunk):
+        """Envía un chunk de registros y espera la confirmación del peer"""
+        # Los escritores registran la marca y guardan el registro con el lock del stripe tomado:
+        # leyendo bajo ese lock, una marca ya vista siempre viene con su registro y el ack no la saltea
+        store = self.server.data
+        data = {}
+        for stripe, keys in store.partition(key for _, key in chunk).items():
+            with store.locks[stripe]:
+                for key in keys:
+                    record = store.get(key)
+                    if record is not None:
+                        data[key] = record
+        payload = encode_sync(data, self.server.port, self.clock.now())
+        framing.send_frame(s, payload)
+        
+        frame = framing.recv_frame(s)
+        if frame is None:
+            raise ConnectionError('El peer cerró la conexión durante la sincronización')
+        reply = json.loads(frame[1])
+        if reply.get('status') != 'sync_ok':
+            raise ConnectionError(f"Sincronización rechazada: {reply}")
+        self.clock.update(reply.get('clock', 0))
+        
+        self.metrics['chunks_sent'] += 1
+        self.metrics['keys_sent'] += len(data)
+        self.metrics['bytes_sent'] += len(payload)
\ No newline at end of file
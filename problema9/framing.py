@@ -0,0 +1,191 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+# Protocolo con framing: cada mensaje va precedido por su largo (4 bytes) y el
+# id del request (8 bytes), que la respuesta repite. Así una conexión admite
+# muchos requests en vuelo (pipelining) y las respuestas se reparten por id.
+# Una conexión con framing empieza con FRAME_MAGIC; las conexiones antiguas
+# empiezan directamente con el JSON ('{'), así un mismo puerto atiende ambas.
+FRAME_MAGIC = b'\x00FRM'
+FRAME_HEADER = struct.Struct('!IQ')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+def recv_exact(sock, size):
+    """Recibe exactamente size bytes; retorna None si la conexión se cerró antes del primero"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("Conexión cerrada a mitad de un mensaje")
+        received += n
+    return bytes(buffer)
+
+def send_frame(sock, payload, request_id=0):
+    """Envía un mensaje (bytes) precedido por su largo y su id de request"""
+    sock.sendall(FRAME_HEADER.pack(len(payload), request_id) + payload)
+
+def recv_frame(sock):
+    """Recibe un mensaje completo como (id, payload); None si el otro extremo cerró la conexión"""
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    size, request_id = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Mensaje demasiado grande: {size} bytes")
+    if size == 0:
+        return request_id, b''
+    payload = recv_exact(sock, size)
+    if payload is None:
+        raise ConnectionError("Conexión cerrada a mitad de un mensaje")
+    return request_id, payload
+
+def accept_framed(conn):
+    """Indica si la conexión entrante usa framing (y consume el preámbulo)"""
+    first = conn.recv(1, socket.MSG_PEEK)
+    if first != FRAME_MAGIC[:1]:
+        return False
+    if recv_exact(conn, len(FRAME_MAGIC)) != FRAME_MAGIC:
+        raise ValueError("Preámbulo de framing inválido")
+    return True
+
+async def read_frame_async(reader):
+    """Versión asyncio de recv_frame"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("Conexión cerrada a mitad de un mensaje")
+    size, request_id = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Mensaje demasiado grande: {size} bytes")
+    try:
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Conexión cerrada a mitad de un mensaje")
+    return request_id, payload
+
+def write_frame(writer, payload, request_id=0):
+    """Versión asyncio de send_frame (el llamador hace drain)"""
+    writer.write(FRAME_HEADER.pack(len(payload), request_id) + payload)
+
+async def accept_framed_async(reader):
+    """Versión asyncio de accept_framed: retorna (usa framing, bytes ya leídos de un cliente antiguo)"""
+    first = await reader.read(1)
+    if first != FRAME_MAGIC[:1]:
+        return False, first
+    try:
+        rest = await reader.readexactly(len(FRAME_MAGIC) - 1)
+    except asyncio.IncompleteReadError:
+        rest = b''
+    if first + rest != FRAME_MAGIC:
+        raise ValueError("Preámbulo de framing inválido")
+    return True, b''
+
+def open_framed_connection(port, timeout):
+    """Abre una conexión con framing hacia un servidor local"""
+    sock = socket.create_connection(('localhost', port), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(FRAME_MAGIC)
+    return sock
+
+class PipelinedConnection:
+    """Conexión con framing que admite muchos requests en vuelo; un hilo lector
+    reparte las respuestas por id a medida que llegan, así nunca se bloquea el envío"""
+    
+    def __init__(self, sock, max_in_flight, timeout=None):
+        self.sock = sock
+        self.sock.settimeout(None)  # El lector espera sin límite; los timeouts son por request
+        self.timeout = timeout
+        self.window = threading.BoundedSemaphore(max_in_flight)
+        self.pending = {}  # id -> Future
+        self.pending_lock = threading.Lock()
+        self.send_lock = threading.Lock()  # El lector nunca lo toma: no hay deadlock
+        self.next_id = 1
+        self.closed = False
+        self.last_used = time.monotonic()
+        self.waits = 0  # Veces que se esperó por la ventana de requests en vuelo
+        reader = threading.Thread(target=self._read_loop)
+        reader.daemon = True
+        reader.start()
+    
+    @property
+    def in_flight(self):
+        return len(self.pending)
+    
+    def submit(self, payload):
+        """Envía un request sin esperar la respuesta; retorna un Future con el payload de respuesta"""
+        if not self.window.acquire(blocking=False):
+            self.waits += 1
+            if not self.window.acquire(timeout=self.timeout):
+                raise TimeoutError("Demasiados requests en vuelo")
+        
+        future = Future()
+        with self.pending_lock:
+            if self.closed:
+                self.window.release()
+                raise ConnectionError("Conexión cerrada")
+            request_id = self.next_id
+            self.next_id += 1
+            self.pending[request_id] = future
+            self.last_used = time.monotonic()
+        
+        try:
+            with self.send_lock:
+                send_frame(self.sock, payload, request_id)
+        except Exception as e:
+            self._fail_pending(e)
+            self.close()
+            raise
+        return future
+    
+    def request(self, payload):
+        """Envía un request y espera su respuesta"""
+        return self.submit(payload).result(self.timeout)
+    
+    def _read_loop(self):
+        """Hilo lector: completa el Future de cada respuesta"""
+        error = ConnectionError("Conexión cerrada por el otro extremo")
+        try:
+            while True:
+                frame = recv_frame(self.sock)
+                if frame is None:
+                    break
+                request_id, payload = frame
+                with self.pending_lock:
+                    future = self.pending.pop(request_id, None)
+                    self.last_used = time.monotonic()
+                if future is not None:
+                    self.window.release()
+                    future.set_result(payload)
+        except Exception as e:
+            error = e
+        self.closed = True
+        self._fail_pending(error)
+    
+    def _fail_pending(self, error):
+        """Falla todos los requests sin respuesta"""
+        with self.pending_lock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for future in pending:
+            self.window.release()
+            if not future.done():
+                future.set_exception(error)
+    
+    def close(self):
+        """Cierra la conexión; el lector falla los requests pendientes"""
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
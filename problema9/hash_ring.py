@@ -0,0 +1,72 @@
+import bisect
+import hashlib
+from config import Config
+
+class HashRing:
+    """Anillo de hash consistente con nodos virtuales: agregar o quitar un nodo
+    solo mueve ~1/N de las claves"""
+    
+    def __init__(self, nodes=(), vnodes=None, replication_factor=None):
+        self.vnodes = vnodes or Config.VIRTUAL_NODES
+        self.replication_factor = replication_factor or Config.REPLICATION_FACTOR
+        self.nodes = set()
+        self.ring = ([], [], 0)  # (posiciones ordenadas, nodo real de cada posición, cantidad de nodos)
+        for node in nodes:
+            self.add_node(node)
+    
+    @staticmethod
+    def _hash(value):
+        """Posición en el anillo: primeros 8 bytes del MD5"""
+        return int.from_bytes(hashlib.md5(str(value).encode('utf-8')).digest()[:8], 'big')
+    
+    def _rebuild(self):
+        """Recalcula las posiciones; se reemplaza la tupla entera para no bloquear lecturas"""
+        points = sorted(
+            (self._hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(self.vnodes)
+        )
+        self.ring = ([position for position, _ in points], [node for _, node in points], len(self.nodes))
+    
+    def add_node(self, node):
+        """Agrega un nodo con sus nodos virtuales"""
+        if node not in self.nodes:
+            self.nodes.add(node)
+            self._rebuild()
+    
+    def remove_node(self, node):
+        """Quita un nodo; sus claves pasan al siguiente nodo del anillo"""
+        if node in self.nodes:
+            self.nodes.discard(node)
+            self._rebuild()
+    
+    def _walk(self, key):
+        """Nodos reales distintos en sentido horario desde la posición de la clave"""
+        positions, owners, count = self.ring
+        if not positions:
+            return
+        start = bisect.bisect(positions, self._hash(key))
+        seen = set()
+        for i in range(len(owners)):
+            node = owners[(start + i) % len(owners)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == count:
+                    return
+    
+    def get_nodes(self, key):
+        """Réplicas dueñas de la clave, en orden de preferencia"""
+        nodes = []
+        for node in self._walk(key):
+            nodes.append(node)
+            if len(nodes) == self.replication_factor:
+                break
+        return nodes
+    
+    def get_node(self, key, alive=None):
+        """Primera réplica sana de la clave; si todas están caídas, el siguiente nodo sano del anillo"""
+        for node in self._walk(key):
+            if alive is None or node in alive:
+                return node
+        return None
\ No newline at end of file
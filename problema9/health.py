@@ -0,0 +1,150 @@
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import Config
+
+CLOSED = 'closed'        # En rotación
+OPEN = 'open'            # Fuera de rotación y sin probes hasta que vence la espera
+HALF_OPEN = 'half_open'  # Un único intento decide si vuelve o se abre de nuevo
+
+def probe(port, timeout=None):
+    """HEALTH_CHECK a un servidor; retorna su respuesta (excepción si no contesta a tiempo)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout or Config.HEALTH_CHECK_TIMEOUT)
+        s.connect(('localhost', port))
+        s.send(json.dumps({'action': 'HEALTH_CHECK'}).encode('utf-8'))
+        return json.loads(s.recv(1024).decode('utf-8'))
+
+class CircuitBreaker:
+    """Circuit breaker de un servidor, alimentado por probes y por los requests reales.
+    Cada intento half-open fallido duplica la espera hasta BREAKER_MAX_RESET_TIMEOUT"""
+    
+    def __init__(self, failure_threshold=None, reset_timeout=None, slow_request=None):
+        self.failure_threshold = failure_threshold or Config.BREAKER_FAILURE_THRESHOLD
+        self.base_reset_timeout = reset_timeout or Config.BREAKER_RESET_TIMEOUT
+        self.slow_request = slow_request or Config.BREAKER_SLOW_REQUEST
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0  # Fallos seguidos
+        self.reset_timeout = self.base_reset_timeout
+        self.opened_at = 0
+        self.metrics = {'opened': 0, 'closed': 0, 'failures': 0, 'slow': 0}
+    
+    def record_success(self, latency=None):
+        """Request o probe exitoso (uno lento cuenta como fallo); True si el breaker cambió de estado"""
+        if latency is not None and latency > self.slow_request:
+            with self.lock:
+                self.metrics['slow'] += 1
+            return self.record_failure()
+        with self.lock:
+            self.failures = 0
+            # Una respuesta tardía de cuando estaba en rotación no lo reabre: eso lo decide el intento half-open
+            if self.state != HALF_OPEN:
+                return False
+            self.state = CLOSED
+            self.reset_timeout = self.base_reset_timeout
+            self.metrics['closed'] += 1
+            return True
+    
+    def record_failure(self, hard=False):
+        """Fallo de un request o probe; hard (no se pudo conectar) abre sin esperar el umbral.
+        True si el breaker se abrió"""
+        with self.lock:
+            self.metrics['failures'] += 1
+            self.failures += 1
+            if self.state == OPEN:
+                return False
+            if self.state == HALF_OPEN:
+                self.reset_timeout = min(self.reset_timeout * 2, Config.BREAKER_MAX_RESET_TIMEOUT)
+            elif not hard and self.failures < self.failure_threshold:
+                return False
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.metrics['opened'] += 1
+            return True
+    
+    def should_probe(self):
+        """Si corresponde probar el servidor: siempre en rotación; si está abierto, solo al vencer la espera"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+    
+    def snapshot(self):
+        """Estado y contadores para las métricas"""
+        with self.lock:
+            return dict(self.metrics, state=self.state, consecutive_failures=self.failures,
+                        reset_timeout=self.reset_timeout)
+
+class HealthChecker:
+    """Health checks de un grupo de servidores con probes simultáneos: un servidor colgado
+    no demora la detección de los demás y un ciclo dura a lo sumo un HEALTH_CHECK_TIMEOUT"""
+    
+    def __init__(self, ports, on_change=None, timeout=None, workers=None):
+        self.ports = list(ports)
+        self.breakers = {port: CircuitBreaker() for port in self.ports}
+        self.on_change = on_change  # on_change(puerto, sano) al entrar o salir de rotación
+        self.timeout = timeout or Config.HEALTH_CHECK_TIMEOUT
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or max(1, min(len(self.ports), Config.HEALTH_CHECK_WORKERS)),
+            thread_name_prefix='health'
+        )
+        self.results = {}  # puerto -> último probe: status, last_check y error
+    
+    def is_healthy(self, port):
+        """Si el servidor está en rotación"""
+        return self.breakers[port].state == CLOSED
+    
+    def healthy_ports(self):
+        """Servidores en rotación"""
+        return [port for port in self.ports if self.is_healthy(port)]
+    
+    def check_all(self):
+        """Prueba a la vez los servidores que corresponda y espera todos los resultados"""
+        futures = [self.executor.submit(self._check, port)
+                   for port in self.ports if self.breakers[port].should_probe()]
+        for future in futures:
+            future.result()
+    
+    def _check(self, port):
+        """Un probe con su resultado aplicado al breaker: solo una conexión rechazada o cortada
+        lo abre de inmediato; un timeout o un estado 'unhealthy' suman hacia el umbral"""
+        hard = False
+        try:
+            status = probe(port, self.timeout).get('status', 'unknown')
+            error = None
+        except Exception as e:
+            status, error = 'unhealthy', str(e)
+            hard = isinstance(e, ConnectionError)
+        self.results[port] = {'status': status, 'last_check': datetime.now().isoformat()}
+        if error:
+            self.results[port]['error'] = error
+        if status == 'healthy':
+            self.report_success(port)
+        else:
+            self.report_failure(port, hard=hard)
+    
+    def report_success(self, port, latency=None):
+        """Señal de éxito (probe o request real, con su latencia)"""
+        if self.breakers[port].record_success(latency):
+            self._changed(port)
+    
+    def report_failure(self, port, hard=False):
+        """Señal de fallo (probe o request real)"""
+        if self.breakers[port].record_failure(hard):
+            self._changed(port)
+    
+    def _changed(self, port):
+        """Avisa que el servidor entró o salió de rotación"""
+        if self.on_change:
+            self.on_change(port, self.is_healthy(port))
+    
+    def get_metrics(self):
+        """Estado del breaker de cada servidor"""
+        return {str(port): breaker.snapshot() for port, breaker in self.breakers.items()}
\ No newline at end of file
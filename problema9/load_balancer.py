@@ -1,14 +1,44 @@
+import asyncio
 import socket
 import threading
 import json
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from config import Config
+from connection_pool import BackendPool
+from hash_ring import HashRing
+from balancing import BackendStats, RecentWrites, create_strategy
+from cache import ResponseCache
+from health import HealthChecker
+from record import request_error
+from metrics import Metrics, MetricsServer
+import framing
 
 class LoadBalancer:
     def __init__(self):
         self.backend_servers = Config.BACKEND_PORTS.copy()
-        self.current_server_index = 0
         self.healthy_servers = set(self.backend_servers)
+        # Contadores por backend que usa la estrategia de balanceo
+        self.stats = {port: BackendStats() for port in self.backend_servers}
+        self.strategy = create_strategy()
+        # Backend de cada escritura reciente, para leer lo propio aunque las réplicas estén atrasadas
+        self.recent_writes = RecentWrites()
+        # Cada clave vive en REPLICATION_FACTOR backends del anillo
+        self.ring = HashRing(self.backend_servers)
+        # Conexiones keep-alive reutilizables hacia cada backend
+        self.pools = {port: BackendPool(port) for port in self.backend_servers}
+        # Probes simultáneos y circuit breaker por backend, también alimentado por los requests reales
+        self.health = HealthChecker(self.backend_servers, on_change=self._on_health_change)
+        # Respuestas GET recientes; None si el cache está deshabilitado
+        self.cache = ResponseCache() if Config.CACHE_ENABLED else None
+        # Latencia por acción vista por el cliente y requests en vuelo por backend
+        self.metrics = Metrics('lb', ('GET', 'SET', 'MGET', 'MSET'))
+        self.metrics.gauge('backend_in_flight', 'Requests enviados al backend sin respuesta todavía', 'backend',
+                           lambda: {port: stats.outstanding for port, stats in self.stats.items()})
+        self.metrics.gauge('backend_healthy', '1 si el backend está en rotación', 'backend',
+                           lambda: {port: int(port in self.healthy_servers) for port in self.backend_servers})
         self.health_check_thread = threading.Thread(target=self._health_check_loop)
         self.health_check_thread.daemon = True
         
@@ -16,14 +46,21 @@ class LoadBalancer:
         """Inicia el balanceador de carga"""
         print("Iniciando balanceador de carga...")
         self.health_check_thread.start()
+        self.metrics.start()
+        if Config.METRICS_PORT_OFFSET is not None:
+            MetricsServer(self.metrics, Config.LOAD_BALANCER_PORT + Config.METRICS_PORT_OFFSET).start()
         self._start_load_balancer()
     
     def _start_load_balancer(self):
         """Inicia el servidor del balanceador"""
+        if Config.SERVER_MODE == 'asyncio':
+            asyncio.run(self._serve_async())
+            return
+        
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind(('localhost', Config.LOAD_BALANCER_PORT))
-            s.listen(10)
+            s.listen(Config.LISTEN_BACKLOG)
             print(f"Balanceador escuchando en puerto {Config.LOAD_BALANCER_PORT}")
             
             while True:
@@ -38,24 +75,15 @@ class LoadBalancer:
     def _handle_client(self, conn, addr):
         """Maneja conexiones de clientes"""
         try:
-            # Recibir request del cliente
-            data = conn.recv(1024).decode('utf-8')
+            if framing.accept_framed(conn):
+                self._handle_framed_client(conn)
+                return
+            
+            # Cliente antiguo: un request JSON por conexión
+            data = conn.recv(1024)
             
             if data:
-                # Seleccionar servidor backend usando round-robin
-                backend_server = self._select_backend_server()
-                
-                if backend_server:
-                    # Forward request al backend
-                    response = self._forward_to_backend(backend_server, data)
-                    conn.send(response.encode('utf-8'))
-                else:
-                    # No hay servidores disponibles
-                    error_response = json.dumps({
-                        'error': 'No hay servidores backend disponibles',
-                        'timestamp': datetime.now().isoformat()
-                    })
-                    conn.send(error_response.encode('utf-8'))
+                conn.send(self._dispatch_and_wait(data))
                     
         except Exception as e:
             print(f"Error manejando cliente: {e}")
@@ -67,62 +95,411 @@ class LoadBalancer:
         finally:
             conn.close()
     
-    def _select_backend_server(self):
-        """Selecciona un servidor backend usando round-robin"""
-        if not self.healthy_servers:
-            return None
-            
-        # Round-robin simple
-        available_servers = list(self.healthy_servers)
-        self.current_server_index = (self.current_server_index + 1) % len(available_servers)
-        return available_servers[self.current_server_index]
+    def _handle_framed_client(self, conn):
+        """Atiende un cliente con framing: cada request se reenvía sin esperar a los anteriores"""
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        replies = queue.Queue()  # (id, respuesta) que escribe un hilo aparte
+        outstanding = [0]        # Requests reenviados sin respuesta todavía
+        done = threading.Condition()
+        
+        def reply(request_id, response):
+            replies.put((request_id, response))
+            with done:
+                outstanding[0] -= 1
+                done.notify_all()
+        
+        writer = threading.Thread(target=self._write_replies, args=(conn, replies))
+        writer.daemon = True
+        writer.start()
+        try:
+            while True:
+                frame = framing.recv_frame(conn)
+                if frame is None:
+                    break
+                request_id, payload = frame
+                with done:
+                    outstanding[0] += 1
+                self._dispatch(payload, lambda response, request_id=request_id: reply(request_id, response))
+        finally:
+            # Entregar las respuestas pendientes antes de cerrar
+            with done:
+                done.wait_for(lambda: outstanding[0] == 0, timeout=Config.BACKEND_REQUEST_TIMEOUT)
+            replies.put(None)
+            writer.join()
+    
+    def _write_replies(self, conn, replies):
+        """Escribe las respuestas a un cliente con framing en el orden en que se completan"""
+        while True:
+            item = replies.get()
+            if item is None:
+                break
+            try:
+                framing.send_frame(conn, item[1], item[0])
+            except OSError:
+                pass  # El cliente se fue: se descartan las respuestas restantes
     
-    def _forward_to_backend(self, backend_port, data):
-        """Forward request al servidor backend"""
+    async def _serve_async(self):
+        """Modo asyncio: un event loop atiende a todos los clientes, hasta MAX_CLIENT_CONNECTIONS a la vez"""
+        self.client_slots = asyncio.Semaphore(Config.MAX_CLIENT_CONNECTIONS)
+        # _dispatch puede bloquearse (connect al backend, ventana de la conexión llena, sendall):
+        # corre en estos hilos para que un backend lento no frene el event loop
+        self.dispatch_executor = ThreadPoolExecutor(max_workers=Config.ASYNC_DISPATCH_WORKERS,
+                                                    thread_name_prefix='dispatch')
+        server = await asyncio.start_server(
+            self._handle_client_async, 'localhost', Config.LOAD_BALANCER_PORT,
+            backlog=Config.LISTEN_BACKLOG, reuse_address=True
+        )
+        print(f"Balanceador escuchando en puerto {Config.LOAD_BALANCER_PORT} (asyncio)")
+        async with server:
+            await server.serve_forever()
+    
+    async def _handle_client_async(self, reader, writer):
+        """Versión asyncio de _handle_client"""
+        async with self.client_slots:
+            try:
+                framed, first = await framing.accept_framed_async(reader)
+                if framed:
+                    await self._handle_framed_client_async(reader, writer)
+                elif first:
+                    # Cliente antiguo: un request JSON por conexión
+                    data = first + await reader.read(1023)
+                    writer.write(await self._dispatch_async(data))
+                    await writer.drain()
+            except Exception as e:
+                print(f"Error manejando cliente: {e}")
+                try:
+                    writer.write(self._error_response(f'Error interno: {str(e)}'))
+                    await writer.drain()
+                except (ConnectionError, OSError):
+                    pass
+            finally:
+                writer.close()
+    
+    async def _handle_framed_client_async(self, reader, writer):
+        """Versión asyncio de _handle_framed_client: las respuestas de los pools llegan al loop por call_soon_threadsafe"""
+        loop = asyncio.get_running_loop()
+        replies = asyncio.Queue()
+        outstanding = [0]
+        idle = asyncio.Event()
+        idle.set()
+        
+        def on_reply(request_id, response):
+            replies.put_nowait((request_id, response))
+            outstanding[0] -= 1
+            if outstanding[0] == 0:
+                idle.set()
+        
+        def reply(request_id, response):
+            loop.call_soon_threadsafe(on_reply, request_id, response)
+        
+        writer_task = asyncio.create_task(self._write_replies_async(writer, replies))
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5)
-                s.connect(('localhost', backend_port))
-                s.send(data.encode('utf-8'))
-                response = s.recv(1024).decode('utf-8')
-                return response
+            while True:
+                frame = await framing.read_frame_async(reader)
+                if frame is None:
+                    break
+                request_id, payload = frame
+                outstanding[0] += 1
+                idle.clear()
+                # Se espera solo el reenvío, no la respuesta: los requests de la conexión salen en orden
+                await loop.run_in_executor(
+                    self.dispatch_executor, self._dispatch, payload,
+                    lambda response, request_id=request_id: reply(request_id, response)
+                )
+        finally:
+            # Entregar las respuestas pendientes antes de cerrar
+            try:
+                await asyncio.wait_for(idle.wait(), Config.BACKEND_REQUEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            replies.put_nowait(None)
+            await writer_task
+    
+    async def _write_replies_async(self, writer, replies):
+        """Versión asyncio de _write_replies"""
+        while True:
+            item = await replies.get()
+            if item is None:
+                break
+            try:
+                framing.write_frame(writer, item[1], item[0])
+                await writer.drain()
+            except (ConnectionError, OSError):
+                pass  # El cliente se fue: se descartan las respuestas restantes
+    
+    async def _dispatch_async(self, payload):
+        """Versión asyncio de _dispatch_and_wait"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        def resolve(response):
+            if not future.done():
+                future.set_result(response)
+        
+        await loop.run_in_executor(
+            self.dispatch_executor, self._dispatch, payload,
+            lambda response: loop.call_soon_threadsafe(resolve, response)
+        )
+        try:
+            return await asyncio.wait_for(future, Config.BACKEND_REQUEST_TIMEOUT * 2)
+        except asyncio.TimeoutError:
+            return self._error_response('Timeout esperando al backend')
+    
+    def _dispatch_and_wait(self, payload):
+        """Reenvía un request y espera su respuesta (clientes sin framing)"""
+        result = []
+        finished = threading.Event()
+        
+        def reply(response):
+            result.append(response)
+            finished.set()
+        
+        self._dispatch(payload, reply)
+        if not finished.wait(Config.BACKEND_REQUEST_TIMEOUT * 2):
+            return self._error_response('Timeout esperando al backend')
+        return result[0]
+    
+    def _dispatch(self, payload, reply):
+        """Reenvía un request al backend; reply(respuesta) se llama cuando llega"""
+        started = time.perf_counter_ns()
+        request = self._parse_request(payload)
+        action = request.get('action') if request else None
+        
+        if action == 'STATS':
+            reply(json.dumps(self.metrics.snapshot()).encode('utf-8'))
+            return
+        if action == 'POOL_STATS':
+            reply(json.dumps(self.get_pool_metrics()).encode('utf-8'))
+            return
+        if action == 'CACHE_STATS':
+            reply(json.dumps(self.cache.get_metrics() if self.cache else {'enabled': False}).encode('utf-8'))
+            return
+        reply = self._timed_reply(action, started, reply)
+        error = request_error(action, request) if request else None
+        if error:
+            reply(self._error_response(error))
+            return
+        if action in ('MGET', 'MSET'):
+            self._dispatch_batch(request, reply)
+            return
+        
+        key = request.get('key') if request else None
+        if self.cache is not None and action == 'GET':
+            cached = self.cache.get(key)
+            if cached is not None:
+                reply(cached)
+                return
+            reply = self._caching_reply(key, reply)
+        elif self.cache is not None and action == 'SET':
+            self.cache.invalidate(key)
+            reply = self._invalidating_reply([key], reply)
+        
+        # Seleccionar el backend dueño de la clave
+        backend_server = self._select_backend_server(key, read=action == 'GET')
+        if not backend_server:
+            reply(self._error_response('No hay servidores backend disponibles'))
+            return
+        
+        self._submit(backend_server, payload, reply)
+    
+    def _submit(self, backend_server, payload, reply):
+        """Envía un request por el pool del backend sin bloquear esperando la respuesta"""
+        stats = self.stats[backend_server]
+        started = stats.start()
+        # Conexión rechazada o cortada: fuera de rotación ya; un timeout o un request lento suman hacia el umbral
+        try:
+            future = self.pools[backend_server].submit(payload)
         except Exception as e:
-            # Marcar servidor como no saludable
+            stats.finish(started, ok=False)
+            self.health.report_failure(backend_server, hard=isinstance(e, ConnectionError))
+            reply(self._error_response(f'Error conectando con backend: {str(e)}'))
+            return
+        
+        def on_response(future):
+            try:
+                response = future.result()
+            except Exception as e:
+                stats.finish(started, ok=False)
+                self.health.report_failure(backend_server, hard=isinstance(e, ConnectionError))
+                reply(self._error_response(f'Error conectando con backend: {str(e)}'))
+                return
+            self.health.report_success(backend_server, stats.finish(started))
+            reply(response)
+        future.add_done_callback(on_response)
+    
+    def _timed_reply(self, action, started, reply):
+        """Envuelve reply para registrar la latencia del request, incluida la espera al backend"""
+        def on_response(response):
+            self.metrics.observe(action, started, response.startswith(b'{"error"'))
+            reply(response)
+        return on_response
+    
+    def _caching_reply(self, key, reply):
+        """Envuelve reply para guardar en el cache la respuesta de un GET"""
+        def on_response(response):
+            try:
+                result = json.loads(response)
+            except json.JSONDecodeError:
+                result = {'error': 'Respuesta inválida del backend'}
+            if 'error' not in result:
+                value = result.get('value')
+                self.cache.put(key, response, value.get('version', 0) if isinstance(value, dict) else 0)
+            reply(response)
+        return on_response
+    
+    def _invalidating_reply(self, keys, reply):
+        """Envuelve reply para invalidar de nuevo las claves escritas cuando el backend confirma:
+        un GET que salió antes del SET no debe dejar el valor viejo en el cache. Un MSET trae
+        la versión más alta que escribió: alcanza como marca para todas sus claves"""
+        def on_response(response):
+            try:
+                version = json.loads(response).get('version', 0)
+            except json.JSONDecodeError:
+                version = 0
+            for key in keys:
+                self.cache.invalidate(key, version)
+            reply(response)
+        return on_response
+    
+    def _observe_versions(self, values):
+        """Descarta del cache las claves de las que un backend devolvió una versión más nueva"""
+        if self.cache is None:
+            return
+        for key, value in values.items():
+            if isinstance(value, dict):
+                self.cache.observe(key, value.get('version', 0))
+    
+    def _dispatch_batch(self, request, reply):
+        """Divide un MGET/MSET por backend dueño de cada clave y une las respuestas"""
+        alive = set(self.healthy_servers)
+        if not alive:
+            reply(self._error_response('No hay servidores backend disponibles'))
+            return
+        
+        action = request['action']
+        parts = {}  # backend -> sub-request
+        if action == 'MGET':
+            for key in request.get('keys') or []:
+                backend_server = self._select_backend_server(key, read=True, alive=alive)
+                part = parts.setdefault(backend_server, dict(request, keys=[]))
+                part['keys'].append(key)
+            merged = {'values': {}}
+        else:
+            for key, value in (request.get('items') or {}).items():
+                part = parts.setdefault(self._select_backend_server(key, alive=alive), dict(request, items={}))
+                part['items'][key] = value
+            merged = {'status': 'OK', 'count': 0}
+            if self.cache is not None:
+                written = list(request.get('items') or {})
+                for key in written:
+                    self.cache.invalidate(key)
+                reply = self._invalidating_reply(written, reply)
+        merged['servers'] = []
+        merged['errors'] = []
+        
+        if not parts:
+            merged['timestamp'] = datetime.now().isoformat()
+            reply(json.dumps(merged).encode('utf-8'))
+            return
+        
+        remaining = [len(parts)]
+        merge_lock = threading.Lock()
+        
+        def on_part(response):
+            try:
+                result = json.loads(response)
+            except json.JSONDecodeError:
+                result = {'error': 'Respuesta inválida del backend'}
+            with merge_lock:
+                if 'error' in result:
+                    merged['errors'].append(result['error'])
+                    if action == 'MSET':
+                        merged['status'] = 'PARTIAL'
+                else:
+                    merged['servers'].append(result.get('server_id'))
+                    if action == 'MGET':
+                        merged['values'].update(result.get('values', {}))
+                        self._observe_versions(result.get('values', {}))
+                    else:
+                        merged['count'] += result.get('count', 0)
+                        merged['version'] = max(merged.get('version', 0), result.get('version', 0))
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                merged['timestamp'] = datetime.now().isoformat()
+                reply(json.dumps(merged).encode('utf-8'))
+        
+        for backend_server, part in parts.items():
+            self._submit(backend_server, json.dumps(part).encode('utf-8'), on_part)
+    
+    def _error_response(self, message):
+        """Respuesta de error serializada"""
+        return json.dumps({
+            'error': message,
+            'timestamp': datetime.now().isoformat()
+        }).encode('utf-8')
+    
+    def _on_health_change(self, backend_port, healthy):
+        """Agrega o saca un backend de rotación cuando cambia su circuit breaker"""
+        if healthy:
+            self.healthy_servers.add(backend_port)
+            print(f"Backend {backend_port} vuelve a rotación")
+        else:
             self.healthy_servers.discard(backend_port)
-            return json.dumps({
-                'error': f'Error conectando con backend: {str(e)}',
-                'timestamp': datetime.now().isoformat()
-            })
+            self.pools[backend_port].clear()
+            print(f"Backend {backend_port} fuera de rotación")
+    
+    def _parse_request(self, data):
+        """Request como dict (None si no es JSON válido)"""
+        try:
+            request = json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+        return request if isinstance(request, dict) else None
+    
+    def get_pool_metrics(self):
+        """Métricas de los pools de conexiones por backend"""
+        metrics = {}
+        breakers = self.health.get_metrics()
+        for port, pool in self.pools.items():
+            metrics[str(port)] = pool.get_metrics()
+            metrics[str(port)].update(self.stats[port].snapshot())
+            metrics[str(port)]['breaker'] = breakers[str(port)]
+        return metrics
+    
+    def _select_backend_server(self, key=None, read=False, alive=None):
+        """Selecciona un backend: las escrituras van a la primera réplica sana de la clave;
+        las lecturas se reparten con la estrategia entre sus réplicas sanas (salvo una escritura
+        reciente: van a su backend) y los requests sin clave, entre todos los backends sanos"""
+        alive = self.healthy_servers if alive is None else alive
+        if not alive:
+            return None
+        
+        if key is None:
+            candidates = [port for port in self.backend_servers if port in alive]
+        elif read and Config.READ_FROM_REPLICAS:
+            written = self.recent_writes.backend_for(key)
+            if written in alive:
+                return written
+            candidates = [port for port in self.ring.get_nodes(key) if port in alive]
+            if not candidates:
+                return self.ring.get_node(key, alive)
+        else:
+            backend_server = self.ring.get_node(key, alive)
+            if not read and backend_server is not None:
+                self.recent_writes.record(key, backend_server)
+            return backend_server
+        return self.strategy.select(candidates, self.stats)
     
     def _health_check_loop(self):
         """Verifica periódicamente la salud de los servidores backend"""
-        import time
         while True:
             self._check_all_servers()
             time.sleep(Config.HEALTH_CHECK_INTERVAL)
     
     def _check_all_servers(self):
-        """Verifica la salud de todos los servidores"""
+        """Verifica la salud de todos los servidores a la vez"""
+        self.health.check_all()
         for server_port in self.backend_servers:
-            if self._check_server_health(server_port):
-                self.healthy_servers.add(server_port)
-            else:
-                self.healthy_servers.discard(server_port)
-    
-    def _check_server_health(self, server_port):
-        """Verifica la salud de un servidor específico"""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(Config.HEALTH_CHECK_TIMEOUT)
-                s.connect(('localhost', server_port))
-                
-                request = json.dumps({'action': 'HEALTH_CHECK'})
-                s.send(request.encode('utf-8'))
-                
-                response = s.recv(1024).decode('utf-8')
-                health_data = json.loads(response)
-                
-                return health_data.get('status') == 'healthy'
-                
-        except Exception:
-            return False
\ No newline at end of file
+            # Cerrar conexiones ociosas aunque no haya tráfico
+            self.pools[server_port].evict_idle()
\ No newline at end of file
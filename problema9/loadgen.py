@@ -0,0 +1,273 @@
+import argparse
+import bisect
+import itertools
+import json
+import platform
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+from config import Config
+from client import Client
+from metrics import Histogram
+
+MODES = ('closed', 'open')
+DISTRIBUTIONS = ('uniform', 'zipf')
+
+# Escenarios de --suite: cada uno reemplaza algunas opciones de la línea de comandos
+SUITE = [
+    ('lecturas_zipf', {'read_ratio': 0.95, 'distribution': 'zipf'}),
+    ('mixto_uniforme', {'read_ratio': 0.5, 'distribution': 'uniform'}),
+    ('escrituras', {'read_ratio': 0.1, 'distribution': 'uniform'}),
+    ('valores_grandes', {'read_ratio': 0.9, 'distribution': 'uniform', 'value_size': (4096, 16384)})
+]
+
+def parse_value_size(text):
+    """Tamaño de los valores: '100' (fijo) o '64-4096' (uniforme en el rango)"""
+    low, _, high = text.partition('-')
+    return int(low), int(high or low)
+
+class KeyChooser:
+    """Elige claves con distribución uniforme o Zipf (la clave de rango r con peso 1/r**s)"""
+    
+    def __init__(self, keys, distribution='uniform', exponent=0.99):
+        self.keys = keys
+        self.distribution = distribution
+        # CDF acumulada una sola vez; cada elección es un bisect
+        self.cdf = None
+        if distribution == 'zipf':
+            self.cdf = list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, keys + 1)))
+    
+    def choose(self, rng):
+        """Índice de la próxima clave"""
+        if self.cdf is None:
+            return rng.randrange(self.keys)
+        return bisect.bisect_left(self.cdf, rng.random() * self.cdf[-1])
+
+class LoadGenerator:
+    """Carga GET/SET contra el balanceador con varios Client a la vez. Closed-loop: cada
+    conexión espera su respuesta antes del siguiente request. Open-loop: los requests salen
+    a tasa fija aunque el sistema se atrase, y la latencia se mide desde el instante en que
+    debía salir cada uno (la espera por un sistema saturado cuenta)"""
+    
+    def __init__(self, concurrency=16, read_ratio=0.9, keys=10000, distribution='uniform',
+                 zipf_exponent=0.99, value_size=(100, 100), seed=None):
+        self.concurrency = concurrency
+        self.read_ratio = read_ratio
+        self.keys = keys
+        self.distribution = distribution
+        self.value_size = value_size
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.chooser = KeyChooser(keys, distribution, zipf_exponent)
+        self.payload = 'x' * value_size[1]  # Los valores son prefijos de este string
+        self.histograms = {'GET': Histogram(), 'SET': Histogram(), 'total': Histogram()}
+        self.error_messages = {}
+        self.errors_lock = threading.Lock()
+    
+    def _next_request(self, rng):
+        """(acción, clave, valor) del próximo request"""
+        key = f"clave_{self.chooser.choose(rng)}"
+        if rng.random() < self.read_ratio:
+            return 'GET', key, None
+        return 'SET', key, self.payload[:rng.randint(*self.value_size)]
+    
+    def _record(self, action, started, error=None):
+        """Registra la latencia (desde started, en ns) y el error de un request"""
+        latency = time.perf_counter_ns() - started
+        self.histograms[action].record(latency, error is not None)
+        self.histograms['total'].record(latency, error is not None)
+        if error is not None:
+            with self.errors_lock:
+                self.error_messages[error] = self.error_messages.get(error, 0) + 1
+    
+    def preload(self):
+        """Escribe todas las claves antes de medir para que los GET no lean claves inexistentes"""
+        client = Client('loadgen_preload')
+        rng = random.Random(self.seed)
+        result = client.mset({f"clave_{i}": self.payload[:rng.randint(*self.value_size)] for i in range(self.keys)})
+        client.close()
+        if 'error' in result or result.get('errors'):
+            print(f"Precarga incompleta: {result.get('error') or result['errors'][:3]}")
+    
+    def run_closed(self, duration):
+        """Closed-loop: concurrency hilos, cada uno con su conexión y un request a la vez"""
+        deadline = time.perf_counter() + duration
+        workers = [threading.Thread(target=self._closed_worker, args=(n, deadline)) for n in range(self.concurrency)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - started
+    
+    def _closed_worker(self, n, deadline):
+        """Envía requests uno tras otro hasta el deadline"""
+        client = Client(f"loadgen_{n}")
+        rng = random.Random(self.seed + n)
+        while time.perf_counter() < deadline:
+            action, key, value = self._next_request(rng)
+            started = time.perf_counter_ns()
+            response = client.send_request(action, key, value)
+            self._record(action, started, response.get('error'))
+        client.close()
+    
+    def run_open(self, duration, rate):
+        """Open-loop: rate requests/s repartidos entre concurrency conexiones con pipelining"""
+        clients = [Client(f"loadgen_{n}") for n in range(self.concurrency)]
+        rng = random.Random(self.seed)
+        in_flight = set()
+        interval = 1 / rate
+        started = time.perf_counter()
+        for i in itertools.count():
+            scheduled = started + i * interval
+            if scheduled >= started + duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Atrasado (el sistema o este hilo no dan abasto): sale ya, la latencia cuenta desde scheduled
+            scheduled_ns = int(scheduled * 1e9)
+            action, key, value = self._next_request(rng)
+            try:
+                future = clients[i % len(clients)].submit(action, key, value)
+            except Exception as e:
+                self._record(action, scheduled_ns, str(e))
+                continue
+            in_flight.add(future)
+            future.add_done_callback(lambda future, action=action, scheduled_ns=scheduled_ns:
+                                     self._on_response(future, action, scheduled_ns, in_flight))
+        
+        # Los que no contestan dentro de CLIENT_TIMEOUT se cancelan y cuentan como error
+        _, not_done = wait(list(in_flight), timeout=Config.CLIENT_TIMEOUT)
+        for future in not_done:
+            future.cancel()
+        elapsed = time.perf_counter() - started
+        for client in clients:
+            client.close()
+        return elapsed
+    
+    def _on_response(self, future, action, scheduled_ns, in_flight):
+        """Callback de cada request open-loop (en el hilo lector de la conexión)"""
+        in_flight.discard(future)
+        try:
+            error = json.loads(future.result()).get('error')
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        self._record(action, scheduled_ns, error)
+    
+    def report(self, elapsed, **extra):
+        """Throughput, tasa de errores y tabla de percentiles por acción"""
+        actions = {action: histogram.snapshot() for action, histogram in self.histograms.items()}
+        total = actions['total']
+        return dict(extra, **{
+            'concurrency': self.concurrency,
+            'read_ratio': self.read_ratio,
+            'keys': self.keys,
+            'distribution': self.distribution,
+            'value_size': list(self.value_size),
+            'seed': self.seed,
+            'elapsed_s': round(elapsed, 3),
+            'requests': total['count'],
+            'errors': total['errors'],
+            'error_rate': round(total['errors'] / total['count'], 5) if total['count'] else 0,
+            'requests_per_s': round((total['count'] - total['errors']) / elapsed, 1) if elapsed else 0,
+            'actions': actions,
+            'error_messages': dict(sorted(self.error_messages.items(), key=lambda item: -item[1])[:10])
+        })
+
+def print_report(report):
+    """Imprime un reporte como tabla"""
+    target = f", objetivo {report['rate']:.0f} req/s" if report.get('rate') else ''
+    print(f"\n{report.get('scenario') or 'carga'}: {report['mode']}-loop, {report['concurrency']} conexiones{target}, "
+          f"{report['read_ratio']:.0%} GET, claves {report['distribution']} ({report['keys']}), "
+          f"valores {report['value_size'][0]}-{report['value_size'][1]} B")
+    print(f"{report['requests']} requests en {report['elapsed_s']:.1f} s: {report['requests_per_s']:.0f} req/s exitosos, "
+          f"{report['errors']} errores ({report['error_rate']:.2%})")
+    print(f"{'acción':>7} {'requests':>9} {'errores':>8} {'media ms':>9} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'p99.9 ms':>9} {'máx ms':>8}")
+    for action, stats in report['actions'].items():
+        print(f"{action:>7} {stats['count']:>9} {stats['errors']:>8} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p90_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['p999_ms']:>9.2f} {stats['max_ms']:>8.2f}")
+    for message, count in report['error_messages'].items():
+        print(f"  {count} x {message}")
+
+def run_scenario(args, scenario=None, **overrides):
+    """Una corrida completa (precarga, carga y reporte) con las opciones de args más overrides"""
+    options = {
+        'concurrency': args.concurrency,
+        'read_ratio': args.read_ratio,
+        'keys': args.keys,
+        'distribution': args.distribution,
+        'zipf_exponent': args.zipf_exponent,
+        'value_size': args.value_size,
+        'seed': args.seed
+    }
+    options.update(overrides)
+    generator = LoadGenerator(**options)
+    if not args.no_preload:
+        generator.preload()
+    if args.mode == 'open':
+        elapsed = generator.run_open(args.duration, args.rate)
+    else:
+        elapsed = generator.run_closed(args.duration)
+    report = generator.report(elapsed, scenario=scenario, mode=args.mode, rate=args.rate if args.mode == 'open' else None)
+    print_report(report)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga GET/SET contra el balanceador")
+    parser.add_argument('--mode', choices=MODES, default='closed',
+                        help="closed: cada conexión espera su respuesta; open: tasa fija (--rate)")
+    parser.add_argument('--rate', type=float, default=1000, help="Requests/s en modo open")
+    parser.add_argument('--concurrency', type=int, default=16, help="Conexiones simultáneas al balanceador")
+    parser.add_argument('--duration', type=float, default=10, help="Segundos de carga por corrida")
+    parser.add_argument('--read-ratio', type=float, default=0.9, help="Fracción de GET (el resto son SET)")
+    parser.add_argument('--keys', type=int, default=10000, help="Cantidad de claves distintas")
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform', help="Distribución de las claves")
+    parser.add_argument('--zipf-exponent', type=float, default=0.99, help="Exponente de la distribución Zipf")
+    parser.add_argument('--value-size', type=parse_value_size, default=(100, 100),
+                        help="Bytes de cada valor: '100' o un rango '64-4096'")
+    parser.add_argument('--no-preload', action='store_true', help="No escribir las claves antes de medir")
+    parser.add_argument('--seed', type=int, help="Semilla para repetir la misma secuencia de requests")
+    parser.add_argument('--suite', action='store_true', help="Corre todos los escenarios de SUITE")
+    parser.add_argument('--port', type=int, default=Config.LOAD_BALANCER_PORT, help="Puerto del balanceador")
+    parser.add_argument('--start-cluster', choices=('threaded', 'asyncio'),
+                        help="Levanta backends y balanceador en un subproceso con ese modo de servidor")
+    parser.add_argument('--json', help="Archivo donde guardar los resultados")
+    args = parser.parse_args()
+    if args.mode == 'open' and args.rate <= 0:
+        parser.error("--rate debe ser positivo")
+    
+    Config.LOAD_BALANCER_PORT = args.port
+    process = None
+    workdir = None
+    if args.start_cluster:
+        from benchmark import start_cluster
+        workdir = tempfile.TemporaryDirectory()
+        process = start_cluster(args.start_cluster, args.port, workdir.name)
+        time.sleep(1)  # Primer health check del balanceador
+    try:
+        if args.suite:
+            results = [run_scenario(args, name, **overrides) for name, overrides in SUITE]
+        else:
+            results = [run_scenario(args)]
+    finally:
+        if process:
+            process.kill()
+            process.wait()
+            workdir.cleanup()
+    
+    if args.json:
+        report = {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import threading
+import framing
+from config import Config
+from data_sync import record_version, encode_sync, decode_sync
+
+def key_digest(key, record):
+    """Digest de 64 bits de una clave con la versión de su registro"""
+    data = f"{key}\0{record_version(record)}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+def pack_hashes(hashes):
+    """Hashes de 64 bits como un solo string hex (16 caracteres cada uno)"""
+    return ''.join(f"{h:016x}" for h in hashes)
+
+def unpack_hashes(packed):
+    """Inverso de pack_hashes"""
+    return [int(packed[i:i + 16], 16) for i in range(0, len(packed), 16)]
+
+class MerkleTree:
+    """Árbol de hashes sobre 2**depth buckets de claves: cada hoja es el XOR de los
+    digests de sus claves y cada nodo el XOR de sus hijos, así un cambio solo
+    recorre el camino hasta la raíz"""
+    
+    def __init__(self, depth):
+        self.depth = depth
+        self.leaves = 1 << depth
+        self.nodes = [0] * (2 * self.leaves)  # nodes[1] es la raíz; los hijos de i son 2i y 2i+1
+        self.buckets = {}  # hoja -> claves
+    
+    def leaf_of(self, key):
+        """Hoja donde cae una clave (no depende de la versión)"""
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=4).digest()
+        return int.from_bytes(digest, 'big') >> (32 - self.depth)
+    
+    def _toggle(self, leaf, digest):
+        """Agrega o quita un digest (XOR) en la hoja y sus ancestros"""
+        index = leaf + self.leaves
+        while index:
+            self.nodes[index] ^= digest
+            index >>= 1
+    
+    def add(self, key, digest):
+        """Agrega una clave con su digest"""
+        leaf = self.leaf_of(key)
+        self.buckets.setdefault(leaf, set()).add(key)
+        self._toggle(leaf, digest)
+    
+    def remove(self, key, digest):
+        """Quita una clave con el digest que tenía"""
+        leaf = self.leaf_of(key)
+        self.buckets.get(leaf, set()).discard(key)
+        self._toggle(leaf, digest)
+
+class MerkleIndex:
+    """Un árbol por conjunto de réplicas del anillo: dos peers comparan solo las
+    claves que ambos deben tener y bajan por los subárboles distintos"""
+    
+    def __init__(self, server, depth=None):
+        self.server = server
+        self.depth = depth or Config.MERKLE_DEPTH
+        self.trees = {}  # "puerto,puerto" -> MerkleTree
+        self.lock = threading.Lock()  # Los escritores de distintos stripes actualizan los mismos nodos
+        self.metrics = {'repairs': 0, 'keys_repaired': 0, 'bytes_exchanged': 0}
+        for key, record in server.data.items():
+            self.update(key, None, record)
+    
+    def _tree_name(self, key):
+        """Nombre del conjunto de réplicas de la clave, o None si este servidor no es réplica"""
+        owners = sorted(self.server.ring.get_nodes(key))
+        if self.server.port not in owners:
+            return None
+        return ','.join(str(port) for port in owners)
+    
+    def _tree(self, name):
+        """Árbol de un conjunto de réplicas (vacío si todavía no tiene claves)"""
+        tree = self.trees.get(name)
+        if tree is None:
+            tree = self.trees[name] = MerkleTree(self.depth)
+        return tree
+    
+    def update(self, key, old_record, new_record):
+        """Refleja el cambio de una clave (llamar con el lock del stripe de la clave tomado)"""
+        name = self._tree_name(key)
+        if name is None:
+            return
+        new_digest = key_digest(key, new_record)
+        old_digest = key_digest(key, old_record) if old_record else None
+        with self.lock:
+            tree = self._tree(name)
+            if old_digest is not None:
+                tree.remove(key, old_digest)
+            tree.add(key, new_digest)
+    
+    def roots_for(self, peer):
+        """Raíces de los árboles compartidos con un peer"""
+        with self.lock:
+            return {name: tree.nodes[1] for name, tree in self.trees.items()
+                    if str(peer) in name.split(',')}
+    
+    def node_hashes(self, name, nodes):
+        """Hashes de los nodos pedidos, en el mismo orden"""
+        with self.lock:
+            tree = self._tree(name)
+            return [tree.nodes[index] for index in nodes]
+    
+    def leaf_digests(self, name, leaves):
+        """Digests (hex) de las claves de las hojas pedidas"""
+        with self.lock:
+            tree = self._tree(name)
+            keys = [key for leaf in leaves for key in tree.buckets.get(leaf, ())]
+        return {key: f"{key_digest(key, self.server.data[key]):016x}" for key in keys if key in self.server.data}
+    
+    def handle_request(self, request):
+        """Responde MERKLE_ROOTS, MERKLE_NODES y MERKLE_KEYS de un peer"""
+        action = request.get('action')
+        if action == 'MERKLE_ROOTS':
+            return {'roots': self.roots_for(request.get('peer'))}
+        if action == 'MERKLE_NODES':
+            return {'hashes': pack_hashes(self.node_hashes(request.get('replicas'), request.get('nodes') or []))}
+        return {'digests': self.leaf_digests(request.get('replicas'), request.get('leaves') or [])}
+    
+    def _call(self, s, request):
+        """Request/respuesta JSON con framing"""
+        return json.loads(self._call_raw(s, json.dumps(request).encode('utf-8')))
+    
+    def _call_raw(self, s, payload):
+        """Envía un frame y retorna la respuesta cruda, contando los bytes de ambos lados"""
+        framing.send_frame(s, payload)
+        frame = framing.recv_frame(s)
+        if frame is None:
+            raise ConnectionError('El peer cerró la conexión durante el anti-entropy')
+        self.metrics['bytes_exchanged'] += len(payload) + len(frame[1])
+        return frame[1]
+    
+    def repair(self, peer):
+        """Compara los árboles compartidos con el peer y repara solo las claves distintas; retorna cuántas"""
+        repaired = 0
+        with framing.open_framed_connection(peer, Config.BACKEND_REQUEST_TIMEOUT) as s:
+            remote_roots = self._call(s, {'action': 'MERKLE_ROOTS', 'peer': self.server.port})['roots']
+            local_roots = self.roots_for(peer)
+            for name in set(remote_roots) | set(local_roots):
+                if remote_roots.get(name, 0) != local_roots.get(name, 0):
+                    repaired += self._repair_tree(s, peer, name, remote_roots.get(name, 0))
+        self.metrics['repairs'] += 1
+        self.metrics['keys_repaired'] += repaired
+        return repaired
+    
+    def _repair_tree(self, s, peer, name, remote_root):
+        """Baja nivel por nivel por los nodos distintos y sincroniza las claves de las hojas distintas"""
+        tree = self._tree(name)
+        differing = {1: remote_root}  # nodo distinto -> hash del peer
+        for _ in range(self.depth):
+            parents = sorted(differing)
+            # Basta pedir el hijo izquierdo: el derecho es el XOR del padre con el izquierdo
+            request = {'action': 'MERKLE_NODES', 'replicas': name, 'nodes': [2 * p for p in parents]}
+            lefts = unpack_hashes(self._call(s, request)['hashes'])
+            local = self.node_hashes(name, [child for p in parents for child in (2 * p, 2 * p + 1)])
+            children = {}
+            for i, parent in enumerate(parents):
+                left, right = lefts[i], differing[parent] ^ lefts[i]
+                if left != local[2 * i]:
+                    children[2 * parent] = left
+                if right != local[2 * i + 1]:
+                    children[2 * parent + 1] = right
+            differing = children
+            if not differing:
+                return 0
+        
+        leaves = [index - tree.leaves for index in differing]
+        remote = self._call(s, {'action': 'MERKLE_KEYS', 'replicas': name, 'leaves': leaves})['digests']
+        local = self.leaf_digests(name, leaves)
+        keys = [key for key in set(remote) | set(local) if remote.get(key) != local.get(key)]
+        
+        # Traer la versión del peer; merge por versión, gana la más nueva
+        pull = [key for key in keys if key in remote]
+        if pull:
+            request = json.dumps({'action': 'SYNC_FETCH', 'keys': pull}).encode('utf-8')
+            _, clock, records = decode_sync(self._call_raw(s, request))
+            self.server._sync_data(records, peer, clock)
+        
+        # Enviar la propia si sigue siendo distinta; el peer también se queda con la más nueva
+        push = {key: self.server.data[key] for key in keys
+                if key in self.server.data and f"{key_digest(key, self.server.data[key]):016x}" != remote.get(key)}
+        if push:
+            self._call_raw(s, encode_sync(push, self.server.port, self.server.data_sync.clock.now()))
+        return len(keys)
\ No newline at end of file
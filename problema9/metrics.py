@@ -0,0 +1,225 @@
+import collections
+import socket
+import threading
+import time
+from config import Config
+
+class Histogram:
+    """Histograma log-lineal estilo HDR de latencias en ns: cada potencia de 2 se divide en
+    2**sub_bits buckets, con error relativo acotado (1/16 con 4 bits) desde ns hasta horas.
+    Registrar es un append atómico sin lock; flush() pasa lo registrado a los buckets"""
+    
+    def __init__(self, sub_bits=None):
+        self.sub_bits = sub_bits or Config.METRICS_HISTOGRAM_SUB_BITS
+        self.exact = 2 << self.sub_bits  # Valores menores se cuentan sin redondear
+        self.counts = [0] * (64 << self.sub_bits)
+        self.pending = collections.deque()  # Latencias registradas todavía sin agregar
+        self.failed = collections.deque()   # Ídem, de requests respondidos con error
+        self.lock = threading.Lock()  # Agregación y lectura de los buckets
+        self.count = 0
+        self.errors = 0
+        self.total = 0  # ns
+        self.max = 0
+    
+    def record(self, value, error=False):
+        """Registra una latencia en ns (deque.append es atómico: no hace falta lock)"""
+        (self.failed if error else self.pending).append(value)
+    
+    def flush(self):
+        """Agrega a los buckets las latencias registradas desde el último flush"""
+        with self.lock:
+            self._drain(self.pending)
+            self.errors += self._drain(self.failed)
+    
+    def _drain(self, values):
+        """Vacía una cola de latencias en los buckets; retorna cuántas había"""
+        drained = 0
+        while values:
+            value = values.popleft()
+            if value < self.exact:
+                index = max(value, 0)
+            else:
+                shift = value.bit_length() - self.sub_bits - 1
+                index = (shift << self.sub_bits) + (value >> shift)
+            self.counts[index] += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+            drained += 1
+        self.count += drained
+        return drained
+    
+    def _upper_bound(self, index):
+        """Mayor valor que cae en un bucket"""
+        if index < self.exact:
+            return index
+        shift = (index >> self.sub_bits) - 1
+        top = index - (shift << self.sub_bits)
+        return ((top + 1) << shift) - 1
+    
+    def percentiles(self, fractions):
+        """Percentiles (cota superior del bucket, en ns) con una sola pasada por los buckets"""
+        self.flush()
+        with self.lock:
+            counts = list(self.counts)
+            count, top = self.count, self.max
+        results = []
+        seen = 0
+        index = 0
+        for fraction in sorted(fractions):
+            target = max(1, int(fraction * count + 0.5))
+            while index < len(counts) and seen + counts[index] < target:
+                seen += counts[index]
+                index += 1
+            results.append(min(self._upper_bound(index), top) if count else 0)
+        return results
+    
+    def snapshot(self):
+        """Conteos, media y percentiles en ms"""
+        p50, p90, p99, p999 = self.percentiles((0.5, 0.9, 0.99, 0.999))
+        with self.lock:
+            count, errors, total, top = self.count, self.errors, self.total, self.max
+        return {
+            'count': count,
+            'errors': errors,
+            'mean_ms': round(total / count / 1e6, 3) if count else 0,
+            'p50_ms': round(p50 / 1e6, 3),
+            'p90_ms': round(p90 / 1e6, 3),
+            'p99_ms': round(p99 / 1e6, 3),
+            'p999_ms': round(p999 / 1e6, 3),
+            'max_ms': round(top / 1e6, 3)
+        }
+
+class Metrics:
+    """Métricas de un componente: un histograma por acción (las desconocidas van a OTHER para
+    no crear uno por cada nombre que mande un cliente) y gauges que se leen al consultarlas"""
+    
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+    
+    def __init__(self, component, actions, labels=None):
+        self.component = component
+        self.labels = labels or {}
+        self.started = time.time()
+        self.histograms = {action: Histogram() for action in list(actions) + ['OTHER']}
+        self.other = self.histograms['OTHER']
+        self.gauges = {}  # nombre -> (descripción, etiqueta, función que retorna {valor de la etiqueta: valor})
+    
+    def start(self):
+        """Agrega los histogramas periódicamente en un hilo aparte, fuera del camino de los requests"""
+        thread = threading.Thread(target=self._flush_loop)
+        thread.daemon = True
+        thread.start()
+    
+    def _flush_loop(self):
+        """Loop de agregación: acota la memoria de lo registrado entre consultas"""
+        while True:
+            time.sleep(Config.METRICS_FLUSH_INTERVAL)
+            for histogram in self.histograms.values():
+                histogram.flush()
+    
+    def observe(self, action, started, error=False):
+        """Registra un request de la acción que empezó en started (time.perf_counter_ns())"""
+        histogram = self.histograms.get(action, self.other) if isinstance(action, str) else self.other
+        # Histogram.record en línea: es el camino de cada request
+        (histogram.failed if error else histogram.pending).append(time.perf_counter_ns() - started)
+    
+    def gauge(self, name, description, label, read):
+        """Registra un gauge; con etiqueta (p. ej. un valor por backend) read() retorna {valor de la etiqueta: valor}"""
+        self.gauges[name] = (description, label, read)
+    
+    def snapshot(self):
+        """Métricas como dict (acción STATS)"""
+        uptime = time.time() - self.started
+        actions = {}
+        for action, histogram in self.histograms.items():
+            stats = histogram.snapshot()
+            if stats['count']:
+                stats['rate_per_s'] = round(stats['count'] / uptime, 1) if uptime else 0
+                actions[action] = stats
+        return {
+            'component': self.component,
+            'labels': self.labels,
+            'uptime_s': round(uptime, 1),
+            'actions': actions,
+            'gauges': {name: read() for name, (_, _, read) in self.gauges.items()}
+        }
+    
+    def render_text(self):
+        """Métricas en el formato de texto de Prometheus (puerto de scrape)"""
+        prefix = f'problema9_{self.component}'
+        base = ''.join(f'{name}="{value}",' for name, value in self.labels.items())
+        lines = [
+            f'# HELP {prefix}_requests_total Requests atendidos por acción',
+            f'# TYPE {prefix}_requests_total counter'
+        ]
+        summaries = []
+        for action, histogram in self.histograms.items():
+            histogram.flush()
+            with histogram.lock:
+                count, errors, total = histogram.count, histogram.errors, histogram.total
+            labels = f'{base}action="{action}"'
+            lines.append(f'{prefix}_requests_total{{{labels}}} {count}')
+            summaries.append((labels, histogram, count, errors, total))
+        lines.append(f'# HELP {prefix}_request_errors_total Requests respondidos con error por acción')
+        lines.append(f'# TYPE {prefix}_request_errors_total counter')
+        for labels, _, _, errors, _ in summaries:
+            lines.append(f'{prefix}_request_errors_total{{{labels}}} {errors}')
+        lines.append(f'# HELP {prefix}_request_duration_seconds Latencia por acción (histograma HDR)')
+        lines.append(f'# TYPE {prefix}_request_duration_seconds summary')
+        for labels, histogram, count, _, total in summaries:
+            for quantile, value in zip(self.QUANTILES, histogram.percentiles(self.QUANTILES)):
+                lines.append(f'{prefix}_request_duration_seconds{{{labels},quantile="{quantile}"}} {value / 1e9:.9f}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{{{labels}}} {total / 1e9:.9f}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{{labels}}} {count}')
+        for name, (description, label, read) in self.gauges.items():
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            if label is None:
+                lines.append(f'{prefix}_{name}{{{base.rstrip(",")}}} {read()}')
+                continue
+            for label_value, value in read().items():
+                lines.append(f'{prefix}_{name}{{{base}{label}="{label_value}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+class MetricsServer:
+    """Puerto de scrape: a cada conexión le responde las métricas en texto plano
+    (con encabezado HTTP, sirve también para curl y Prometheus)"""
+    
+    def __init__(self, metrics, port):
+        self.metrics = metrics
+        self.port = port
+    
+    def start(self):
+        """Atiende el puerto en un hilo aparte"""
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+    
+    def _serve(self):
+        """Acepta conexiones y responde de a una: un scrape es barato y poco frecuente"""
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                s.bind(('localhost', self.port))
+                s.listen(Config.LISTEN_BACKLOG)
+                while True:
+                    conn, addr = s.accept()
+                    self._respond(conn)
+        except OSError as e:
+            print(f"Error en el puerto de métricas {self.port}: {e}")
+    
+    def _respond(self, conn):
+        """Envía las métricas y cierra la conexión"""
+        try:
+            conn.settimeout(1)
+            try:
+                conn.recv(4096)  # El request (si es HTTP) no importa: siempre son las métricas
+            except socket.timeout:
+                pass
+            body = self.metrics.render_text().encode('utf-8')
+            conn.sendall(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         + f'Content-Length: {len(body)}\r\n\r\n'.encode('utf-8') + body)
+        except OSError:
+            pass
+        finally:
+            conn.close()
\ No newline at end of file
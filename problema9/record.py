@@ -0,0 +1,127 @@
+import json
+import struct
+import sys
+import zlib
+from datetime import datetime
+
+# crc32 (de lo que sigue), versión, timestamp ns, tipo de valor y largos de clave, server_id y valor
+ENTRY_HEADER = struct.Struct('!IQqBHHI')
+VALUE_STR = 0
+VALUE_JSON = 1
+MAX_TEXT_BYTES = 0xFFFF  # Largo de la clave y del server_id en ENTRY_HEADER (H)
+# El del valor (I) no se valida: un request no pasa de framing.MAX_FRAME_SIZE
+
+class Record:
+    """Registro inmutable de una clave: valor, instante de escritura en ns, servidor que lo
+    escribió (interned, uno solo por servidor en memoria) y versión HLC. Con __slots__ y
+    enteros ocupa menos de la mitad que el dict con el timestamp como string ISO"""
+    
+    __slots__ = ('value', 'timestamp', 'server_id', 'version')
+    
+    def __init__(self, value, timestamp, server_id, version=0):
+        self.value = value
+        self.timestamp = timestamp  # ns desde epoch
+        self.server_id = sys.intern(server_id)
+        self.version = version
+    
+    def order(self):
+        """Orden de última escritura gana: versión HLC, luego timestamp (registros viejos) y server_id"""
+        return (self.version, self.timestamp, self.server_id)
+    
+    def to_dict(self):
+        """Forma JSON del registro, la que ven los clientes"""
+        return {
+            'value': self.value,
+            'timestamp': datetime.fromtimestamp(self.timestamp / 1e9).isoformat(),
+            'server_id': self.server_id,
+            'version': self.version
+        }
+    
+    @classmethod
+    def from_dict(cls, record):
+        """Registro desde su forma JSON (snapshots y logs del formato anterior)"""
+        timestamp = record.get('timestamp') or 0
+        if isinstance(timestamp, str):
+            timestamp = round(datetime.fromisoformat(timestamp).timestamp() * 1e9)
+        return cls(record.get('value'), timestamp, record.get('server_id', ''), record.get('version', 0))
+
+def key_error(key):
+    """Motivo por el que una clave no sirve, o None. Solo strings: en disco la clave es texto, así que
+    1, 1.0, True o null serían otra clave después de reiniciar (y en memoria 1, 1.0 y True chocan)"""
+    if not isinstance(key, str):
+        return 'La clave debe ser un string'
+    return _text_error(key, 'La clave')
+
+def value_error(value):
+    """Motivo por el que un valor no se puede guardar, o None (un string con surrogates sueltos no pasa a UTF-8)"""
+    if isinstance(value, str):
+        try:
+            value.encode('utf-8')
+        except UnicodeEncodeError:
+            return 'El valor tiene caracteres que no se pueden codificar en UTF-8'
+    return None
+
+def entry_error(key, record):
+    """Motivo por el que (clave, Record) no entra en una entrada binaria, o None"""
+    return key_error(key) or value_error(record.value) or _text_error(record.server_id, 'El server_id')
+
+def _text_error(text, name):
+    """Motivo por el que un texto no entra en un campo de largo H, o None"""
+    try:
+        size = len(text.encode('utf-8'))
+    except UnicodeEncodeError:
+        return f'{name} tiene caracteres que no se pueden codificar en UTF-8'
+    if size > MAX_TEXT_BYTES:
+        return f'{name} supera los {MAX_TEXT_BYTES} bytes'
+    return None
+
+def request_error(action, request):
+    """Motivo por el que las claves o valores de un request no sirven, o None; se valida antes de
+    tocar el cache o el almacenamiento, porque lo que no entra en una entrada binaria no llega al log"""
+    if action == 'GET':
+        return key_error(request.get('key'))
+    if action == 'SET':
+        return key_error(request.get('key')) or value_error(request.get('value'))
+    if action == 'MGET':
+        keys = request.get('keys') or []
+        if not isinstance(keys, list):
+            return 'keys debe ser una lista'
+        return next((error for error in map(key_error, keys) if error), None)
+    if action == 'MSET':
+        items = request.get('items') or {}
+        if not isinstance(items, dict):
+            return 'items debe ser un objeto'
+        return next((error for error in (key_error(key) or value_error(value) for key, value in items.items())
+                     if error), None)
+    return None
+
+def encode_entry(key, record):
+    """(clave, Record) en binario con crc32, para logs, snapshots y sincronización"""
+    if isinstance(record.value, str):
+        kind, value = VALUE_STR, record.value.encode('utf-8')
+    else:
+        kind, value = VALUE_JSON, json.dumps(record.value).encode('utf-8')
+    key = str(key).encode('utf-8')
+    server_id = record.server_id.encode('utf-8')
+    body = struct.pack('!QqBHHI', record.version, record.timestamp, kind, len(key), len(server_id), len(value))
+    body += key + server_id + value
+    return struct.pack('!I', zlib.crc32(body)) + body
+
+def decode_entries(buffer, offset=0):
+    """Genera (clave, Record, fin) hasta el final o hasta una entrada incompleta o corrupta"""
+    view = memoryview(buffer)
+    size = len(buffer)
+    while offset + ENTRY_HEADER.size <= size:
+        crc, version, timestamp, kind, key_size, server_id_size, value_size = ENTRY_HEADER.unpack_from(buffer, offset)
+        start = offset + ENTRY_HEADER.size
+        end = start + key_size + server_id_size + value_size
+        if end > size or zlib.crc32(view[offset + 4:end]) != crc:
+            return
+        key = str(view[start:start + key_size], 'utf-8')
+        start += key_size
+        server_id = str(view[start:start + server_id_size], 'utf-8')
+        value = str(view[start + server_id_size:end], 'utf-8')
+        if kind == VALUE_JSON:
+            value = json.loads(value)
+        yield key, Record(value, timestamp, server_id, version), end
+        offset = end
\ No newline at end of file
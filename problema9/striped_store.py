@@ -0,0 +1,74 @@
+import threading
+from config import Config
+
+class StripedStore:
+    """Almacenamiento repartido en stripes elegidos por hash de la clave, cada uno
+    con su lock. Los registros nunca se modifican, se reemplazan: las lecturas no
+    toman locks y los escritores solo bloquean los stripes de sus claves"""
+    
+    def __init__(self, data=None, stripes=None):
+        self.count = stripes or Config.STORE_STRIPES
+        self.stripes = [{} for _ in range(self.count)]
+        self.locks = [threading.Lock() for _ in range(self.count)]
+        for key, record in (data or {}).items():
+            self.stripes[self.index(key)][key] = record
+    
+    def index(self, key):
+        """Stripe de una clave"""
+        return hash(key) % self.count
+    
+    def lock_for(self, key):
+        """Lock del stripe de una clave"""
+        return self.locks[self.index(key)]
+    
+    def partition(self, keys):
+        """Agrupa claves por stripe: stripe -> lista de claves"""
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.index(key), []).append(key)
+        return groups
+    
+    def get(self, key, default=None):
+        """Registro de una clave sin tomar locks"""
+        return self.stripes[self.index(key)].get(key, default)
+    
+    def __getitem__(self, key):
+        """Registro de una clave sin tomar locks (KeyError si no existe)"""
+        return self.stripes[self.index(key)][key]
+    
+    def __setitem__(self, key, record):
+        """Reemplaza el registro (llamar con el lock del stripe tomado)"""
+        self.stripes[self.index(key)][key] = record
+    
+    def __contains__(self, key):
+        """Si la clave existe"""
+        return key in self.stripes[self.index(key)]
+    
+    def __len__(self):
+        """Cantidad de claves"""
+        return sum(len(stripe) for stripe in self.stripes)
+    
+    def __iter__(self):
+        """Claves de todos los stripes"""
+        for key, _ in self.items():
+            yield key
+    
+    def items(self):
+        """(clave, registro) de todos los stripes, copiando uno a la vez"""
+        for i, stripe in enumerate(self.stripes):
+            with self.locks[i]:
+                items = list(stripe.items())
+            yield from items
+    
+    def values(self):
+        """Registros de todos los stripes"""
+        for _, record in self.items():
+            yield record
+    
+    def copy(self):
+        """Copia superficial como dict; cada stripe se bloquea solo mientras se copia"""
+        data = {}
+        for i, stripe in enumerate(self.stripes):
+            with self.locks[i]:
+                data.update(stripe)
+        return data
\ No newline at end of file
@@ -0,0 +1,102 @@
+import os
+import shutil
+import threading
+import time
+from config import Config
+from record import encode_entry
+
+class WriteAheadLog:
+    """Log append-only de escrituras con group commit: un solo fsync cubre
+    todas las escrituras que llegaron mientras se hacía el anterior"""
+    
+    def __init__(self, server_id, group_commit_interval=None, sync_writes=None):
+        self.path = Config.wal_path(server_id)
+        self.group_commit_interval = (Config.WAL_GROUP_COMMIT_INTERVAL
+                                      if group_commit_interval is None else group_commit_interval)
+        self.sync_writes = Config.WAL_SYNC_WRITES if sync_writes is None else sync_writes
+        self.file = open(self.path, 'ab')
+        self.lock = threading.Lock()        # Protege el archivo y last_seq
+        self.fsync_lock = threading.Lock()  # Un solo fsync a la vez; rotate() espera al que esté en curso
+        self.durable = threading.Condition()
+        self.pending = threading.Event()    # Hay escrituras sin fsync
+        self.last_seq = 0     # Última escritura agregada
+        self.flushed_seq = 0  # Última escritura cubierta por un fsync
+        self.entries = 0      # Entradas desde el último snapshot
+        self.metrics = {'appends': 0, 'fsyncs': 0}
+        self.flush_thread = threading.Thread(target=self._flush_loop)
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+    
+    def append(self, entries):
+        """Agrega (clave, Record) al log; retorna el número de secuencia a pasar a wait()"""
+        data = b''.join(encode_entry(key, record) for key, record in entries)
+        with self.lock:
+            self.file.write(data)
+            self.last_seq += 1
+            self.entries += len(entries)
+            self.metrics['appends'] += 1
+            seq = self.last_seq
+        self.pending.set()
+        return seq
+    
+    def wait(self, seq=None):
+        """Espera a que un fsync cubra seq (por defecto, todo lo agregado hasta ahora)"""
+        if not self.sync_writes:
+            return
+        if seq is None:
+            seq = self.last_seq
+        with self.durable:
+            self.durable.wait_for(lambda: self.flushed_seq >= seq)
+    
+    def _flush_loop(self):
+        """Hilo de group commit: vacía el buffer y hace fsync de todo lo acumulado"""
+        while True:
+            self.pending.wait()
+            if self.group_commit_interval:
+                time.sleep(self.group_commit_interval)
+            self.pending.clear()
+            with self.fsync_lock:
+                with self.lock:
+                    seq = self.last_seq
+                    self.file.flush()
+                # Los escritores siguen agregando al buffer durante el fsync
+                try:
+                    os.fsync(self.file.fileno())
+                except OSError as e:
+                    print(f"Error en fsync del log {self.path}: {e}")
+                self.metrics['fsyncs'] += 1
+            self._mark_durable(seq)
+    
+    def _mark_durable(self, seq):
+        """Libera a los que esperan escrituras hasta seq"""
+        with self.durable:
+            if seq > self.flushed_seq:
+                self.flushed_seq = seq
+                self.durable.notify_all()
+    
+    def rotate(self):
+        """Pasa el log actual a .old y empieza uno vacío; se llama justo antes de copiar los datos para el snapshot"""
+        with self.fsync_lock:
+            with self.lock:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                old_path = self.path + '.old'
+                if os.path.exists(old_path):
+                    # Un snapshot anterior falló: su log todavía hace falta
+                    with open(old_path, 'ab') as dst, open(self.path, 'rb') as src:
+                        shutil.copyfileobj(src, dst)
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, old_path)
+                self.file = open(self.path, 'ab')
+                self.entries = 0
+                seq = self.last_seq
+        self._mark_durable(seq)
+    
+    def discard_rotated(self):
+        """Borra el log .old una vez que el snapshot que lo cubre está en disco"""
+        try:
+            os.remove(self.path + '.old')
+        except FileNotFoundError:
+            pass
\ No newline at end of file